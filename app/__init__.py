@@ -10,6 +10,10 @@ def create_app():
     # Load environment variables
     load_dotenv()
     app.secret_key = os.getenv('SECRET_KEY')
+
+    # Create the activity store's tables up front instead of on every connection
+    from app.models.activities import init_db
+    init_db()
     
     # Register blueprints
     from app.routes.auth import auth_bp
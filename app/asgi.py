@@ -0,0 +1,272 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from http.cookies import SimpleCookie
+from tempfile import SpooledTemporaryFile
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+from app import create_app
+from app.services.chat import (async_classify_query, async_get_greeting_response, async_query_openai,
+                               async_cached_response, async_cached_stream, async_stream_openai,
+                               create_greeting_prompt, create_prompt, summarize_training, activity_fingerprint,
+                               known_classification, response_key, BUSY_ERROR)
+from app.services.llm import LLMOverloaded, llm_gateway
+from app.services.strava import async_get_raw_activities, process_activities
+
+# ASGI entry point: `uvicorn app.asgi:app`. POST /api/chat and /api/chat/stream run on
+# the event loop so a single process can hold hundreds of in-flight chats; every other
+# route is served by the regular Flask app through a WSGI adapter.
+
+# Worker threads for the Flask routes
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "32"))
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix="wsgi")
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    """asgiref runs WSGI apps thread-sensitive, i.e. every request on one shared thread.
+    Flask doesn't need that, so requests run side by side on wsgi_executor instead;
+    only asgiref's environ and start_response handling is reused."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError("WSGI wrapper received a non-HTTP scope")
+        self.scope = scope
+        loop = asyncio.get_running_loop()
+
+        # Called from the worker thread; returns once the event loop has sent the message
+        def sync_send(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        with SpooledTemporaryFile(max_size=65536) as body:
+            while True:
+                message = await receive()
+                if message["type"] != "http.request":
+                    raise ValueError("WSGI wrapper received a non-HTTP-request message")
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            await loop.run_in_executor(wsgi_executor, self.serve, body, sync_send)
+
+    def serve(self, body, sync_send):
+        output = self.wsgi_application(self.build_environ(self.scope, body), self.start_response)
+        try:
+            for chunk in output:
+                if not self.response_started:
+                    self.response_started = True
+                    sync_send(self.response_start)
+                if chunk:
+                    sync_send({"type": "http.response.body", "body": chunk, "more_body": True})
+        finally:
+            # Runs the response's call_on_close callbacks
+            if hasattr(output, "close"):
+                output.close()
+        if not self.response_started:
+            self.response_started = True
+            sync_send(self.response_start)
+        sync_send({"type": "http.response.body"})
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application)(scope, receive, send)
+
+
+flask_app = create_app()
+wsgi_app = ThreadedWsgiToAsgi(flask_app)
+
+
+def load_session(scope):
+    """Decode Flask's signed session cookie from the request headers."""
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if serializer is None:
+        return {}
+
+    cookie = SimpleCookie()
+    for name, value in scope.get("headers", []):
+        if name == b"cookie":
+            cookie.load(value.decode("latin-1"))
+
+    morsel = cookie.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if morsel is None:
+        return {}
+    try:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        return serializer.loads(morsel.value, max_age=max_age)
+    except Exception:
+        return {}
+
+
+async def read_json(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        return {}
+
+
+async def send_json(send, payload, status=200, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_overloaded(send, error):
+    retry_after = str(int(error.retry_after)).encode()
+    await send_json(send, {"response": BUSY_ERROR}, error.status_code, [(b"retry-after", retry_after)])
+
+
+async def load_chat_context(access_token, athlete_id):
+    raw_activities = await async_get_raw_activities(access_token, athlete_id)
+    return process_activities(raw_activities), summarize_training(raw_activities)
+
+
+def prefetch_chat_context(user_input, access_token, athlete_id):
+    """Task loading activities during classification; None if the query clearly doesn't need them."""
+    if known_classification(user_input) in ("greeting", "irrelevant"):
+        return None
+    return asyncio.ensure_future(load_chat_context(access_token, athlete_id))
+
+
+async def chat_context(context_task, access_token, athlete_id):
+    return await (context_task or load_chat_context(access_token, athlete_id))
+
+
+async def chat(scope, receive, send):
+    data = await read_json(receive)
+    session = load_session(scope)
+
+    user_input = data.get("message", "").strip()
+    access_token = session.get("access_token") or data.get("access_token")
+
+    if not access_token:
+        return await send_json(send, {"response": "Authorization error: No valid Strava access token found. Please log in again."}, 401)
+
+    # Load activities while the query is being classified; dropped for greetings
+    athlete_id = session.get("athlete_id")
+    context_task = prefetch_chat_context(user_input, access_token, athlete_id)
+
+    try:
+        classification = await async_classify_query(user_input)
+
+        if classification == "greeting":
+            key = response_key("greeting", user_input)
+            response = await async_cached_response(key, lambda: async_get_greeting_response(user_input))
+            return await send_json(send, {"response": response})
+
+        if classification == "irrelevant":
+            return await send_json(send, {"response": "I'm sorry, I can only help with sports-related queries like running, cycling, or training advice."})
+
+        if classification == "relevant":
+            processed_activities_csv, summary = await chat_context(context_task, access_token, athlete_id)
+            key = response_key("answer", user_input, athlete_id, activity_fingerprint(processed_activities_csv, summary))
+            response = await async_cached_response(
+                key, lambda: async_query_openai(create_prompt(processed_activities_csv, user_input, summary), max_tokens=600)
+            )
+            return await send_json(send, {"response": response})
+
+        return await send_json(send, {"response": "Sorry, I couldn't process your query. Please try again."})
+    except LLMOverloaded as e:
+        return await send_overloaded(send, e)
+    finally:
+        if context_task and not context_task.done():
+            context_task.cancel()
+
+
+async def chat_stream(scope, receive, send):
+    """POST /api/chat/stream: the answer as Server-Sent Events, one JSON-encoded token each."""
+    data = await read_json(receive)
+    session = load_session(scope)
+
+    user_input = data.get("message", "").strip()
+    access_token = session.get("access_token") or data.get("access_token")
+
+    if not access_token:
+        return await send_json(send, {"response": "Authorization error: No valid Strava access token found. Please log in again."}, 401)
+
+    # An SSE response can't change its status once it has started, so reject up front
+    try:
+        llm_gateway.check()
+    except LLMOverloaded as e:
+        return await send_overloaded(send, e)
+
+    athlete_id = session.get("athlete_id")
+    context_task = prefetch_chat_context(user_input, access_token, athlete_id)
+
+    async def answer_tokens():
+        classification = await async_classify_query(user_input)
+
+        if classification == "greeting":
+            tokens = async_cached_stream(
+                response_key("greeting", user_input),
+                lambda: async_stream_openai(create_greeting_prompt(user_input), max_tokens=50, stage="greeting")
+            )
+        elif classification == "relevant":
+            processed_activities_csv, summary = await chat_context(context_task, access_token, athlete_id)
+            key = response_key("answer", user_input, athlete_id, activity_fingerprint(processed_activities_csv, summary))
+            tokens = async_cached_stream(
+                key, lambda: async_stream_openai(create_prompt(processed_activities_csv, user_input, summary), max_tokens=600)
+            )
+        else:
+            if classification == "irrelevant":
+                yield "I'm sorry, I can only help with sports-related queries like running, cycling, or training advice."
+            else:
+                yield "Sorry, I couldn't process your query. Please try again."
+            return
+
+        async for token in tokens:
+            yield token
+
+    async def send_event(event):
+        await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),  # Don't let proxies buffer the stream
+        ]
+    })
+    try:
+        try:
+            async for token in answer_tokens():
+                await send_event(f"data: {json.dumps({'token': token})}\n\n")
+        except LLMOverloaded:
+            await send_event(f"data: {json.dumps({'token': BUSY_ERROR})}\n\n")
+        await send_event("event: done\ndata: {}\n\n")
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if context_task and not context_task.done():
+            context_task.cancel()
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "http" and scope["method"] == "POST":
+        if scope["path"] == "/api/chat":
+            return await chat(scope, receive, send)
+        if scope["path"] == "/api/chat/stream":
+            return await chat_stream(scope, receive, send)
+
+    return await wsgi_app(scope, receive, send)
@@ -0,0 +1,562 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+from app.services.geo import decode_polyline, geohash, geohash_cells, haversine, route_crosses_box
+
+# Location of the local activity store (one SQLite file shared by all athletes)
+DB_PATH = os.getenv('ACTIVITY_DB_PATH', os.path.join('instance', 'activities.db'))
+
+# Route bounding boxes are stored in polyline precision (1e-5 degrees) as integers
+E5 = 100000
+
+# Set once the tables exist, so connections after the first skip the schema setup
+schema_ready = False
+schema_lock = threading.Lock()
+
+# Function 1: Open a connection to the activity store
+
+def get_connection():
+    if not schema_ready:
+        init_db()
+    return connect()
+
+
+def connect():
+    directory = os.path.dirname(DB_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+# Function 1b: Create the store's tables and indexes (once per process, from create_app)
+
+def init_db():
+    global schema_ready
+    with schema_lock:
+        if schema_ready:
+            return
+
+        conn = connect()
+        try:
+            create_schema(conn)
+        finally:
+            conn.close()
+        schema_ready = True
+
+
+def create_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS activities (
+            athlete_id INTEGER NOT NULL,
+            activity_id INTEGER NOT NULL,
+            start_date INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (athlete_id, activity_id)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_activities_start ON activities (athlete_id, start_date)"
+    )
+    # Heart rate streams, stored as packed arrays (empty when the activity has none)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS activity_streams (
+            athlete_id INTEGER NOT NULL,
+            activity_id INTEGER NOT NULL,
+            time BLOB NOT NULL,
+            heartrate BLOB NOT NULL,
+            PRIMARY KEY (athlete_id, activity_id)
+        )
+    """)
+    # Spatial index: geohash of each start point plus an R-tree of route bounding boxes.
+    # Added later, so existing stores are filled once.
+    needs_backfill = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'route_bounds'"
+    ).fetchone() is None
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS activity_places (
+            id INTEGER PRIMARY KEY,
+            athlete_id INTEGER NOT NULL,
+            activity_id INTEGER NOT NULL,
+            start_geohash TEXT,
+            start_lat REAL,
+            start_lng REAL,
+            UNIQUE (athlete_id, activity_id)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_places_geohash ON activity_places (athlete_id, start_geohash)"
+    )
+    # Integer R-tree keyed by activity_places.id. The athlete id is its first dimension, so a
+    # box query only walks that athlete's routes; coordinates are in 1e-5 degree units.
+    conn.execute("DROP TABLE IF EXISTS activity_bounds")  # Float R-tree without the athlete dimension
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS route_bounds USING rtree_i32("
+        "id, min_athlete, max_athlete, min_lat, max_lat, min_lng, max_lng)"
+    )
+    if needs_backfill:
+        with conn:
+            for athlete_id, data in conn.execute("SELECT athlete_id, data FROM activities").fetchall():
+                index_places(conn, athlete_id, [json.loads(data)])
+    # Route fingerprints (MinHash signatures) and their LSH buckets for repeat-route clustering
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS route_fingerprints (
+            athlete_id INTEGER NOT NULL,
+            activity_id INTEGER NOT NULL,
+            cluster_id INTEGER NOT NULL,
+            signature BLOB NOT NULL,
+            PRIMARY KEY (athlete_id, activity_id)
+        )
+    """)
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_cluster ON route_fingerprints (athlete_id, cluster_id, activity_id)"
+    )
+    # Buckets point at clusters, so a popular route doesn't add rows for every repeat
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS route_buckets (
+            athlete_id INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            cluster_id INTEGER NOT NULL,
+            PRIMARY KEY (athlete_id, bucket, cluster_id)
+        ) WITHOUT ROWID
+    """)
+    # Heatmap counts as sparse 256x256 tiles: the pixels (y * 256 + x, sorted uint16) that
+    # routes pass through and how many routes pass through each (uint32)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS heatmap_tiles (
+            athlete_id INTEGER NOT NULL,
+            zoom INTEGER NOT NULL,
+            tile_x INTEGER NOT NULL,
+            tile_y INTEGER NOT NULL,
+            cells BLOB NOT NULL,
+            counts BLOB NOT NULL,
+            max_count INTEGER NOT NULL,
+            PRIMARY KEY (athlete_id, zoom, tile_x, tile_y)
+        ) WITHOUT ROWID
+    """)
+    # Activities whose routes are counted in heatmap_tiles (including ones without a route)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS heatmap_activities (
+            athlete_id INTEGER NOT NULL,
+            activity_id INTEGER NOT NULL,
+            PRIMARY KEY (athlete_id, activity_id)
+        ) WITHOUT ROWID
+    """)
+    # Per-athlete sync bookkeeping: a version bumped whenever activities are saved, and
+    # whether the history before the first sync has been fetched
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            athlete_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            backfilled INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+# Function 2: Convert Strava's UTC start_date to a unix timestamp
+
+def start_date_to_epoch(start_date):
+    parsed = datetime.strptime(start_date, "%Y-%m-%dT%H:%M:%SZ")
+    return int(parsed.replace(tzinfo=timezone.utc).timestamp())
+
+# Function 3: Newest stored start date, used as Strava's `after` parameter
+
+def get_latest_start_date(athlete_id):
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            "SELECT MAX(start_date) FROM activities WHERE athlete_id = ?", (athlete_id,)
+        ).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def get_earliest_start_date(athlete_id):
+    """Oldest stored start date, used as Strava's `before` parameter by the backfill."""
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            "SELECT MIN(start_date) FROM activities WHERE athlete_id = ?", (athlete_id,)
+        ).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+# Function 4: Insert or update raw Strava activities
+
+def save_activities(athlete_id, activities):
+    if not activities:
+        return 0
+
+    rows = [
+        (athlete_id, act['id'], start_date_to_epoch(act['start_date']), json.dumps(act))
+        for act in activities
+    ]
+
+    conn = get_connection()
+    try:
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO activities (athlete_id, activity_id, start_date, data) "
+                "VALUES (?, ?, ?, ?)",
+                rows
+            )
+            index_places(conn, athlete_id, activities)
+            conn.execute(
+                "INSERT INTO sync_state (athlete_id, version) VALUES (?, 1) "
+                "ON CONFLICT (athlete_id) DO UPDATE SET version = version + 1",
+                (athlete_id,)
+            )
+        return len(rows)
+    finally:
+        conn.close()
+
+# Function 5: Read stored activities (most recent first), optionally only after a timestamp
+
+def get_activities(athlete_id, after=None):
+    query = "SELECT data FROM activities WHERE athlete_id = ?"
+    params = [athlete_id]
+    if after is not None:
+        query += " AND start_date > ?"
+        params.append(int(after))
+    query += " ORDER BY start_date DESC"
+
+    conn = get_connection()
+    try:
+        return [json.loads(row[0]) for row in conn.execute(query, params)]
+    finally:
+        conn.close()
+
+# Function 6: Store an activity's heart rate stream (seconds since start, bpm per sample)
+
+def save_stream(athlete_id, activity_id, time, heartrate):
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO activity_streams (athlete_id, activity_id, time, heartrate) "
+                "VALUES (?, ?, ?, ?)",
+                (
+                    athlete_id,
+                    activity_id,
+                    np.asarray(time, dtype=np.int32).tobytes(),
+                    np.asarray(heartrate, dtype=np.int16).tobytes(),
+                )
+            )
+    finally:
+        conn.close()
+
+# Function 7: Read stored heart rate streams for a set of activities
+
+def get_streams(athlete_id, activity_ids):
+    """{activity_id: (time, heartrate)} for the ids that have a stored stream."""
+    activity_ids = [int(activity_id) for activity_id in activity_ids]
+    streams = {}
+
+    conn = get_connection()
+    try:
+        # Stay well below SQLite's limit on query parameters
+        for i in range(0, len(activity_ids), 500):
+            chunk = activity_ids[i:i + 500]
+            rows = conn.execute(
+                "SELECT activity_id, time, heartrate FROM activity_streams "
+                f"WHERE athlete_id = ? AND activity_id IN ({','.join('?' * len(chunk))})",
+                [athlete_id, *chunk]
+            )
+            for activity_id, time, heartrate in rows:
+                streams[activity_id] = (
+                    np.frombuffer(time, dtype=np.int32), np.frombuffer(heartrate, dtype=np.int16)
+                )
+        return streams
+    finally:
+        conn.close()
+
+# Function 8: Read one stored activity (None if it isn't in the store)
+
+def get_activity(athlete_id, activity_id):
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            "SELECT data FROM activities WHERE athlete_id = ? AND activity_id = ?", (athlete_id, activity_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    finally:
+        conn.close()
+
+# Function 9: Add activities to the spatial index (inside the caller's transaction)
+
+def index_places(conn, athlete_id, activities):
+    for act in activities:
+        start_latlng = act.get('start_latlng') or []
+        start = start_latlng if len(start_latlng) == 2 else (None, None)
+        cell = geohash(*start) if start[0] is not None else None
+
+        place_id = conn.execute(
+            "INSERT INTO activity_places (athlete_id, activity_id, start_geohash, start_lat, start_lng) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT (athlete_id, activity_id) DO UPDATE SET "
+            "start_geohash = excluded.start_geohash, start_lat = excluded.start_lat, start_lng = excluded.start_lng "
+            "RETURNING id",
+            (athlete_id, act['id'], cell, start[0], start[1])
+        ).fetchone()[0]
+
+        points = decode_polyline((act.get('map') or {}).get('summary_polyline'))
+        if len(points):
+            # Rounded outwards, so the box always contains the route
+            min_lat, min_lng = np.floor(points.min(axis=0) * E5).astype(int).tolist()
+            max_lat, max_lng = np.ceil(points.max(axis=0) * E5).astype(int).tolist()
+            conn.execute(
+                "INSERT OR REPLACE INTO route_bounds (id, min_athlete, max_athlete, min_lat, max_lat, min_lng, max_lng) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (place_id, athlete_id, athlete_id, min_lat, max_lat, min_lng, max_lng)
+            )
+        else:
+            conn.execute("DELETE FROM route_bounds WHERE id = ?", (place_id,))
+
+# Function 10: Activities that start within radius metres of a point, nearest first
+
+def get_activities_near(athlete_id, lat, lng, radius, limit=50):
+    """[(activity, distance in metres)] using the geohash index on start points."""
+    candidates = []
+    conn = get_connection()
+    try:
+        # Each cell is a range scan on the (athlete_id, start_geohash) index
+        for cell in geohash_cells(lat, lng, radius):
+            candidates += conn.execute(
+                "SELECT p.start_lat, p.start_lng, a.data FROM activity_places p "
+                "JOIN activities a ON a.athlete_id = p.athlete_id AND a.activity_id = p.activity_id "
+                "WHERE p.athlete_id = ? AND p.start_geohash >= ? AND p.start_geohash < ?",
+                (athlete_id, cell, cell + "{")  # '{' sorts right after 'z', the last geohash character
+            ).fetchall()
+    finally:
+        conn.close()
+
+    if not candidates:
+        return []
+    distances = haversine(lat, lng, [row[0] for row in candidates], [row[1] for row in candidates])
+    nearest = [i for i in np.argsort(distances, kind='stable') if distances[i] <= radius][:limit]
+    return [(json.loads(candidates[i][2]), float(distances[i])) for i in nearest]
+
+# Function 11: Activities whose route passes through a box, most recent first
+
+def get_activities_within(athlete_id, south, west, north, east, limit=50):
+    conn = get_connection()
+    try:
+        # The R-tree narrows things down to this athlete's overlapping bounding boxes. CROSS
+        # JOIN keeps it as the outer loop; otherwise SQLite walks all of the athlete's activities.
+        rows = conn.execute(
+            "SELECT a.data FROM route_bounds b "
+            "CROSS JOIN activity_places p ON p.id = b.id "
+            "CROSS JOIN activities a ON a.athlete_id = p.athlete_id AND a.activity_id = p.activity_id "
+            "WHERE b.min_athlete <= ? AND b.max_athlete >= ? "
+            "AND b.max_lat >= ? AND b.min_lat <= ? AND b.max_lng >= ? AND b.min_lng <= ? "
+            "ORDER BY a.start_date DESC",
+            (athlete_id, athlete_id, math.floor(south * E5), math.ceil(north * E5),
+             math.floor(west * E5), math.ceil(east * E5))
+        ).fetchall()
+    finally:
+        conn.close()
+
+    # ...then the route itself has to cross the box
+    activities = []
+    for (data,) in rows:
+        act = json.loads(data)
+        if route_crosses_box(decode_polyline(act['map']['summary_polyline']), south, west, north, east):
+            activities.append(act)
+            if len(activities) >= limit:
+                break
+    return activities
+
+# Function 12: Clusters sharing LSH buckets with a route (inside the caller's transaction)
+
+def get_route_candidates(conn, athlete_id, buckets, clusters=8, members=5):
+    """[(cluster_id, [signature, ...])] for the clusters sharing the most buckets.
+
+    Each cluster comes with the signatures of its most recent members.
+    """
+    cluster_ids = [row[0] for row in conn.execute(
+        "SELECT cluster_id FROM route_buckets "
+        f"WHERE athlete_id = ? AND bucket IN ({','.join('?' * len(buckets))}) "
+        "GROUP BY cluster_id ORDER BY COUNT(*) DESC LIMIT ?",
+        [athlete_id, *buckets, clusters]
+    )]
+    return [
+        (cluster_id, [np.frombuffer(signature, dtype=np.uint32) for (signature,) in conn.execute(
+            "SELECT signature FROM route_fingerprints WHERE athlete_id = ? AND cluster_id = ? "
+            "ORDER BY activity_id DESC LIMIT ?",
+            (athlete_id, cluster_id, members)
+        )])
+        for cluster_id in cluster_ids
+    ]
+
+# Function 13: Store a route fingerprint and add its buckets to its cluster (inside the caller's transaction)
+
+def save_route_fingerprint(conn, athlete_id, activity_id, cluster_id, signature, buckets):
+    conn.execute(
+        "INSERT OR REPLACE INTO route_fingerprints (athlete_id, activity_id, cluster_id, signature) "
+        "VALUES (?, ?, ?, ?)",
+        (athlete_id, activity_id, cluster_id, np.asarray(signature, dtype=np.uint32).tobytes())
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO route_buckets (athlete_id, bucket, cluster_id) VALUES (?, ?, ?)",
+        [(athlete_id, bucket, cluster_id) for bucket in buckets]
+    )
+
+# Function 14: Cluster of every fingerprinted route, plus stored activities not fingerprinted yet
+
+def get_route_clusters(athlete_id):
+    """({activity_id: cluster_id}, [activities without a fingerprint])."""
+    conn = get_connection()
+    try:
+        clusters = dict(conn.execute(
+            "SELECT activity_id, cluster_id FROM route_fingerprints WHERE athlete_id = ?", (athlete_id,)
+        ).fetchall())
+        missing = conn.execute(
+            "SELECT a.data FROM activities a LEFT JOIN route_fingerprints f "
+            "ON f.athlete_id = a.athlete_id AND f.activity_id = a.activity_id "
+            "WHERE a.athlete_id = ? AND f.activity_id IS NULL",
+            (athlete_id,)
+        ).fetchall()
+        return clusters, [json.loads(data) for (data,) in missing]
+    finally:
+        conn.close()
+
+# Function 15: Add routes' counts to the stored heatmap tiles
+
+def add_heatmap_counts(athlete_id, activity_ids, tiles):
+    """Merge {(zoom, x, y): (cells, counts)} into the athlete's tiles and record activity_ids
+    as counted, in one transaction. If another process already counted some of these
+    activities nothing is written, and their ids are returned."""
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")  # Take the write lock before checking
+            counted = [
+                activity_id for (activity_id,) in conn.execute(
+                    "SELECT activity_id FROM heatmap_activities WHERE athlete_id = ? "
+                    f"AND activity_id IN ({','.join('?' * len(activity_ids))})",
+                    (athlete_id, *activity_ids)
+                )
+            ]
+            if counted:
+                return counted
+
+            rows = []
+            for (zoom, tile_x, tile_y), (cells, counts) in tiles.items():
+                stored = conn.execute(
+                    "SELECT cells, counts FROM heatmap_tiles "
+                    "WHERE athlete_id = ? AND zoom = ? AND tile_x = ? AND tile_y = ?",
+                    (athlete_id, zoom, tile_x, tile_y)
+                ).fetchone()
+                if stored:
+                    # Sum the counts of pixels in both, keeping the pixels sorted
+                    cells = np.concatenate((np.frombuffer(stored[0], dtype=np.uint16), cells))
+                    counts = np.concatenate((np.frombuffer(stored[1], dtype=np.uint32), counts))
+                    order = np.argsort(cells, kind='stable')
+                    cells, counts = cells[order], counts[order]
+                    starts = np.flatnonzero(np.append(True, cells[1:] != cells[:-1]))
+                    cells, counts = cells[starts], np.add.reduceat(counts, starts).astype(np.uint32)
+                rows.append((
+                    athlete_id, zoom, tile_x, tile_y,
+                    cells.astype(np.uint16).tobytes(), counts.astype(np.uint32).tobytes(), int(counts.max())
+                ))
+
+            conn.executemany("INSERT OR REPLACE INTO heatmap_tiles VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.executemany(
+                "INSERT INTO heatmap_activities (athlete_id, activity_id) VALUES (?, ?)",
+                [(athlete_id, activity_id) for activity_id in activity_ids]
+            )
+            return []
+    finally:
+        conn.close()
+
+# Function 16: Stored heatmap summary, plus stored activities not counted yet
+
+def get_heatmap_summary(athlete_id):
+    """(number of counted activities, {zoom: highest count}, [activities not counted yet])."""
+    conn = get_connection()
+    try:
+        (counted,) = conn.execute(
+            "SELECT COUNT(*) FROM heatmap_activities WHERE athlete_id = ?", (athlete_id,)
+        ).fetchone()
+        level_max = dict(conn.execute(
+            "SELECT zoom, MAX(max_count) FROM heatmap_tiles WHERE athlete_id = ? GROUP BY zoom", (athlete_id,)
+        ).fetchall())
+        missing = conn.execute(
+            "SELECT a.data FROM activities a LEFT JOIN heatmap_activities h "
+            "ON h.athlete_id = a.athlete_id AND h.activity_id = a.activity_id "
+            "WHERE a.athlete_id = ? AND h.activity_id IS NULL",
+            (athlete_id,)
+        ).fetchall()
+        return counted, level_max, [json.loads(data) for (data,) in missing]
+    finally:
+        conn.close()
+
+# Function 17: One stored heatmap tile as (cells, counts), or None if no route passes through it
+
+def get_heatmap_tile(athlete_id, zoom, tile_x, tile_y):
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            "SELECT cells, counts FROM heatmap_tiles WHERE athlete_id = ? AND zoom = ? AND tile_x = ? AND tile_y = ?",
+            (athlete_id, zoom, tile_x, tile_y)
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.uint16), np.frombuffer(row[1], dtype=np.uint32)
+    finally:
+        conn.close()
+
+# Function 18: Box around every indexed route of an athlete ([[south, west], [north, east]] or None)
+
+def get_route_extent(athlete_id):
+    conn = get_connection()
+    try:
+        south, west, north, east = conn.execute(
+            "SELECT MIN(min_lat), MIN(min_lng), MAX(max_lat), MAX(max_lng) FROM route_bounds "
+            "WHERE min_athlete <= ? AND max_athlete >= ?",
+            (athlete_id, athlete_id)
+        ).fetchone()
+        if south is None:
+            return None
+        return [[south / E5, west / E5], [north / E5, east / E5]]
+    finally:
+        conn.close()
+
+# Function 19: Version of an athlete's stored activities, which changes with every save
+
+def get_store_version(athlete_id):
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT version FROM sync_state WHERE athlete_id = ?", (athlete_id,)).fetchone()
+        return row[0] if row else 0
+    finally:
+        conn.close()
+
+# Function 20: Whether an athlete's history before the first sync has been fetched
+
+def is_backfilled(athlete_id):
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT backfilled FROM sync_state WHERE athlete_id = ?", (athlete_id,)).fetchone()
+        return bool(row and row[0])
+    finally:
+        conn.close()
+
+
+def mark_backfilled(athlete_id):
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT INTO sync_state (athlete_id, backfilled) VALUES (?, 1) "
+                "ON CONFLICT (athlete_id) DO UPDATE SET backfilled = 1",
+                (athlete_id,)
+            )
+    finally:
+        conn.close()
@@ -1,15 +1,97 @@
 import json
 import os
+import tempfile
+import threading
+import numpy as np
 from flask import request, jsonify
 
-# Function 1: Get settings from settings.json file
+SETTINGS_FILE = 'settings.json'
+
+DEFAULT_SETTINGS = {
+    "maxHR": 200,
+    "zones": {
+        "1": {"min": 50, "max": 59, "name": "Recovery"},
+        "2": {"min": 60, "max": 69, "name": "Aerobic Endurance"},
+        "3": {"min": 70, "max": 79, "name": "Tempo"},
+        "4": {"min": 80, "max": 89, "name": "Threshold"},
+        "5": {"min": 90, "max": 100, "name": "VO2 Max"}
+    }
+}
+
+# Parsed settings and zone table, reloaded only when settings.json changes on disk
+_cache = {"stamp": None, "settings": None, "zones": None}
+_lock = threading.Lock()
+
+
+# Heart rate zones resolved to bpm once per settings change. lookup[bpm] is the index of
+# the zone a whole bpm value falls in; between[bpm] is the zone holding everything
+# strictly between bpm and bpm + 1 (-1 means no zone). Ranges are matched in settings
+# order, first match wins, same as the original per-request loop.
+
+class ZoneTable:
+    def __init__(self, settings):
+        self.max_hr = settings['maxHR']
+        self.zones = []  # (zone number, name, low bpm, high bpm)
+        for zone_num, zone_data in settings['zones'].items():
+            min_hr = round((zone_data['min'] / 100) * self.max_hr)
+            # Extend the upper limit of the zone to include all decimals
+            max_hr_zone = round(((zone_data['max'] + 0.999999) / 100) * self.max_hr)
+            self.zones.append((zone_num, zone_data['name'], min_hr, max_hr_zone))
+            print(f"Zone {zone_num}: {int(min_hr)}-{int(max_hr_zone)} bpm")
+
+        # Rounding can push the top zone a bpm or two past max HR
+        size = int(max([self.max_hr] + [zone[3] for zone in self.zones])) + 1
+        self.lookup = np.full(size, -1, dtype=np.int16)
+        self.between = np.full(size, -1, dtype=np.int16)
+        # Fill in reverse so earlier zones overwrite later ones where ranges overlap
+        for index in range(len(self.zones) - 1, -1, -1):
+            low, high = self.zones[index][2], self.zones[index][3]
+            self.lookup[max(low, 0):max(min(high + 1, size), 0)] = index
+            self.between[max(low, 0):max(min(high, size), 0)] = index
+
+    def zone_index(self, hr):
+        """Index into self.zones for a heart rate, or -1 if it's in no zone."""
+        if not 0 <= hr < len(self.lookup):  # Also catches NaN
+            return -1
+        bpm = int(hr)
+        return int(self.lookup[bpm] if hr == bpm else self.between[bpm])
+
+    def zone_indices(self, hrs):
+        """zone_index() for an array of heart rates."""
+        hrs = np.asarray(hrs, dtype=float)
+        valid = (hrs >= 0) & (hrs < len(self.lookup))
+        bpm = np.where(valid, np.floor(np.where(valid, hrs, 0)), 0).astype(np.intp)
+        indices = np.where(hrs == bpm, self.lookup[bpm], self.between[bpm])
+        return np.where(valid, indices, -1)
+
+# Function 1: Get settings from settings.json file (cached until the file changes)
+
+def _load_settings():
+    """Refresh the cache if settings.json changed; returns (settings, zone table)."""
+    try:
+        stat = os.stat(SETTINGS_FILE)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        stamp = None
+
+    with _lock:
+        if stamp == _cache["stamp"] and (stamp is None or _cache["settings"] is not None):
+            return _cache["settings"], _cache["zones"]
+
+        settings = None
+        if stamp is not None:
+            with open(SETTINGS_FILE, 'r') as f:
+                settings = json.load(f)
+        _cache.update(stamp=stamp, settings=settings, zones=ZoneTable(settings) if settings else None)
+        return settings, _cache["zones"]
+
 
 def get_settings_from_file():
-    settings_file = 'settings.json'
-    if os.path.exists(settings_file):
-        with open(settings_file, 'r') as f:
-            return json.load(f)
-    return None
+    return _load_settings()[0]
+
+
+def get_zone_table():
+    return _load_settings()[1]
 
 # Function 2: Save settings
 
@@ -46,10 +128,29 @@ def save_settings():
             return jsonify({"error": "Validation failed", "details": errors}), 400
 
         # Save to file (or database)
-        with open('settings.json', 'w') as file:
-            json.dump({"maxHR": max_hr, "zones": zones}, file)
+        write_settings({"maxHR": max_hr, "zones": zones})
 
         return jsonify({"message": "Settings saved successfully!"}), 200
     except Exception as e:
         print(f"Error saving settings: {e}")
         return jsonify({"error": "Failed to save settings"}), 500
+
+# Function 3: Write settings atomically, so readers never see a half-written file
+
+def write_settings(settings):
+    directory = os.path.dirname(os.path.abspath(SETTINGS_FILE))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.settings-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(settings, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, SETTINGS_FILE)
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+    # Drop the cached copy right away rather than waiting for the mtime check
+    with _lock:
+        _cache.update(stamp=None, settings=None, zones=None)
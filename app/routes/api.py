@@ -1,13 +1,63 @@
-from flask import Blueprint, jsonify, request, session
+from flask import Blueprint, Response, jsonify, request, send_from_directory, session
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from datetime import datetime, timezone
 import json
 import os
-
-from app.services.chat import classify_query, get_greeting_response, create_prompt, query_openai
-from app.services.strava import get_raw_activities, process_activities
-from app.models.settings import get_settings_from_file
+import numpy as np
+
+from app.services.chat import (classify_query, get_greeting_response, create_greeting_prompt, create_prompt,
+                               query_openai, stream_openai, summarize_training, activity_fingerprint,
+                               response_key, cached_response, cached_stream, known_classification, BUSY_ERROR)
+from app.services.classifier import classifier_stats
+from app.services.llm import LLMOverloaded, llm_gateway, stage_stats
+from app.services.strava import get_hr_streams, get_raw_activities, process_activities, stored_activity_frame
+from app.models.settings import DEFAULT_SETTINGS, get_settings_from_file, get_zone_table, write_settings
+from app.models.activities import get_activities_near, get_activities_within, get_activity
+from app.services.cache import response_cache
+from app.services.clusters import usual_routes
+from app.services.geo import MAX_ZOOM, MIN_ZOOM, route_coordinates
+from app.services.heatmap import MAX_ZOOM as HEATMAP_MAX_ZOOM, get_heatmap, render_tile
+from app.services.thumbnails import DIGEST_PATTERN, THUMBNAIL_DIR, thumbnail_path
+from app.services.stats import (current_week_start, hr_by_pace, time_in_zones, to_epoch,
+                               weekly_stats_by_sport)
 
 api_bp = Blueprint('api', __name__)
 
+# Worker threads that load activities while the chat query is being classified
+chat_executor = ThreadPoolExecutor(max_workers=8)
+# Loads running or queued at once; past that, chats load their activities after classification
+MAX_CHAT_PREFETCH = int(os.getenv("MAX_CHAT_PREFETCH", "16"))
+chat_prefetch_slots = threading.BoundedSemaphore(MAX_CHAT_PREFETCH)
+
+
+def load_chat_context(access_token, athlete_id):
+    raw_activities = get_raw_activities(access_token, athlete_id)
+    return process_activities(raw_activities), summarize_training(raw_activities)
+
+
+def prefetch_chat_context(user_input, access_token, athlete_id):
+    """Start loading activities while the query is classified. None when the query
+    clearly doesn't need them, or when too many loads are already waiting."""
+    if known_classification(user_input) in ("greeting", "irrelevant"):
+        return None
+    if not chat_prefetch_slots.acquire(blocking=False):
+        return None
+
+    future = chat_executor.submit(load_chat_context, access_token, athlete_id)
+    # Also called when the future is cancelled before it starts
+    future.add_done_callback(lambda _: chat_prefetch_slots.release())
+    return future
+
+
+def chat_context(future, access_token, athlete_id):
+    return future.result() if future else load_chat_context(access_token, athlete_id)
+
+
+def overloaded_response(error):
+    # Tell the client when to retry instead of letting it hang in the queue
+    return jsonify({"response": BUSY_ERROR}), error.status_code, {"Retry-After": str(int(error.retry_after))}
+
 # API Route 1: Save settings to JSON file
 
 @api_bp.route('/api/save-settings', methods=['POST'])
@@ -44,9 +94,8 @@ def save_settings():
         if errors:
             return jsonify({"error": "Validation failed", "details": errors}), 400
 
-        # Save to file (or database)
-        with open('settings.json', 'w') as file:
-            json.dump({"maxHR": max_hr, "zones": zones}, file)
+        # Save to file (or database); replaced atomically and picked up by the settings cache
+        write_settings({"maxHR": max_hr, "zones": zones})
 
         return jsonify({"message": "Settings saved successfully!"}), 200
     except Exception as e:
@@ -57,24 +106,12 @@ def save_settings():
 
 @api_bp.route('/api/get-settings', methods=['GET'])
 def get_settings():
-    settings_file = 'settings.json'
-    if os.path.exists(settings_file):
-        with open(settings_file, 'r') as f:
-            settings_data = json.load(f)
+    settings_data = get_settings_from_file()
+    if settings_data:
         return jsonify(settings_data), 200
     else:
         # Default settings if file doesn't exist
-        default_settings = {
-            "maxHR": 200,
-            "zones": {
-                "1": {"min": 50, "max": 59, "name": "Recovery"},
-                "2": {"min": 60, "max": 69, "name": "Aerobic Endurance"},
-                "3": {"min": 70, "max": 79, "name": "Tempo"},
-                "4": {"min": 80, "max": 89, "name": "Threshold"},
-                "5": {"min": 90, "max": 100, "name": "VO2 Max"}
-            }
-        }
-        return jsonify(default_settings), 200
+        return jsonify(DEFAULT_SETTINGS), 200
 
 # API Route 3: Calculate zone
 
@@ -96,14 +133,13 @@ def calculate_zone():
                 "name": "No heart rate data available"
             }), 200
 
-        # Load saved settings from file
-        settings = get_settings_from_file()
+        # Zone table from the settings cache (rebuilt only when settings.json changes)
+        zone_table = get_zone_table()
 
-        if not settings:
+        if not zone_table:
             return jsonify({"error": "Settings not found"}), 400
 
-        max_hr = settings['maxHR']
-        saved_zones = settings['zones']
+        max_hr = zone_table.max_hr
 
         # Convert average_hr to float/int if it's a string
         try:
@@ -126,23 +162,14 @@ def calculate_zone():
                 "name": "Heart rate cannot be negative"
             }), 200
 
-        # # Debug line for percentage calculation
-        # hr_percentage = (average_hr / max_hr) * 100
-        # print(f"Debug: Average HR: {average_hr}, Max HR: {max_hr}, Percentage: {hr_percentage:.2f}%")
-
         # Determine which zone the heart rate falls into
-        for zone_num, zone_data in saved_zones.items():
-            min_hr = round((zone_data['min'] / 100) * max_hr)
-            # Extend the upper limit of the zone to include all decimals
-            max_hr_zone = round(((zone_data['max'] + 0.999999) / 100) * max_hr)
-
-            # print(f"Debug: Zone {zone_num} range: {min_hr}-{max_hr_zone} bpm") # Debug line
-
-            if min_hr <= average_hr <= max_hr_zone:
-                return jsonify({
-                    "zone": f"Zone {zone_num}",
-                    "name": zone_data['name']
-                }), 200
+        index = zone_table.zone_index(average_hr)
+        if index >= 0:
+            zone_num, name = zone_table.zones[index][:2]
+            return jsonify({
+                "zone": f"Zone {zone_num}",
+                "name": name
+            }), 200
 
         return jsonify({
             "zone": "Unknown Zone",
@@ -152,6 +179,103 @@ def calculate_zone():
         print(f"Error in calculate_zone: {e}")
         return jsonify({"error": str(e)}), 500
 
+# API Route 3b: Calculate zones for many heart rates or activities in one request
+
+MAX_ZONE_BATCH = 5000
+
+# Same answers as /api/calculate-zone, in the order zone_results picks them
+NO_HR_DATA = {"zone": "Unknown Zone", "name": "No heart rate data available"}
+INVALID_HR = {"zone": "Invalid", "name": "Invalid heart rate value"}
+HR_ABOVE_MAX = {"zone": "Invalid", "name": "Average heart rate exceeds maximum heart rate"}
+NEGATIVE_HR = {"zone": "Invalid", "name": "Heart rate cannot be negative"}
+NO_MATCHING_ZONE = {"zone": "Unknown Zone", "name": "No matching zone found"}
+
+
+def zone_results(zone_table, heart_rates):
+    """calculate_zone's answer for each value, classified against the zone table in one pass."""
+    hrs = np.full(len(heart_rates), np.nan)
+    missing = np.zeros(len(heart_rates), dtype=bool)
+    invalid = np.zeros(len(heart_rates), dtype=bool)
+    for i, value in enumerate(heart_rates):
+        if isinstance(value, str) and 'bpm' in value:
+            value = value.replace(' bpm', '')
+        if value is None:
+            missing[i] = True
+            continue
+        try:
+            hrs[i] = float(value)
+        except (TypeError, ValueError):
+            invalid[i] = True
+
+    indices = zone_table.zone_indices(hrs)
+
+    # One code per value pointing into `answers`; the first matching condition wins
+    answers = [NO_HR_DATA, INVALID_HR, HR_ABOVE_MAX, NEGATIVE_HR, NO_MATCHING_ZONE]
+    answers += [{"zone": f"Zone {zone_num}", "name": name} for zone_num, name, _, _ in zone_table.zones]
+    codes = np.select(
+        [missing, invalid, hrs > zone_table.max_hr, hrs < 0, indices >= 0],
+        [0, 1, 2, 3, 5 + indices],
+        default=4
+    )
+    return [answers[code] for code in codes]
+
+
+@api_bp.route('/api/calculate-zones', methods=['POST'])
+def calculate_zones():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    heart_rates = data.get('heart_rates')
+    activity_ids = data.get('activity_ids')
+
+    # Each field is checked on its own; heart_rates wins when both are sent
+    for field, values in (('heart_rates', heart_rates), ('activity_ids', activity_ids)):
+        if values is None:
+            continue
+        if not isinstance(values, list):
+            return jsonify({"error": f"{field} must be a list"}), 400
+        if len(values) > MAX_ZONE_BATCH:
+            return jsonify({"error": f"At most {MAX_ZONE_BATCH} values per request"}), 400
+    if heart_rates is None and activity_ids is None:
+        return jsonify({"error": "Provide a list of heart_rates or activity_ids"}), 400
+    if not (heart_rates if heart_rates is not None else activity_ids):
+        return jsonify({"zones": []}), 200
+
+    zone_table = get_zone_table()
+    if not zone_table:
+        return jsonify({"error": "Settings not found"}), 400
+
+    if heart_rates is not None:
+        return jsonify({"zones": zone_results(zone_table, heart_rates)}), 200
+
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    # Average heart rates come from the stored activities (parsed once per sync), never Strava
+    frame = stored_activity_frame(athlete_id)
+
+    try:
+        ids = np.array(activity_ids, dtype=np.int64)
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({"error": "activity_ids must be integers"}), 400
+
+    # Find every requested id in the frame with one sorted search
+    found = np.zeros(len(ids), dtype=bool)
+    hrs = np.full(len(ids), np.nan)
+    if len(frame):
+        order = np.argsort(frame.ids)
+        positions = order[np.minimum(np.searchsorted(frame.ids[order], ids), len(order) - 1)]
+        found = frame.ids[positions] == ids
+        hrs = np.where(found, frame.average_heartrate[positions], np.nan)
+
+    zones = zone_results(zone_table, [None if np.isnan(hr) else hr for hr in hrs])
+    return jsonify({"zones": [
+        dict(zone, activity_id=int(activity_id)) if hit
+        else {"activity_id": int(activity_id), "zone": "Unknown Zone", "name": "Activity not found"}
+        for activity_id, zone, hit in zip(ids, zones, found)
+    ]}), 200
+
 # API Route 4: Chatbot
 
 @api_bp.route('/api/chat', methods=['POST'])
@@ -165,28 +289,352 @@ def chat():
     if not access_token:
         return jsonify({"response": "Authorization error: No valid Strava access token found. Please log in again."}), 401
 
-    # Classify the query
-    classification = classify_query(user_input)
-    print(f"Classification: {classification}")  # Debug log
+    # Start loading activities right away; the load is cancelled if the query
+    # turns out to be a greeting or irrelevant
+    athlete_id = session.get("athlete_id")
+    activities_future = prefetch_chat_context(user_input, access_token, athlete_id)
 
-    if classification == "greeting":
-        user_input = request.json.get("message", "").strip()
-        return jsonify({"response": get_greeting_response(user_input)})
+    try:
+        # Classify the query
+        classification = classify_query(user_input)
+        print(f"Classification: {classification}")  # Debug log
+
+        if classification == "greeting":
+            user_input = request.json.get("message", "").strip()
+            key = response_key("greeting", user_input)
+            return jsonify({"response": cached_response(key, lambda: get_greeting_response(user_input))})
+
+        if classification == "irrelevant":
+            return jsonify({"response": "I'm sorry, I can only help with sports-related queries like running, cycling, or training advice."})
+
+        if classification == "relevant":
+            # Activities come from the cache shared with the dashboard, loaded during classification
+            processed_activities_csv, summary = chat_context(activities_future, access_token, athlete_id)
+            
+            # Same question on the same data gets the cached answer
+            key = response_key("answer", user_input, athlete_id, activity_fingerprint(processed_activities_csv, summary))
+
+            # Create prompt with the athlete's training summary and recent activities, then query GPT
+            gpt_response = cached_response(
+                key, lambda: query_openai(create_prompt(processed_activities_csv, user_input, summary), max_tokens=600)
+            )
+            return jsonify({"response": gpt_response})
+    except LLMOverloaded as e:
+        return overloaded_response(e)
+    finally:
+        if activities_future:
+            activities_future.cancel()
 
-    if classification == "irrelevant":
-        return jsonify({"response": "I'm sorry, I can only help with sports-related queries like running, cycling, or training advice."})
+    # Fallback response
+    return jsonify({"response": "Sorry, I couldn't process your query. Please try again."})
 
-    if classification == "relevant":
-        # Fetch fresh activities every time
-        raw_activities = get_raw_activities(access_token)
-        processed_activities_csv = process_activities(raw_activities)
-        
-        # Create prompt with fresh activity data
-        prompt = create_prompt(processed_activities_csv, user_input)
-        
-        # Query GPT
-        gpt_response = query_openai(prompt, max_tokens=600)
-        return jsonify({"response": gpt_response})
+# API Route 4b: Chatbot, streamed as Server-Sent Events
 
-    # Fallback response
-    return jsonify({"response": "Sorry, I couldn't process your query. Please try again."})
\ No newline at end of file
+@api_bp.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    user_input = request.json.get("message", "").strip()
+    print(f"User Input: {user_input}")  # Debug log
+
+    # Get access token from session or request
+    access_token = session.get("access_token") or request.json.get("access_token")
+
+    if not access_token:
+        return jsonify({"response": "Authorization error: No valid Strava access token found. Please log in again."}), 401
+
+    # An SSE response can't change its status once it has started, so reject up front
+    try:
+        llm_gateway.check()
+    except LLMOverloaded as e:
+        return overloaded_response(e)
+
+    # Start loading activities right away, like the non-streaming route
+    athlete_id = session.get("athlete_id")
+    activities_future = prefetch_chat_context(user_input, access_token, athlete_id)
+
+    # Each token is JSON-encoded so newlines survive the SSE framing
+    def events():
+        try:
+            for token in answer_tokens():
+                yield f"data: {json.dumps({'token': token})}\n\n"
+        except LLMOverloaded:
+            yield f"data: {json.dumps({'token': BUSY_ERROR})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    def answer_tokens():
+        classification = classify_query(user_input)
+        print(f"Classification: {classification}")  # Debug log
+
+        if classification == "greeting":
+            tokens = cached_stream(
+                response_key("greeting", user_input),
+                lambda: stream_openai(create_greeting_prompt(user_input), max_tokens=50, stage="greeting")
+            )
+        elif classification == "irrelevant":
+            tokens = ["I'm sorry, I can only help with sports-related queries like running, cycling, or training advice."]
+        elif classification == "relevant":
+            processed_activities_csv, summary = chat_context(activities_future, access_token, athlete_id)
+            key = response_key("answer", user_input, athlete_id, activity_fingerprint(processed_activities_csv, summary))
+            tokens = cached_stream(
+                key, lambda: stream_openai(create_prompt(processed_activities_csv, user_input, summary), max_tokens=600)
+            )
+        else:
+            tokens = ["Sorry, I couldn't process your query. Please try again."]
+        return tokens
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Don't let proxies buffer the stream
+    })
+    if activities_future:
+        # Drops a load that hasn't started if the answer didn't need it (or the client left)
+        response.call_on_close(activities_future.cancel)
+    return response
+
+# API Route 4c: Chat cache, classifier, LLM gateway and model routing statistics
+
+@api_bp.route('/api/chat/stats', methods=['GET'])
+def chat_stats():
+    return jsonify({
+        "response_cache": response_cache.stats(),
+        "classifier": classifier_stats.summary(),
+        "llm_gateway": llm_gateway.stats(),
+        "stages": stage_stats.summary()
+    }), 200
+
+# API Route 5: Weekly stats for the sport filter
+
+@api_bp.route('/api/weekly-stats', methods=['GET'])
+def weekly_stats():
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    sport_type = request.args.get('sport_type', 'all').lower()
+
+    # Stored activities as parsed once per sync (never Strava)
+    frame = stored_activity_frame(athlete_id)
+
+    start_of_current_week = current_week_start(datetime.now(timezone.utc))
+
+    weekly_by_sport = weekly_stats_by_sport(frame, start_of_current_week, include=('run', 'ride', sport_type))
+    return jsonify(weekly_by_sport[sport_type]), 200
+
+# API Route 6: Time in each heart rate zone this week or month, from heart rate streams
+
+@api_bp.route('/api/time-in-zones', methods=['GET'])
+def get_time_in_zones():
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    zone_table = get_zone_table()
+    if not zone_table:
+        return jsonify({"error": "Settings not found"}), 400
+
+    period = request.args.get('period', 'week')
+    now = datetime.now(timezone.utc)
+    if period == 'week':
+        start = current_week_start(now)
+    elif period == 'month':
+        start = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
+    else:
+        return jsonify({"error": "period must be 'week' or 'month'"}), 400
+
+    frame = stored_activity_frame(athlete_id)
+
+    # Only activities recorded with heart rate have a stream worth fetching
+    mask = frame.between(start=to_epoch(start)) & ~np.isnan(frame.average_heartrate)
+    activity_ids = [int(activity_id) for activity_id in frame.ids[mask]]
+
+    # Stored streams are reused; missing ones are fetched once and kept. Only what the
+    # rate limit allows right now is fetched here, the rest follows in the background
+    streams = get_hr_streams(session.get("access_token"), athlete_id, activity_ids, max_wait=0)
+    seconds = time_in_zones(streams.values(), zone_table)
+    in_zones = seconds[1:].sum()
+
+    return jsonify({
+        "period": period,
+        "start": start.date().isoformat(),
+        "activities": len(activity_ids),
+        "missing_streams": len(activity_ids) - len(streams),
+        "zones": [
+            {
+                "zone": f"Zone {zone_num}",
+                "name": name,
+                "seconds": int(seconds[i + 1]),
+                "percentage": round(100 * float(seconds[i + 1]) / in_zones, 1) if in_zones else 0.0
+            }
+            for i, (zone_num, name, _, _) in enumerate(zone_table.zones)
+        ],
+        "outside_zones_seconds": int(seconds[0])
+    }), 200
+
+# API Route 7: Heart rate by pace trends with a configurable pace range and window
+
+@api_bp.route('/api/hr-trends', methods=['GET'])
+def hr_trends():
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    # Paces in seconds per km; months limits the window to the last N calendar months
+    bin_width = request.args.get('bin_width', 20, type=int)
+    pace_min = request.args.get('pace_min', 240, type=int)
+    pace_max = request.args.get('pace_max', 480, type=int)
+    months = request.args.get('months', None, type=int)
+
+    if not 5 <= bin_width <= 300 or not 0 <= pace_min < pace_max <= 1800:
+        return jsonify({"error": "Need 5 <= bin_width <= 300 and 0 <= pace_min < pace_max <= 1800"}), 400
+    if (pace_max - pace_min) / bin_width > 60:
+        return jsonify({"error": "At most 60 pace groups"}), 400
+    if months is not None and months < 1:
+        return jsonify({"error": "months must be at least 1"}), 400
+
+    frame = stored_activity_frame(athlete_id)
+
+    # Cached on the frame, so it's recomputed only after a sync (or when the month rolls over)
+    now = datetime.now(timezone.utc)
+    key = ('hr_by_pace', bin_width, pace_min, pace_max, months, (now.year, now.month) if months else None)
+    trends = frame.memo(key, lambda: hr_by_pace(frame, bin_width, pace_min, pace_max, months, now))
+
+    # jsonify sorts object keys, so the pace group order is sent separately
+    return jsonify({"pace_groups": list(trends), "trends": trends}), 200
+
+# API Route 8: Simplified route coordinates for an activity map
+
+@api_bp.route('/api/routes/<int:activity_id>', methods=['GET'])
+def activity_route(activity_id):
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    # Without a zoom the route is simplified for a map of `size` pixels fitted to it
+    zoom = request.args.get('zoom', None, type=int)
+    size = request.args.get('size', 80, type=int)
+    if zoom is not None and not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        return jsonify({"error": f"zoom must be between {MIN_ZOOM} and {MAX_ZOOM}"}), 400
+    if not 16 <= size <= 2048:
+        return jsonify({"error": "size must be between 16 and 2048"}), 400
+
+    activity = get_activity(athlete_id, activity_id)
+    if activity is None:
+        return jsonify({"error": "Activity not found"}), 404
+
+    encoded = (activity.get('map') or {}).get('summary_polyline') or ''
+    zoom, coordinates = route_coordinates(activity_id, encoded, zoom, size)
+    return jsonify({"id": activity_id, "zoom": zoom, "coordinates": coordinates}), 200
+
+# API Route 9: Pre-rendered route thumbnails (content addressed, so cached forever)
+
+@api_bp.route('/api/thumbnails/<digest>.svg', methods=['GET'])
+def route_thumbnail_file(digest):
+    if not session.get("athlete_id"):
+        return jsonify({"error": "Not logged in"}), 401
+    if not DIGEST_PATTERN.match(digest) or not os.path.exists(thumbnail_path(digest)):
+        return jsonify({"error": "Thumbnail not found"}), 404
+
+    response = send_from_directory(os.path.abspath(THUMBNAIL_DIR), f"{digest}.svg", mimetype='image/svg+xml')
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+# API Route 10: Heatmap of every stored route, as PNG map tiles
+
+@api_bp.route('/api/heatmap', methods=['GET'])
+def heatmap_info():
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    heatmap = get_heatmap(athlete_id)
+    return jsonify({
+        "activities": heatmap.activities,
+        "bounds": heatmap.bounds,
+        "max_zoom": HEATMAP_MAX_ZOOM,
+        "tiles": f"/api/heatmap/{{z}}/{{x}}/{{y}}.png?v={heatmap.version}",
+    }), 200
+
+
+@api_bp.route('/api/heatmap/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def heatmap_tile(z, x, y):
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+    if not 0 <= z <= HEATMAP_MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        return jsonify({"error": "Tile out of range"}), 404
+
+    png, version = render_tile(athlete_id, z, x, y)
+    # Tile URLs carry the heatmap version (?v=), so a cached tile is never out of date
+    response = Response(png, mimetype='image/png')
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    response.set_etag(f"{version}-{z}-{x}-{y}")
+    return response.make_conditional(request)
+
+# API Route 11: Activities that start near a point or pass through a box
+
+def activity_summary(activity):
+    return {
+        "id": activity['id'],
+        "name": activity.get('name'),
+        "sport_type": activity.get('sport_type'),
+        "date": activity.get('start_date_local'),
+        "distance": round(activity.get('distance', 0) / 1000, 2),
+        "start_latlng": activity.get('start_latlng'),
+    }
+
+
+@api_bp.route('/api/activities/near', methods=['GET'])
+def activities_near():
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    lat = request.args.get('lat', None, type=float)
+    lng = request.args.get('lng', None, type=float)
+    radius = request.args.get('radius', 500, type=float)  # metres
+    limit = request.args.get('limit', 50, type=int)
+    if lat is None or lng is None or not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        return jsonify({"error": "Need lat (-90 to 90) and lng (-180 to 180)"}), 400
+    if not 1 <= radius <= 100000 or not 1 <= limit <= 500:
+        return jsonify({"error": "Need 1 <= radius <= 100000 metres and 1 <= limit <= 500"}), 400
+
+    nearby = get_activities_near(athlete_id, lat, lng, radius, limit)
+    return jsonify({
+        "activities": [{**activity_summary(activity), "distance_from": round(distance)} for activity, distance in nearby]
+    }), 200
+
+
+@api_bp.route('/api/activities/within', methods=['GET'])
+def activities_within():
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    box = [request.args.get(name, None, type=float) for name in ('south', 'west', 'north', 'east')]
+    limit = request.args.get('limit', 50, type=int)
+    if None in box:
+        return jsonify({"error": "Need south, west, north and east"}), 400
+    south, west, north, east = box
+    if not -90 <= south <= north <= 90 or not -180 <= west <= east <= 180:
+        return jsonify({"error": "Need south <= north and west <= east within valid coordinates"}), 400
+    if not 1 <= limit <= 500:
+        return jsonify({"error": "Need 1 <= limit <= 500"}), 400
+
+    activities = get_activities_within(athlete_id, south, west, north, east, limit)
+    return jsonify({"activities": [activity_summary(activity) for activity in activities]}), 200
+
+# API Route 12: Usual routes (repeat-route clusters) with pace and heart rate progression
+
+@api_bp.route('/api/usual-routes', methods=['GET'])
+def get_usual_routes():
+    athlete_id = session.get("athlete_id")
+    if not athlete_id:
+        return jsonify({"error": "Not logged in"}), 401
+
+    min_count = request.args.get('min_count', 3, type=int)
+    limit = request.args.get('limit', 10, type=int)
+    if not 2 <= min_count <= 1000 or not 1 <= limit <= 50:
+        return jsonify({"error": "Need 2 <= min_count <= 1000 and 1 <= limit <= 50"}), 400
+
+    frame = stored_activity_frame(athlete_id)
+
+    return jsonify({"routes": usual_routes(athlete_id, frame, min_count, limit)}), 200
@@ -1,8 +1,9 @@
 from flask import Flask, redirect, request, session, render_template, jsonify, Blueprint
-import requests
 import os
 from dotenv import load_dotenv
 
+from app.services.strava import StravaAPIError, strava_request
+
 auth_bp = Blueprint('auth', __name__)
 
 # Get keys from the environment
@@ -28,8 +29,11 @@ def login_strava():
 @auth_bp.route('/logout')
 def logout():
     if 'access_token' in session:
-        requests.post("https://www.strava.com/oauth/deauthorize", 
-                     data={'access_token': session['access_token']})
+        try:
+            strava_request("POST", "https://www.strava.com/oauth/deauthorize",
+                           data={'access_token': session['access_token']})
+        except StravaAPIError as e:
+            print(f"Error deauthorizing Strava token: {e}")
     
     session.clear()
     response = redirect('/')
@@ -47,20 +51,25 @@ def callback():
         return "Authorization failed. Please try again.", 400  # Handle missing code gracefully
 
     # Exchange the authorization code for an access token
-    token_response = requests.post(
-        "https://www.strava.com/oauth/token",
-        data={
-            'client_id': CLIENT_ID,
-            'client_secret': CLIENT_SECRET,
-            'code': code,
-            'grant_type': 'authorization_code'
-        }
-    ).json()
+    try:
+        token_response = strava_request(
+            "POST",
+            "https://www.strava.com/oauth/token",
+            data={
+                'client_id': CLIENT_ID,
+                'client_secret': CLIENT_SECRET,
+                'code': code,
+                'grant_type': 'authorization_code'
+            }
+        ).json()
+    except StravaAPIError:
+        return "Strava is busy right now. Please try again in a few minutes.", 503
 
     # Save the user's tokens and expiry in the session
     session['access_token'] = token_response.get('access_token')
     session['refresh_token'] = token_response.get('refresh_token')
     session['expires_at'] = token_response.get('expires_at')
+    session['athlete_id'] = token_response.get('athlete', {}).get('id')
 
     # Redirect to the dashboard
     return redirect('/dashboard')
\ No newline at end of file
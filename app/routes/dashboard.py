@@ -1,13 +1,15 @@
 from flask import Blueprint, render_template
-import requests
 import json
 import os
 from datetime import datetime, timedelta, timezone
-from flask import Flask, redirect, request, session, render_template, jsonify
+from flask import Flask, redirect, request, session, render_template
 from flask_cors import CORS
-import time
+import numpy as np
 
-from app.models.settings import get_settings_from_file
+from app.models.settings import get_zone_table
+from app.services.stats import current_week_start, hr_by_pace, to_epoch, weekly_stats_by_sport
+from app.services.strava import StravaAPIError, get_activity_frame, get_athlete
+from app.services.thumbnails import route_thumbnail
 
 app = Flask(__name__)
 CORS(app)
@@ -31,44 +33,23 @@ def dashboard():
         manifest = {}
 
     access_token = session['access_token']
-    headers = {'Authorization': f"Bearer {access_token}"}
 
     # Fetch profile info
-    profile_response = requests.get('https://www.strava.com/api/v3/athlete', headers=headers)
-    if profile_response.status_code != 200:
-        return f"Error fetching profile: {profile_response.status_code}, {profile_response.text}"
-    profile = profile_response.json()
-
-    # Fetch or cache activities
-    if 'all_activities' not in session or time.time() > session.get('cache_expiry', 0):
-        all_activities = []
-        page = 1
-        while True:
-            activities_response = requests.get(
-                'https://www.strava.com/api/v3/athlete/activities',
-                headers=headers,
-                params={'per_page': 100, 'page': page}
-            )
-            if activities_response.status_code != 200:
-                return f"Error fetching activities: {activities_response.status_code}, {activities_response.text}"
-
-            activities = activities_response.json()
-            if not activities:
-                break
-            all_activities.extend(activities)
-            page += 1
-
-        session['all_activities'] = all_activities
-        session['cache_expiry'] = time.time() + 600  # Cache expires in 10 minutes
-    else:
-        all_activities = session['all_activities']
-
-    # Sort activities by start date (most recent first)
-    all_activities = sorted(
-        all_activities,
-        key=lambda act: datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z"),
-        reverse=True
-    )
+    try:
+        profile = get_athlete(access_token)
+    except StravaAPIError as e:
+        return f"Error fetching profile: {e.status_code}, {e.text}"
+    session['athlete_id'] = profile['id']
+
+    # Sync new activities into the local store or use the server-side cache. All
+    # sections below use masks over the frame's parsed columns.
+    try:
+        frame = get_activity_frame(access_token, profile['id'])
+    except StravaAPIError as e:
+        return f"Error fetching activities: {e.status_code}, {e.text}"
+
+    # Activities are already sorted by start date (most recent first)
+    all_activities = frame.activities
 
     # Prepare detailed activity data for display, filtering for outdoor activities with GPS data
     detailed_activities = []
@@ -90,12 +71,16 @@ def dashboard():
         start_date = datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%S%z")
         formatted_date = start_date.strftime("%A, %B %d, %Y")
         
+        # Static route sketch, rendered once per route; the interactive map loads on click
+        thumbnail = route_thumbnail(polyline)
+
         detailed_activities.append({
+            "id": activity['id'],
             "name": activity['name'],
             "distance": f"{activity['distance'] / 1000:.2f} km",
             "time": f"{activity['moving_time'] // 60} mins",
             "date": formatted_date,
-            "polyline": polyline,
+            "thumbnail": f"/api/thumbnails/{thumbnail}.svg",
             "start_latlng": start_latlng,
             "url": f"https://www.strava.com/activities/{activity['id']}"
         })
@@ -106,25 +91,19 @@ def dashboard():
 
     now = datetime.now(timezone.utc)
     first_day_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
-    monthly_activities = [
-        act for act in all_activities if datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z") >= first_day_of_month
-    ]
-    monthly_distance = sum(act['distance'] for act in monthly_activities) / 1000
-    monthly_time = sum(act['moving_time'] for act in monthly_activities) / 3600
+    monthly = frame.totals(frame.between(start=to_epoch(first_day_of_month)))
+    monthly_distance = monthly["distance"]
+    monthly_time = monthly["time"]
 
     past_4_weeks = now - timedelta(weeks=4)
-    last_4_weeks_activities = [
-        act for act in all_activities if datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z") > past_4_weeks
-    ]
-    last_4_weeks_distance = sum(act['distance'] for act in last_4_weeks_activities) / 1000
-    last_4_weeks_time = sum(act['moving_time'] for act in last_4_weeks_activities) / 3600
+    last_4_weeks = frame.totals(frame.between(start=to_epoch(past_4_weeks), include_start=False))
+    last_4_weeks_distance = last_4_weeks["distance"]
+    last_4_weeks_time = last_4_weeks["time"]
 
     year_start = datetime(now.year, 1, 1, tzinfo=timezone.utc)
-    yearly_activities = [
-        act for act in all_activities if datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z") >= year_start
-    ]
-    yearly_distance = sum(act['distance'] for act in yearly_activities) / 1000
-    yearly_time = sum(act['moving_time'] for act in yearly_activities) / 3600
+    yearly = frame.totals(frame.between(start=to_epoch(year_start)))
+    yearly_distance = yearly["distance"]
+    yearly_time = yearly["time"]
 
     data = {
         "profile": {
@@ -137,16 +116,16 @@ def dashboard():
             "time": f"{int(monthly_time)} hrs {int((monthly_time % 1) * 60)} mins"
         },
         "last_4_weeks": {
-            "activities_per_week": len(last_4_weeks_activities) // 4,
+            "activities_per_week": last_4_weeks["count"] // 4,
             "avg_distance_per_week": f"{last_4_weeks_distance / 4:.2f} km",
             "avg_time_per_week": f"{int(last_4_weeks_time / 4)} hrs {int(((last_4_weeks_time / 4) % 1) * 60)} mins",
         },
         "yearly_stats": {
-            "activities": len(yearly_activities),
+            "activities": yearly["count"],
             "distance": f"{yearly_distance:.2f} km",
             "time": f"{int(yearly_time)} hrs {int((yearly_time % 1) * 60)} mins",
         },
-        "activities": detailed_activities[:2],  # Only show first 2 outdoor activities
+        "activities": detailed_activities,  # Thumbnails are cheap, so show all 5 outdoor activities
     }
 
 # Middle section
@@ -156,87 +135,25 @@ def dashboard():
 
     # Calculate weekly stats (current week) - Current time
     now = datetime.now(timezone.utc)
-    start_of_current_week = now - timedelta(days=now.weekday())
-    start_of_current_week = start_of_current_week.replace(hour=0, minute=0, second=0, microsecond=0)
+    start_of_current_week = current_week_start(now)
     end_of_current_week = start_of_current_week + timedelta(days=6, hours=23, minutes=59, seconds=59)
 
-    # Filter activities for the current week based on the sport type
-    if sport_type == 'all':
-        weekly_activities = [
-            act for act in all_activities
-            if start_of_current_week <= datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z") <= end_of_current_week
-        ]
-    elif sport_type == 'ride':
-        weekly_activities = [
-            act for act in all_activities
-            if start_of_current_week <= datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z") <= end_of_current_week
-            and act.get('sport_type', '').lower() in ['ride', 'virtualride', 'ebikeride', 'handcycle']
-        ]
-    else:
-        weekly_activities = [
-            act for act in all_activities
-            if start_of_current_week <= datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z") <= end_of_current_week
-            and act.get('sport_type', '').lower() == sport_type
-        ]
-
-    # Calculate current week's stats
-    weekly_distance = sum(act['distance'] for act in weekly_activities) / 1000
-    weekly_time = sum(act['moving_time'] for act in weekly_activities) / 3600
-    weekly_elevation = sum(act.get('total_elevation_gain', 0) for act in weekly_activities)
-
-    # Weekly Chart Data: Current week + last 11 weeks
-    weekly_labels = []
-    weekly_distances = []
-
-    weekly_labels.append(f"{start_of_current_week.strftime('%b %d')} - {end_of_current_week.strftime('%b %d')}")
-    weekly_distances.append(round(weekly_distance, 2))
-
-    for i in range(1, 12):
-        start_of_week = start_of_current_week - timedelta(weeks=i)
-        end_of_week = start_of_week + timedelta(days=6, hours=23, minutes=59, seconds=59)
-
-        if sport_type == 'all':
-            week_activities = [
-                act for act in all_activities
-                if start_of_week <= datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z") <= end_of_week
-            ]
-        else:
-            week_activities = [
-                act for act in all_activities
-                if start_of_week <= datetime.strptime(act['start_date_local'], "%Y-%m-%dT%H:%M:%S%z") <= end_of_week
-                and act.get('sport_type', '').lower() == sport_type
-            ]
-
-        week_distance = sum(act['distance'] for act in week_activities) / 1000
-        weekly_labels.append(f"{start_of_week.strftime('%b %d')} - {end_of_week.strftime('%b %d')}")
-        weekly_distances.append(round(week_distance, 2))
+    # Current week's activities (all sports), used for the zone focus below
+    weekly_mask = frame.between(to_epoch(start_of_current_week), to_epoch(end_of_current_week))
 
-    weekly_labels.reverse()
-    weekly_distances.reverse()
+    # Weekly stats and chart data (current week + last 11 weeks) for every sport filter in one pass
+    weekly_by_sport = weekly_stats_by_sport(frame, start_of_current_week, include=('run', 'ride', sport_type))
+    selected = weekly_by_sport[sport_type]
 
     # Update weekly_stats in the data dictionary
-    data["weekly_stats"] = {
-        "distance": f"{weekly_distance:.2f} km",
-        "time": f"{int(weekly_time)} hrs {int((weekly_time % 1) * 60)} mins",
-        "elevation": f"{weekly_elevation:.0f} m"
-    }
-
-    data["weekly_chart"] = {
-        "labels": weekly_labels,
-        "distances": weekly_distances
-    }
-
-    # If AJAX request, return JSON data
-    if request.args.get('sport_type'):
-        return jsonify({
-            "weekly_stats": data["weekly_stats"],
-            "weekly_chart": data["weekly_chart"]
-        })
+    data["weekly_stats"] = selected["weekly_stats"]
+    data["weekly_chart"] = selected["weekly_chart"]
+    data["weekly_by_sport"] = weekly_by_sport
 
 # Zone section
 
-    settings = get_settings_from_file()
-    if not settings:
+    zone_table = get_zone_table()
+    if not zone_table:
         print("No saved settings found. Please configure zones in settings.")
         data["zone_focus"] = {
             "training_focus": "Zones not configured",
@@ -244,36 +161,24 @@ def dashboard():
         }
         return data
 
-    # Use saved settings
-    max_hr = settings['maxHR']
-    saved_zones = settings['zones']
+    # Use saved settings (zone ranges are precomputed when settings.json changes)
+    max_hr = zone_table.max_hr
     print(f"Using saved max HR: {max_hr}")
 
-    # Calculate zones from saved settings
-    zones = {}
-    for zone_num, zone_data in saved_zones.items():
-        min_hr = round((zone_data['min'] / 100) * max_hr)
-        max_hr_zone = round(((zone_data['max'] + 0.999999) / 100) * max_hr)
-        zones[f"Zone {zone_num}"] = (min_hr, max_hr_zone)
-        print(f"Zone {zone_num}: {int(min_hr)}-{int(max_hr_zone)} bpm")
-
     # Calculate average heart rate from activities
-    activity_averages = []
-    for activity in weekly_activities:
-        if 'average_heartrate' in activity:
-            activity_averages.append(activity['average_heartrate'])
+    weekly_hr = frame.average_heartrate[weekly_mask]
+    activity_averages = weekly_hr[~np.isnan(weekly_hr)]
 
-    average_heart_rate = int(sum(activity_averages) / len(activity_averages)) if activity_averages else 0
+    average_heart_rate = int(activity_averages.sum() / len(activity_averages)) if len(activity_averages) else 0
     print(f"Calculated average HR: {average_heart_rate}")
     print(f"Max HR: {max_hr}")
 
     # Determine zone based on average heart rate
     zone_focus = None
-    for zone, (low, high) in zones.items():
-        if low <= average_heart_rate <= high:
-            zone_focus = zone
-            print(f"Average HR {average_heart_rate} falls into {zone}")
-            break
+    index = zone_table.zone_index(average_heart_rate)
+    if index >= 0:
+        zone_focus = f"Zone {zone_table.zones[index][0]}"
+        print(f"Average HR {average_heart_rate} falls into {zone_focus}")
 
     # Define zone names mapping
     zone_names = {
@@ -294,57 +199,9 @@ def dashboard():
 
 # Heart Rate Trends section
 
-    # Filter runs only (normal runs, trail runs, treadmill runs)
-    running_activities = [
-        act for act in all_activities 
-        if act.get('sport_type') in ['Run', 'TrailRun', 'Treadmill', 'VirtualRun', 'RaceRun']
-    ]
-
-    # Define pace groups (20-second intervals in seconds per km)
-    pace_groups = [
-        (240, 260, "4:00–4:20"), (260, 280, "4:20–4:40"), (280, 300, "4:40–5:00"),
-        (300, 320, "5:00–5:20"), (320, 340, "5:20–5:40"), (340, 360, "5:40–6:00"),
-        (360, 380, "6:00–6:20"), (380, 400, "6:20–6:40"), (400, 420, "6:40–7:00"),
-        (420, 440, "7:00–7:20"), (440, 460, "7:20–7:40"), (460, 480, "7:40–8:00")
-    ]
-
-    # Initialize heart rate trends data structure
-    hr_trends_by_pace = {group[2]: {} for group in pace_groups}  # pace label -> month -> HR list
-
-    # Process running activities
-    for activity in running_activities:
-        distance = activity.get('distance', 0)  # Distance in meters
-        moving_time = activity.get('moving_time', 0)  # Time in seconds
-        average_hr = activity.get('average_heartrate')  # Average heart rate
-
-        # Skip activities with missing or invalid data
-        if distance == 0 or moving_time == 0 or not average_hr:
-            continue
-
-        # Calculate average pace in seconds per km
-        avg_pace = moving_time / (distance / 1000)  # sec/km
-
-        # Match the pace to the appropriate pace group
-        for low, high, pace_label in pace_groups:
-            if low <= avg_pace < high:
-                # Extract month from activity start date
-                month = datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%S%z").strftime("%b")
-                year = datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%S%z").year
-                month_year = f"{month} '{str(year)[-2:]}"
-
-                # Add HR data to the appropriate month and pace group
-                if month_year not in hr_trends_by_pace[pace_label]:
-                    hr_trends_by_pace[pace_label][month_year] = []
-                hr_trends_by_pace[pace_label][month_year].append(average_hr)
-                break  # Exit loop once pace group is matched
-
-    # Calculate average heart rates for each month in each pace group
-    final_hr_trends = {}
-    for pace_label, monthly_data in hr_trends_by_pace.items():
-        final_hr_trends[pace_label] = sorted([
-            {"month_year": month_year, "bpm": round(sum(hr) / len(hr))}
-            for month_year, hr in monthly_data.items()
-        ], key=lambda x: datetime.strptime(x["month_year"], "%b '%y"))
+    # Average HR per 20-second pace group (4:00–8:00 /km) and month, for runs only.
+    # Computed once per synced frame and reused until the next sync
+    final_hr_trends = frame.memo(('hr_by_pace', 20, 240, 480, None, None), lambda: hr_by_pace(frame))
 
     # Add the heart rate trends data to the template context
     data["heart_rate_trends_by_pace"] = final_hr_trends
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import threading
+import time
+
+# Server-side cache with per-entry expiry and least-recently-used eviction
+
+class TTLCache:
+    # ttl=None keeps entries until they are evicted or popped
+    def __init__(self, maxsize=128, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at is not None and time.time() > expires_at:
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)  # Mark as most recently used
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            ttl = ttl or self.ttl
+            self._data[key] = (time.time() + ttl if ttl else None, value)
+            self._data.move_to_end(key)
+
+            # Evict least recently used entries once we're over capacity
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else default
+
+    def pop_where(self, predicate):
+        """Drop every entry whose key matches predicate; returns how many were dropped."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Parsed activity frames keyed by (athlete id, store version), shared by every worker thread
+# in this process. A sync that stores anything bumps the version, so entries never expire.
+activity_cache = TTLCache(maxsize=256, ttl=None)
+
+# Athletes synced with Strava in the last 10 minutes; their frames aren't synced again until then
+sync_cache = TTLCache(maxsize=4096, ttl=600)
+
+# Chat answers keyed by (athlete id, normalized question, activity data fingerprint)
+response_cache = TTLCache(maxsize=1024, ttl=3600)
+
+# Simplified route coordinates keyed by (activity id, map zoom)
+route_cache = TTLCache(maxsize=4096, ttl=86400)
+
+# Heatmap summaries per athlete id; the counts themselves live in the activity store
+heatmap_cache = TTLCache(maxsize=1024, ttl=600)
+
+# Rendered heatmap PNG tiles keyed by (athlete id, heatmap version, zoom, x, y)
+tile_cache = TTLCache(maxsize=2048, ttl=3600)
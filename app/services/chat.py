@@ -1,18 +1,60 @@
-from dotenv import load_dotenv
-from openai import OpenAI
+from datetime import datetime, timezone
+import hashlib
 import os
+import re
+import threading
+import time
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from app.services.cache import TTLCache, response_cache
+from app.services.classifier import THRESHOLD, classify_locally, classify_locally_async, score_query
+from app.services.llm import LLMOverloaded, async_complete, async_stream_complete, complete, stream_complete
+from app.services.stats import ActivityFrame, current_week_start, monthly_rollups, weekly_series
 
-# Function 1: Use OpenAI to classify the query as 'greeting', 'relevant', or 'irrelevant'.
+QUERY_ERROR = "Sorry, I couldn't process your request. Please try again."
+GREETING_ERROR = "Sorry, I couldn't process your greeting. How can I assist you with your training?"
+BUSY_ERROR = "I'm answering a lot of questions right now. Please try again in a few seconds."
+
+
+class StreamFailed(Exception):
+    """Raised by a token stream that broke off; message is what the user is told instead."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+# Classifications by normalized query (answers themselves live in response_cache)
+classification_cache = TTLCache(maxsize=2048, ttl=24 * 3600)
+
+# Words that don't change what is being asked
+FILLER_WORDS = {"please", "pls", "hey", "hi", "coach", "matthew", "can", "you", "tell", "me", "the", "a", "so"}
+
+# Function 1: Classify the query, answering obvious cases locally and asking OpenAI otherwise
 
 def classify_query(query):
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "user", "content": f"""
+    # Repeated questions reuse their earlier classification
+    key = normalize_query(query)
+    classification = classification_cache.get(key)
+    if classification is None:
+        classification = classify_locally(query, classify_query_llm)
+        if classification != "unknown":
+            classification_cache.set(key, classification)
+    return classification
+
+
+def known_classification(query):
+    """The classification if it needs no OpenAI call (cached, or clear to the local scorer), else None."""
+    classification = classification_cache.get(normalize_query(query))
+    if classification is None:
+        label, score = score_query(query)
+        if score >= THRESHOLD:
+            classification = label
+    return classification
+
+# Function 1b: Use OpenAI to classify the query as 'greeting', 'relevant', or 'irrelevant'.
+
+def create_classification_prompt(query):
+    return f"""
 You are an intelligent query classifier for a running and fitness chatbot. Your role is to analyze the user's query and classify it into one of three categories:
 - 'greeting': The user is starting the conversation with a casual or formal greeting. This could be slang as well.
 - 'relevant': The user is asking a question directly related to their activities, running, cycling (riding), fitness, training, or performance nutrition. 
@@ -22,61 +64,155 @@ Only return the single word, unstyled, no markup, just 'greeting', 'relevant', o
 
 User query: '{query}'
 """
-                }
-            ]
-        )
-        # Extract and clean the model's response
-        classification = response.choices[0].message.content.strip().lower()
 
-        # Normalize response to ensure it matches one of the valid categories
-        classification = classification.strip(" '\"")  # Remove quotes or unexpected characters
 
-        # Validate the response is an exact match to expected categories
-        valid_categories = {"greeting", "relevant", "irrelevant"}
-        if classification in valid_categories:
-            return classification
+def parse_classification(content):
+    # Extract and clean the model's response
+    classification = content.strip().lower()
 
-        # Handle unexpected responses
-        print(f"Unexpected classification response: {classification}")  # Debug log
-        return "unknown"
+    # Normalize response to ensure it matches one of the valid categories
+    classification = classification.strip(" '\"")  # Remove quotes or unexpected characters
+
+    # Validate the response is an exact match to expected categories
+    valid_categories = {"greeting", "relevant", "irrelevant"}
+    if classification in valid_categories:
+        return classification
+
+    # Handle unexpected responses
+    print(f"Unexpected classification response: {classification}")  # Debug log
+    return "unknown"
+
+
+def classify_query_llm(query):
+    try:
+        response = complete(
+            "classify",
+            [
+                {"role": "user", "content": create_classification_prompt(query)}
+            ],
+            max_tokens=5  # A single word
+        )
+        return parse_classification(response.choices[0].message.content)
+    except LLMOverloaded:
+        raise
     except Exception as e:
-        print(f"Error in classify_query: {e}")
+        print(f"Error in classify_query_llm: {e}")
         return "unknown"
 
 # Function 2: Create the prompt later sent to the GPT
 
-def create_prompt(activities_csv, user_query, max_activities=200):
-    # Add explanation for the CSV format
-    csv_explanation = """
-    The activity data is presented in the following csv format:
-    - Activity Type: Either 'Run' or 'Ride'.
-    - Name: Name of the activity.
-    - Distance: Distance in kilometers (km).
-    - Elevation Gain: Elevation gain in meters (m).
-    - Avg HR: Average heart rate in beats per minute (bpm).
-    - Pace/Speed: For 'Run' activities, this is the average pace in minutes per kilometer (min/km). For 'Ride' activities, this is the average speed in kilometers per hour (km/h).
-    - Duration: Duration of the activity in minutes (min).
-    """
-    # Ensure the activities are split into lines
-    activities_list = activities_csv.splitlines()
-
-    # Truncate activities to the maximum allowed
-    activity_data = "\n".join(activities_list[:max_activities])
-
-    # Combine explanation and data into the prompt
-    prompt = f"""
+# Static instructions go first and never change, so the provider can cache this prefix
+PROMPT_PREFIX = """
 You are a virtual running coach for a web app. Your purpose is to provide advice on whatever the user asks, whether that's running, cycling, training, or performance nutrition. Structure your response using simple sentences and clear spacing. Ensure that your response uses clear paragraphs with line breaks to separate ideas, making the information easy to read. Use a conversational and encouraging tone, while staying concise, clear, and actionable.
 
-{csv_explanation}
+Provide a tailored, well-structured and clear response based on the user's recent training. Respond as a natural human being. Do not respond like ChatGPT. Do not respond like a robot. Do not use unneccesary capital letters in headings. Do not use any markdown like ***bold*** or ### italic. Do not use lists.
 
-Here is the user's recent training data:
-{activity_data}
+The user's training is given as weekly and monthly totals, followed by their most recent individual activities in csv format:
+Type (Run, Ride, Hike or Swim), Name, Distance (km), Elevation Gain (m), Avg HR (bpm), Pace/Speed (min/km for runs, km/h for rides), Duration (min).
+"""
 
-User question: {user_query}
+# Maximum prompt size in tokens (instructions + training data + question)
+PROMPT_TOKEN_BUDGET = int(os.getenv("CHAT_PROMPT_TOKEN_BUDGET", "700"))
 
-Provide a tailored, well-structured and clear response based on the user's recent training. Respond as a natural human being. Do not respond like ChatGPT. Do not respond like a robot. Do not use unneccesary capital letters in headings. Do not use any markdown like ***bold*** or ### italic. Do not use lists.
-"""
-    return prompt
+# Words in a question that mention one of the activity types in the csv
+SPORT_WORDS = {
+    "run": "run", "runs": "run", "running": "run", "ran": "run",
+    "ride": "ride", "rides": "ride", "riding": "ride", "rode": "ride", "cycling": "ride",
+    "hike": "hike", "hikes": "hike", "hiking": "hike", "hiked": "hike",
+    "swim": "swim", "swims": "swim", "swimming": "swim", "swam": "swim",
+}
+
+
+# The tokenizer's encoding file is downloaded on first use. Until that works token counts
+# are estimated, and the download is retried after a delay that doubles with each failure.
+TOKENIZER_RETRY = 60  # seconds
+TOKENIZER_MAX_RETRY = 3600
+tokenizer = None
+tokenizer_failures = 0
+tokenizer_retry_at = 0.0
+tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    global tokenizer, tokenizer_failures, tokenizer_retry_at
+    if tokenizer is not None or time.monotonic() < tokenizer_retry_at:
+        return tokenizer
+
+    with tokenizer_lock:
+        if tokenizer is None and time.monotonic() >= tokenizer_retry_at:
+            try:
+                import tiktoken
+                tokenizer = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                delay = min(TOKENIZER_RETRY * 2 ** tokenizer_failures, TOKENIZER_MAX_RETRY)
+                tokenizer_failures += 1
+                tokenizer_retry_at = time.monotonic() + delay
+                print(f"Tokenizer unavailable, estimating token counts for {delay}s: {e}")
+    return tokenizer
+
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+    return len(text) // 4 + 1  # Roughly four characters per token for English text
+
+
+def summarize_training(raw_activities, now=None):
+    """Compact weekly and monthly rollups of the athlete's training."""
+    if not raw_activities:
+        return "No recent training data."
+
+    now = now or datetime.now(timezone.utc)
+    frame = ActivityFrame(raw_activities)
+
+    labels, series = weekly_series(frame, current_week_start(now), weeks=8, include=('run', 'ride'))
+    weekly_lines = []
+    for i, label in enumerate(labels):
+        weekly_lines.append(
+            f"{label}: {int(series['all']['count'][i])} activities, {series['all']['distance'][i]:.1f} km, "
+            f"{series['all']['time'][i]:.1f} h (run {series['run']['distance'][i]:.1f} km, "
+            f"ride {series['ride']['distance'][i]:.1f} km)"
+        )
+
+    monthly_lines = []
+    for month in monthly_rollups(frame, now, months=6):
+        hr = f", avg HR {month['average_heartrate']}" if month['average_heartrate'] else ""
+        monthly_lines.append(
+            f"{month['label']}: {month['count']} activities, {month['distance']:.0f} km, {month['time']:.1f} h{hr}"
+        )
+
+    return "Weekly totals (oldest first):\n" + "\n".join(weekly_lines) + \
+        "\n\nMonthly totals (oldest first):\n" + "\n".join(monthly_lines)
+
+
+def create_prompt(activities_csv, user_query, summary="", token_budget=PROMPT_TOKEN_BUDGET):
+    question = f"\nUser question: {user_query}\n"
+    summary_block = f"\n{summary}\n" if summary else ""
+
+    # Rows are most recent first; activities of a sport the user mentions are picked first
+    rows = activities_csv.splitlines()
+    mentioned = {SPORT_WORDS[word] for word in re.findall(r"[a-z]+", user_query.lower()) if word in SPORT_WORDS}
+    order = range(len(rows))
+    if mentioned:
+        order = sorted(order, key=lambda i: rows[i].split(",", 1)[0].lower() not in mentioned)
+
+    # Fill whatever budget the fixed parts leave with individual activities
+    remaining = token_budget - count_tokens(PROMPT_PREFIX + summary_block + question) - 10
+    picked = []
+    for i in order:
+        cost = count_tokens(rows[i]) + 1
+        if cost > remaining:
+            break
+        picked.append(i)
+        remaining -= cost
+
+    # Picked rows keep their order and the question comes last, so an athlete's prompts
+    # share a prefix (instructions, summary, activities)
+    activity_rows = [rows[i] for i in sorted(picked)]
+
+    activity_block = "\nRecent activities:\n" + "\n".join(activity_rows) + "\n" if activity_rows else ""
+    return PROMPT_PREFIX + summary_block + activity_block + question
 
 # Function 3: Create the actual query sent to the GPT
 
@@ -89,34 +225,41 @@ def query_openai(prompt, max_tokens=900):
 
     # Send to GPT
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+        response = complete(
+            "answer",
+            [
                 {"role": "user", "content": prompt}
             ],
             max_tokens=max_tokens,
             temperature=0.7
         )
         return response.choices[0].message.content.strip()
+    except LLMOverloaded:
+        raise
     except Exception as e:
         print(f"Error in query_openai: {e}")
-        return "Sorry, I couldn't process your request. Please try again."
+        return QUERY_ERROR
 
-# Function 4: Get greeting response
+# Function 4: Create the greeting prompt
 
-def get_greeting_response(user_input):
-    try:
-        # Define the GPT prompt
-        prompt = f"""
+def create_greeting_prompt(user_input):
+    return f"""
         You are a virtual assistant specializing in running, cycling, swimming, and fitness. You are part of a fitness dashboard web app built with the Strava API, so always act as if you already have access to the user's fitness data, including their recent activities and training progress. When responding to greetings, tailor your responses naturally and contextually while subtly reinforcing that you are ready to assist with their fitness journey. Keep your greeting short. Always sound confident, encouraging, and ready to assist with their training.
 
         User's input: {user_input}
         """
+
+# Function 5: Get greeting response
+
+def get_greeting_response(user_input):
+    try:
+        # Define the GPT prompt
+        prompt = create_greeting_prompt(user_input)
         
         # Send the prompt to GPT
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+        response = complete(
+            "greeting",
+            [
                 {"role": "user", "content": prompt}
             ],
             max_tokens=50,  # Keep the response concise
@@ -125,6 +268,186 @@ def get_greeting_response(user_input):
         
         # Extract the response text
         return response.choices[0].message.content.strip()
+    except LLMOverloaded:
+        raise
     except Exception as e:
         print(f"Error in get_greeting_response: {e}")
-        return "Sorry, I couldn't process your greeting. How can I assist you with your training?"
\ No newline at end of file
+        return GREETING_ERROR
+
+# Function 6: Stream the GPT response token by token
+
+def stream_openai(prompt, max_tokens=900, stage="answer"):
+    try:
+        yield from stream_complete(
+            stage,
+            [
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=int(max_tokens),
+            temperature=0.7
+        )
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        print(f"Error in stream_openai: {e}")
+        raise StreamFailed(GREETING_ERROR if stage == "greeting" else QUERY_ERROR) from e
+
+
+# Function 7: Response cache helpers
+
+def normalize_query(query):
+    words = re.findall(r"[a-z0-9]+", query.lower())
+    # A message made only of filler words ("hi!") keeps them
+    return " ".join(word for word in words if word not in FILLER_WORDS) or " ".join(words)
+
+
+def activity_fingerprint(*parts):
+    """Short hash of the processed activity data an answer was based on."""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def response_key(kind, user_input, athlete_id=None, fingerprint=None):
+    # athlete_id comes first so a sync can drop all of that athlete's answers
+    return (athlete_id, kind, normalize_query(user_input), fingerprint)
+
+
+def cached_response(key, produce):
+    response = response_cache.get(key)
+    if response is None:
+        response = produce()
+        if response not in (QUERY_ERROR, GREETING_ERROR):
+            response_cache.set(key, response)
+    return response
+
+
+def cached_stream(key, produce_stream):
+    response = response_cache.get(key)
+    if response is not None:
+        yield response
+        return
+
+    tokens = []
+    try:
+        for token in produce_stream():
+            tokens.append(token)
+            yield token
+    except StreamFailed as e:
+        # Only a complete answer is cached; the user sees the error after what was sent
+        yield f"\n\n{e.message}" if tokens else e.message
+        return
+
+    response_cache.set(key, "".join(tokens))
+
+
+# Function 8: Async variants for the ASGI chat path (no thread is held while OpenAI works)
+
+async def async_classify_query(query):
+    key = normalize_query(query)
+    classification = classification_cache.get(key)
+    if classification is None:
+        classification = await classify_locally_async(query, async_classify_query_llm)
+        if classification != "unknown":
+            classification_cache.set(key, classification)
+    return classification
+
+
+async def async_classify_query_llm(query):
+    try:
+        response = await async_complete(
+            "classify",
+            [
+                {"role": "user", "content": create_classification_prompt(query)}
+            ],
+            max_tokens=5  # A single word
+        )
+        return parse_classification(response.choices[0].message.content)
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        print(f"Error in async_classify_query_llm: {e}")
+        return "unknown"
+
+
+async def async_query_openai(prompt, max_tokens=900):
+    try:
+        response = await async_complete(
+            "answer",
+            [
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=int(max_tokens),
+            temperature=0.7
+        )
+        return response.choices[0].message.content.strip()
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        print(f"Error in async_query_openai: {e}")
+        return QUERY_ERROR
+
+
+async def async_get_greeting_response(user_input):
+    try:
+        response = await async_complete(
+            "greeting",
+            [
+                {"role": "user", "content": create_greeting_prompt(user_input)}
+            ],
+            max_tokens=50,  # Keep the response concise
+            temperature=0.7
+        )
+        return response.choices[0].message.content.strip()
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        print(f"Error in async_get_greeting_response: {e}")
+        return GREETING_ERROR
+
+
+async def async_cached_response(key, produce):
+    response = response_cache.get(key)
+    if response is None:
+        response = await produce()
+        if response not in (QUERY_ERROR, GREETING_ERROR):
+            response_cache.set(key, response)
+    return response
+
+
+async def async_stream_openai(prompt, max_tokens=900, stage="answer"):
+    try:
+        async for token in async_stream_complete(
+            stage,
+            [
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=int(max_tokens),
+            temperature=0.7
+        ):
+            yield token
+    except LLMOverloaded:
+        raise
+    except Exception as e:
+        print(f"Error in async_stream_openai: {e}")
+        raise StreamFailed(GREETING_ERROR if stage == "greeting" else QUERY_ERROR) from e
+
+
+async def async_cached_stream(key, produce_stream):
+    response = response_cache.get(key)
+    if response is not None:
+        yield response
+        return
+
+    tokens = []
+    try:
+        async for token in produce_stream():
+            tokens.append(token)
+            yield token
+    except StreamFailed as e:
+        yield f"\n\n{e.message}" if tokens else e.message
+        return
+
+    response_cache.set(key, "".join(tokens))
@@ -0,0 +1,172 @@
+import asyncio
+import os
+import random
+import re
+import threading
+
+# Local first stage for classify_query: a keyword/bigram scorer that settles obvious
+# greetings and obvious training questions without an LLM round trip.
+
+# Minimum score before the local answer is trusted (higher = more LLM fallbacks)
+THRESHOLD = float(os.getenv("CLASSIFIER_THRESHOLD", "2.0"))
+# Matching terms/bigrams needed for full weight; a lone training word is weak evidence
+# ("how do I run a python script", "who won the race for president"), so it counts half
+MIN_SIGNALS = 2
+# Fraction of local answers that are double-checked against the LLM in the background
+AUDIT_RATE = float(os.getenv("CLASSIFIER_AUDIT_RATE", "0.05"))
+
+GREETING_WORDS = {
+    "hi", "hello", "hey", "heya", "hiya", "yo", "sup", "howdy", "hallo", "hoi", "hai",
+    "morning", "afternoon", "evening", "good", "there", "thanks", "thank", "thx", "ty",
+    "cheers", "you", "bye", "goodbye", "ok", "okay", "cool", "great", "nice", "coach",
+    "matthew", "whats", "up", "how", "are", "doing", "ya",
+}
+GREETING_OPENERS = {
+    "hi", "hello", "hey", "heya", "hiya", "yo", "sup", "howdy", "hallo", "hoi", "hai",
+    "thanks", "thank", "thx", "ty", "cheers", "bye", "goodbye", "morning", "good",
+}
+
+# Weighted training vocabulary; bigrams catch phrases whose words are ambiguous alone
+RELEVANT_TERMS = {
+    "run": 2, "runs": 2, "running": 2, "ran": 2, "ride": 2, "rides": 2, "riding": 2,
+    "cycling": 2, "bike": 2, "swim": 2, "swimming": 2, "hike": 1.5, "marathon": 2,
+    "half": 0.5, "10k": 2, "5k": 2, "pace": 2, "tempo": 2, "interval": 2, "intervals": 2,
+    "training": 2, "train": 1.5, "workout": 2, "workouts": 2, "race": 2, "racing": 2,
+    "mileage": 2, "km": 1.5, "kilometers": 1.5, "miles": 1.5, "elevation": 2,
+    "recovery": 1.5, "overtraining": 2.5, "taper": 2, "vo2": 2.5, "threshold": 1.5,
+    "zone": 1.5, "zones": 1.5, "heart": 1, "hr": 1.5, "bpm": 2, "cadence": 2,
+    "endurance": 2, "fitness": 1.5, "injury": 1.5, "stretching": 1.5, "strava": 2,
+    "nutrition": 1.5, "carbs": 1.5, "hydration": 1.5, "gels": 1.5, "week": 0.5,
+    "weekly": 1, "progress": 1, "improve": 1, "faster": 1, "speed": 1, "sprint": 2,
+    "longrun": 2, "trail": 1.5, "cyclist": 2, "runner": 2, "activities": 1.5,
+}
+RELEVANT_BIGRAMS = {
+    "heart rate": 2, "long run": 2.5, "easy run": 2.5, "my week": 1.5, "last week": 1,
+    "my training": 2.5, "my runs": 2.5, "my rides": 2.5, "am i": 0.5, "rest day": 2.5,
+    "personal best": 2, "max hr": 2.5,
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(query):
+    return [token.replace("'", "") for token in TOKEN_PATTERN.findall(query.lower())]
+
+
+def score_query(query):
+    """Return (label, score) for the locally most likely class."""
+    tokens = tokenize(query)
+    if not tokens:
+        return "greeting", 0.0
+
+    bigrams = [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    signals = [RELEVANT_TERMS[token] for token in tokens if token in RELEVANT_TERMS]
+    signals += [RELEVANT_BIGRAMS[bigram] for bigram in bigrams if bigram in RELEVANT_BIGRAMS]
+    relevant_score = sum(signals)
+    if len(signals) < MIN_SIGNALS:
+        relevant_score /= 2
+
+    # A greeting is short, opens with a greeting word and has nothing else in it
+    greeting_score = 0.0
+    if tokens[0] in GREETING_OPENERS and len(tokens) <= 6:
+        known = sum(1 for token in tokens if token in GREETING_WORDS)
+        greeting_score = 3.0 * known / len(tokens)
+
+    if relevant_score > greeting_score:
+        return "relevant", relevant_score
+    return "greeting", greeting_score
+
+
+class ClassifierStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.local_hits = 0
+        # Agreement with the LLM, for audited local hits and for the local guess on fallbacks
+        self.agreement = {"audited": [0, 0], "fallback": [0, 0]}  # kind -> [agreed, compared]
+
+    def record(self, local_hit):
+        with self.lock:
+            self.total += 1
+            if local_hit:
+                self.local_hits += 1
+            total = self.total
+        if total % 50 == 0:
+            print(f"Classifier stats: {self.summary()}")  # Periodic log for threshold tuning
+
+    def record_agreement(self, kind, local_label, llm_label):
+        if llm_label not in {"greeting", "relevant", "irrelevant"}:
+            return
+        with self.lock:
+            self.agreement[kind][1] += 1
+            if local_label == llm_label:
+                self.agreement[kind][0] += 1
+
+    def summary(self):
+        with self.lock:
+            return {
+                "total": self.total,
+                "local_hits": self.local_hits,
+                "hit_rate": round(self.local_hits / self.total, 3) if self.total else 0.0,
+                "agreement": {
+                    kind: {"compared": compared, "rate": round(agreed / compared, 3) if compared else None}
+                    for kind, (agreed, compared) in self.agreement.items()
+                },
+                "threshold": THRESHOLD,
+            }
+
+
+classifier_stats = ClassifierStats()
+
+
+def classify_locally(query, llm_classifier):
+    """Classify with the local scorer, falling back to llm_classifier when unsure."""
+    label, score = score_query(query)
+
+    if score >= THRESHOLD:
+        classifier_stats.record(local_hit=True)
+
+        # Occasionally double-check a confident local answer without blocking the user
+        if random.random() < AUDIT_RATE:
+            def audit():
+                try:
+                    classifier_stats.record_agreement("audited", label, llm_classifier(query))
+                except Exception as e:
+                    print(f"Skipped classifier audit: {e}")  # e.g. the LLM gateway is busy
+
+            threading.Thread(target=audit, daemon=True).start()
+        return label
+
+    classification = llm_classifier(query)
+    classifier_stats.record(local_hit=False)
+    classifier_stats.record_agreement("fallback", label, classification)
+    return classification
+
+
+# Audit tasks started by classify_locally_async (kept so they aren't garbage collected)
+audit_tasks = set()
+
+
+async def classify_locally_async(query, llm_classifier):
+    """classify_locally for coroutines; llm_classifier is an async function."""
+    label, score = score_query(query)
+
+    if score >= THRESHOLD:
+        classifier_stats.record(local_hit=True)
+
+        if random.random() < AUDIT_RATE:
+            async def audit():
+                try:
+                    classifier_stats.record_agreement("audited", label, await llm_classifier(query))
+                except Exception as e:
+                    print(f"Skipped classifier audit: {e}")
+
+            task = asyncio.ensure_future(audit())
+            audit_tasks.add(task)
+            task.add_done_callback(audit_tasks.discard)
+        return label
+
+    classification = await llm_classifier(query)
+    classifier_stats.record(local_hit=False)
+    classifier_stats.record_agreement("fallback", label, classification)
+    return classification
@@ -0,0 +1,176 @@
+import hashlib
+import threading
+
+import numpy as np
+
+from app.models.activities import get_connection, get_route_candidates, get_route_clusters, save_route_fingerprint
+from app.services.geo import METERS_PER_DEGREE, decode_polyline
+from app.services.stats import RUN_SPORTS, pace_label, sport_family
+from app.services.thumbnails import route_thumbnail
+
+# Repeat-route clustering. Each route becomes a set of ~150 m grid cells, summarized
+# by a MinHash signature. LSH buckets point at the clusters a new route may belong
+# to, and it joins the one with the most similar recent route. No pairwise pass over history.
+
+RESAMPLE_STEP = 50  # metres between resampled points, so no cell along the route is skipped
+CELL_LAT = 0.0015  # ~165 m
+CELL_LNG = 0.0025  # ~170 m at 50° latitude
+SIGNATURE_SIZE = 64
+BANDS = 16  # of 4 values each; routes with Jaccard similarity 0.6 share a bucket ~90% of the time
+SIMILARITY = 0.5  # Estimated Jaccard similarity needed to join a cluster
+NO_ROUTE = 0  # cluster_id of activities without GPS data
+SYNC_CLUSTER_LIMIT = 200  # Larger syncs are clustered when usual routes are first requested
+
+# One lock per athlete, so a sync's background job and a usual routes request never
+# fingerprint the same routes at the same time
+athlete_locks = {}
+athlete_locks_lock = threading.Lock()
+
+# Fixed multiply-shift hash functions, identical in every process
+hash_seeds = np.random.default_rng(20240101).integers(1, 2 ** 63, size=(2, SIGNATURE_SIZE), dtype=np.uint64)
+HASH_A, HASH_B = hash_seeds[0] | np.uint64(1), hash_seeds[1]
+
+
+def route_cells(points):
+    """Grid cells (as int64 ids) visited by a route, resampled every RESAMPLE_STEP metres."""
+    if len(points) < 2:
+        return np.empty(0, dtype=np.int64)
+
+    # Distance along the route on a local flat projection
+    scale = np.cos(np.radians(points[:, 0].mean()))
+    steps = np.hypot(np.diff(points[:, 0]), np.diff(points[:, 1]) * scale) * METERS_PER_DEGREE
+    along = np.concatenate(([0.0], np.cumsum(steps)))
+    samples = np.arange(0, along[-1] + RESAMPLE_STEP, RESAMPLE_STEP).clip(max=along[-1])
+
+    lat = np.interp(samples, along, points[:, 0])
+    lng = np.interp(samples, along, points[:, 1])
+    cell_y = np.floor(lat / CELL_LAT).astype(np.int64)
+    cell_x = np.floor(lng / CELL_LNG).astype(np.int64)
+    return np.unique((cell_y << 32) + cell_x)
+
+
+def route_signature(cells):
+    """MinHash signature (SIGNATURE_SIZE uint32 values) of a set of cells."""
+    x = cells.astype(np.uint64)[None, :]
+    # Multiply-shift hashing; uint64 arithmetic wraps around, which is what we want
+    hashes = (HASH_A[:, None] * x + HASH_B[:, None]) >> np.uint64(32)
+    return hashes.min(axis=1).astype(np.uint32)
+
+
+def route_buckets(signature, sport):
+    """One LSH bucket id per band; the sport is part of the key so rides never match runs."""
+    buckets = []
+    for band in np.split(signature, BANDS):
+        digest = hashlib.blake2b(f"{sport}:".encode() + band.tobytes(), digest_size=8).digest()
+        buckets.append(int.from_bytes(digest, 'big', signed=True))
+    return buckets
+
+
+def route_sport(sport_type):
+    sport_type = (sport_type or '').lower()
+    return 'run' if sport_type in RUN_SPORTS else sport_family(sport_type)
+
+
+def assign_route_clusters(athlete_id, activities):
+    """Fingerprint activities (oldest first) and put each one in its route cluster."""
+    activities = sorted(activities, key=lambda act: act.get('start_date', ''))
+
+    conn = get_connection()
+    try:
+        with conn:
+            for act in activities:
+                cells = route_cells(decode_polyline((act.get('map') or {}).get('summary_polyline')))
+                if not len(cells):
+                    save_route_fingerprint(conn, athlete_id, act['id'], NO_ROUTE, [], [])
+                    continue
+
+                signature = route_signature(cells)
+                buckets = route_buckets(signature, route_sport(act.get('sport_type')))
+
+                # Cluster of the most similar recent route among those sharing a bucket,
+                # if it's similar enough; otherwise the route starts a cluster of its own
+                cluster_id, best = act['id'], SIMILARITY
+                for candidate_cluster, signatures in get_route_candidates(conn, athlete_id, buckets):
+                    if not signatures:
+                        continue
+                    similarity = float(np.max(np.mean(np.array(signatures) == signature, axis=1)))
+                    if similarity >= best:
+                        cluster_id, best = candidate_cluster, similarity
+
+                save_route_fingerprint(conn, athlete_id, act['id'], cluster_id, signature, buckets)
+    finally:
+        conn.close()
+
+
+def athlete_lock(athlete_id):
+    with athlete_locks_lock:
+        return athlete_locks.setdefault(athlete_id, threading.Lock())
+
+
+def cluster_missing_routes(athlete_id):
+    """Put every stored activity without a fingerprint in its cluster; returns {activity_id: cluster_id}."""
+    with athlete_lock(athlete_id):
+        clusters, missing = get_route_clusters(athlete_id)
+        if missing:
+            assign_route_clusters(athlete_id, missing)
+            clusters, _ = get_route_clusters(athlete_id)
+    return clusters
+
+
+def cluster_new_routes(athlete_id, new_activities):
+    """Cluster a sync's new activities (off the request path); a big sync is left to usual_routes."""
+    if len(new_activities) <= SYNC_CLUSTER_LIMIT:
+        cluster_missing_routes(athlete_id)
+
+
+def usual_routes(athlete_id, frame, min_count=3, limit=10):
+    """Routes run at least min_count times (most popular first) with their pace and HR over time."""
+    clusters, missing = get_route_clusters(athlete_id)
+    if missing:
+        # Activities the background job hasn't clustered yet (or left to us after a big sync)
+        clusters = cluster_missing_routes(athlete_id)
+
+    cluster = np.array([clusters.get(int(activity_id), NO_ROUTE) for activity_id in frame.ids], dtype=np.int64)
+    ids, counts = np.unique(cluster[cluster != NO_ROUTE], return_counts=True)
+    popular = ids[counts >= min_count][np.argsort(-counts[counts >= min_count], kind='stable')][:limit]
+
+    routes = []
+    for cluster_id in popular:
+        # Oldest first, so the lists read as progressions
+        members = np.flatnonzero(cluster == cluster_id)[::-1]
+        distance = frame.distance[members]
+        pace = np.where(distance > 0, frame.moving_time[members] / np.maximum(distance, 1) * 1000, np.nan)
+        heartrate = frame.average_heartrate[members]
+        latest = frame.activities[members[-1]]
+
+        routes.append({
+            "id": int(cluster_id),
+            "name": latest.get('name'),
+            "sport": route_sport(latest.get('sport_type')),
+            "count": len(members),
+            "distance": round(float(np.median(distance)) / 1000, 2),
+            "thumbnail": f"/api/thumbnails/{route_thumbnail((latest.get('map') or {}).get('summary_polyline') or '')}.svg",
+            "best_pace": pace_label(float(np.nanmin(pace))) if not np.isnan(pace).all() else None,
+            "pace_trend": trend_per_month(frame.start[members], pace),
+            "heartrate_trend": trend_per_month(frame.start[members], heartrate),
+            "activities": [
+                {
+                    "id": int(frame.ids[index]),
+                    "date": frame.activities[index].get('start_date_local'),
+                    "pace": None if np.isnan(p) else round(float(p)),
+                    "pace_label": None if np.isnan(p) else pace_label(float(p)),
+                    "heartrate": None if np.isnan(hr) else round(float(hr), 1),
+                }
+                for index, p, hr in zip(members, pace, heartrate)
+            ],
+        })
+    return routes
+
+
+def trend_per_month(start, values):
+    """Least-squares change of values per 30 days (None with fewer than 3 valid points)."""
+    valid = ~np.isnan(values)
+    if valid.sum() < 3 or np.ptp(start[valid]) == 0:
+        return None
+    slope = np.polyfit(start[valid] / (30 * 86400), values[valid], 1)[0]
+    return round(float(slope), 2)
@@ -0,0 +1,206 @@
+import math
+
+import numpy as np
+
+from app.services.cache import route_cache
+
+# Route geometry for the activity maps: Strava's encoded polylines are decoded and
+# simplified once on the server, so the browser only receives the points it can draw.
+
+# Web Mercator tiles are 256 px wide; one pixel spans 360 / (256 * 2**zoom) degrees
+TILE_SIZE = 256
+MIN_ZOOM = 0
+MAX_ZOOM = 18
+# Points closer than this many pixels to the simplified line are dropped
+TOLERANCE_PX = 0.5
+
+
+def decode_polyline(encoded):
+    """Decode a Google encoded polyline into an (n, 2) array of [lat, lng]."""
+    if not encoded:
+        return np.empty((0, 2), dtype=np.float64)
+
+    chars = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+
+    # Every value is a run of 5-bit chunks (least significant first); 0x20 marks "more follows"
+    last = (chars & 0x20) == 0
+    value_index = np.concatenate(([0], np.cumsum(last)[:-1]))
+    starts = np.flatnonzero(np.concatenate(([True], last[:-1])))
+    position = np.arange(len(chars)) - starts[value_index]
+    values = np.bincount(
+        value_index, weights=(chars & 0x1f) << (5 * position), minlength=int(last.sum())
+    ).astype(np.int64)
+
+    # Undo the zigzag sign encoding, then the delta encoding
+    values = np.where(values & 1, ~(values >> 1), values >> 1)
+    pairs = values[:len(values) // 2 * 2].reshape(-1, 2)
+    return np.cumsum(pairs, axis=0) / 1e5
+
+
+def simplify(points, tolerance):
+    """Douglas–Peucker: indices of the points to keep so no dropped point is further than tolerance."""
+    n = len(points)
+    if n < 3:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        # Distance of every point in between to the segment first-last, in one pass
+        start, end = points[first], points[last]
+        segment = end - start
+        inner = points[first + 1:last] - start
+        length_sq = segment @ segment
+        if length_sq == 0:
+            distances = np.hypot(inner[:, 0], inner[:, 1])
+        else:
+            t = np.clip(inner @ segment / length_sq, 0, 1)
+            offset = inner - t[:, None] * segment
+            distances = np.hypot(offset[:, 0], offset[:, 1])
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return np.flatnonzero(keep)
+
+
+def tolerance_for_zoom(zoom):
+    """Simplification tolerance in degrees of longitude for a map zoom level."""
+    return TOLERANCE_PX * 360 / (TILE_SIZE * 2 ** zoom)
+
+
+def fit_zoom(points, size_px):
+    """Highest zoom at which the whole route fits in a size_px square map."""
+    if len(points) < 2:
+        return MAX_ZOOM
+
+    lat, lng = points[:, 0], points[:, 1]
+    span = max(float(lng.max() - lng.min()), float(lat.max() - lat.min()) / math.cos(math.radians(lat.mean())))
+    if span <= 0:
+        return MAX_ZOOM
+    zoom = math.floor(math.log2(360 * size_px / (TILE_SIZE * span)))
+    return max(MIN_ZOOM, min(MAX_ZOOM, zoom))
+
+
+def simplify_route(points, zoom):
+    """Simplified [[lat, lng], ...] for drawing the route at the given zoom."""
+    if len(points) == 0:
+        return []
+
+    # Scale longitudes so both axes are in the same units before measuring distances
+    scale = math.cos(math.radians(float(points[:, 0].mean())))
+    projected = np.column_stack((points[:, 0] / scale, points[:, 1]))
+    kept = points[simplify(projected, tolerance_for_zoom(zoom))]
+    return np.round(kept, 5).tolist()
+
+
+def route_coordinates(activity_id, encoded, zoom=None, size_px=80):
+    """Simplified coordinates for an activity, cached per activity id and zoom.
+
+    Without a zoom the route is simplified for a size_px map fitted to the route.
+    Returns (zoom, coordinates).
+    """
+    if zoom is None:
+        zoom = route_cache.get((activity_id, 'fit', size_px))
+        if zoom is None:
+            zoom = fit_zoom(decode_polyline(encoded), size_px)
+            route_cache.set((activity_id, 'fit', size_px), zoom)
+
+    key = (activity_id, zoom)
+    coordinates = route_cache.get(key)
+    if coordinates is None:
+        coordinates = simplify_route(decode_polyline(encoded), zoom)
+        route_cache.set(key, coordinates)
+    return zoom, coordinates
+
+
+# Geohash cells of activity start points, used by the activity store's spatial index
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9  # ~5 m cells; any prefix is the enclosing larger cell
+METERS_PER_DEGREE = 111320
+
+
+def geohash(lat, lng, precision=GEOHASH_PRECISION):
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    code, value = [], 0
+    # Bits alternate between longitude and latitude, five bits per character
+    for bit in range(precision * 5):
+        bounds, coordinate = (lng_range, lng) if bit % 2 == 0 else (lat_range, lat)
+        middle = (bounds[0] + bounds[1]) / 2
+        if coordinate >= middle:
+            value = value * 2 + 1
+            bounds[0] = middle
+        else:
+            value = value * 2
+            bounds[1] = middle
+        if bit % 5 == 4:
+            code.append(GEOHASH_ALPHABET[value])
+            value = 0
+    return "".join(code)
+
+
+def geohash_cells(lat, lng, radius):
+    """Geohash prefixes whose cells together cover every point within radius metres."""
+    radius_lat = radius / METERS_PER_DEGREE
+    # Longitude degrees are shortest on the side of the circle nearest the pole
+    cos_lat = math.cos(math.radians(min(90.0, abs(lat) + radius_lat)))
+
+    # Use the finest precision whose cells are still at least radius wide in both directions
+    precision = 1
+    for candidate in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat = 180 / 2 ** (5 * candidate // 2)
+        cell_lng = 360 / 2 ** ((5 * candidate + 1) // 2)
+        if cell_lat * METERS_PER_DEGREE >= radius and cell_lng * METERS_PER_DEGREE * cos_lat >= radius:
+            precision = candidate
+            break
+
+    cell_lat = 180 / 2 ** (5 * precision // 2)
+    cell_lng = 360 / 2 ** ((5 * precision + 1) // 2)
+    # The start cell and its eight neighbours
+    return sorted({
+        geohash(
+            min(max(lat + i * cell_lat, -90.0), 90.0 - 1e-9),
+            (lng + j * cell_lng + 180) % 360 - 180,
+            precision
+        )
+        for i in (-1, 0, 1) for j in (-1, 0, 1)
+    })
+
+
+def haversine(lat, lng, lats, lngs):
+    """Distance in metres from one point to arrays of points."""
+    lat, lng, lats, lngs = map(np.radians, (lat, lng, np.asarray(lats), np.asarray(lngs)))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * 6371000 * np.arcsin(np.sqrt(np.minimum(a, 1)))
+
+
+def route_crosses_box(points, south, west, north, east):
+    """Whether any segment of the route passes through the box (Liang–Barsky clipping)."""
+    if len(points) == 0:
+        return False
+    inside = (points[:, 0] >= south) & (points[:, 0] <= north) & (points[:, 1] >= west) & (points[:, 1] <= east)
+    if inside.any() or len(points) < 2:
+        return bool(inside.any())
+
+    start, delta = points[:-1], np.diff(points, axis=0)
+    t0, t1 = np.zeros(len(delta)), np.ones(len(delta))
+    visible = np.ones(len(delta), dtype=bool)
+    for axis, low, high in ((0, south, north), (1, west, east)):
+        for p, q in ((-delta[:, axis], start[:, axis] - low), (delta[:, axis], high - start[:, axis])):
+            parallel = p == 0
+            visible &= ~(parallel & (q < 0))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = np.where(parallel, 0, q / np.where(parallel, 1, p))
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, t), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, t), t1)
+    return bool((visible & (t0 <= t1)).any())
@@ -0,0 +1,247 @@
+import os
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from app.models.activities import add_heatmap_counts, get_heatmap_summary, get_heatmap_tile, get_route_extent
+from app.services.cache import heatmap_cache, tile_cache
+from app.services.geo import TILE_SIZE, decode_polyline
+
+# Heatmap of every stored route as a pyramid of 256x256 count tiles, one level per
+# zoom. Routes are rasterized once (at the first request, then as new activities sync)
+# and their counts kept in the activity store as sparse tiles; PNG tiles are rendered
+# from those on demand.
+
+# Zoom level the routes are rasterized at; lower levels are binned from the same pixels
+BASE_ZOOM = int(os.getenv("HEATMAP_BASE_ZOOM", "14"))
+# Tiles past the base zoom are enlarged from it
+MAX_ZOOM = BASE_ZOOM + 3
+MAX_LATITUDE = 85.05112878  # Web Mercator cut-off
+# Activities rasterized per store update, which bounds memory while building a long history
+BUILD_BATCH = 500
+SYNC_HEATMAP_LIMIT = 200  # Larger syncs are counted when the heatmap is next requested
+
+
+def project(points, zoom):
+    """Global pixel coordinates (x, y) of [lat, lng] points at a zoom level."""
+    world = TILE_SIZE * 2 ** zoom
+    lat = np.clip(points[:, 0], -MAX_LATITUDE, MAX_LATITUDE)
+    sin = np.sin(np.radians(lat))
+    x = (points[:, 1] + 180) / 360 * world
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)) * world
+    return x, y
+
+
+def rasterize(routes, zoom):
+    """Pixels (x, y, route index) covered by the routes, with segments filled in every pixel."""
+    routes = [points for points in routes if len(points)]
+    if not routes:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    points = np.concatenate(routes)
+    route = np.repeat(np.arange(len(routes)), [len(points) for points in routes])
+    x, y = project(points, zoom)
+
+    # Interpolate ~1 px steps along each segment, but never between two routes
+    dx, dy = np.diff(x), np.diff(y)
+    same_route = route[1:] == route[:-1]
+    steps = np.where(same_route, np.ceil(np.maximum(np.abs(dx), np.abs(dy))), 0).astype(np.int64)
+    steps = np.maximum(steps, same_route)
+
+    segment = np.repeat(np.arange(len(steps)), steps)
+    step = np.arange(len(segment)) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = step / steps[segment]
+
+    # The last point of each route closes its final segment
+    ends = np.flatnonzero(np.append(~same_route, True))
+    px = np.concatenate((x[segment] + t * dx[segment], x[ends]))
+    py = np.concatenate((y[segment] + t * dy[segment], y[ends]))
+    pr = np.concatenate((route[segment], route[ends]))
+
+    last = TILE_SIZE * 2 ** zoom - 1
+    px = np.clip(np.floor(px), 0, last).astype(np.int64)
+    py = np.clip(np.floor(py), 0, last).astype(np.int64)
+    return px, py, pr
+
+
+def unique_pixels(x, y, route):
+    """Drop repeated (x, y, route) triples, so a route counts once per pixel it passes through."""
+    bits = BASE_ZOOM + 8  # Pixel coordinates at the base zoom fit in this many bits
+    keys = np.sort((route << (2 * bits)) | (x << bits) | y)
+    keys = keys[np.append(True, keys[1:] != keys[:-1])]
+    mask = (1 << bits) - 1
+    return (keys >> bits) & mask, keys & mask, keys >> (2 * bits)
+
+
+def tile_counts(zoom, x, y):
+    """Sparse counts {(zoom, tile x, tile y): (cells, counts)} of global pixel coordinates."""
+    tile = (x >> 8) * (1 << zoom) + (y >> 8)
+    cell = (y & 0xff) * TILE_SIZE + (x & 0xff)
+    keys = np.sort(tile * TILE_SIZE * TILE_SIZE + cell)
+    starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    counts = np.diff(np.append(starts, len(keys)))
+    tiles, cells = np.divmod(keys[starts], TILE_SIZE * TILE_SIZE)
+
+    result = {}
+    bounds = np.flatnonzero(np.diff(tiles)) + 1
+    for start, end in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(tiles)]))):
+        tile_x, tile_y = divmod(int(tiles[start]), 1 << zoom)
+        result[(zoom, tile_x, tile_y)] = (cells[start:end].astype(np.uint16), counts[start:end].astype(np.uint32))
+    return result
+
+
+def route_tiles(activities):
+    """Sparse tile counts of the activities' routes at every zoom level."""
+    routes = [decode_polyline((activity.get('map') or {}).get('summary_polyline')) for activity in activities]
+
+    # Each level halves the pixels of the one above, so the point sets shrink as we go
+    tiles = {}
+    x, y, route = rasterize(routes, BASE_ZOOM)
+    for zoom in range(BASE_ZOOM, -1, -1):
+        x, y, route = unique_pixels(x, y, route)
+        tiles.update(tile_counts(zoom, x, y))
+        x, y = x >> 1, y >> 1
+    return tiles
+
+
+class Heatmap:
+    """What tile rendering needs to know about an athlete's stored heatmap."""
+
+    def __init__(self, activities, level_max, bounds):
+        self.activities = activities  # Number of activities counted
+        self.level_max = level_max  # zoom -> highest count in any tile
+        self.bounds = bounds  # [[south, west], [north, east]]
+        # Activities are only ever added, so the count changes with every update
+        self.version = activities
+
+
+# One lock per athlete, so building one heatmap never holds up another athlete's
+athlete_locks = {}
+athlete_locks_lock = threading.Lock()
+
+
+def athlete_lock(athlete_id):
+    with athlete_locks_lock:
+        return athlete_locks.setdefault(athlete_id, threading.Lock())
+
+
+def add_routes(athlete_id, activities):
+    """Count the routes of activities in the stored heatmap, BUILD_BATCH at a time."""
+    for start in range(0, len(activities), BUILD_BATCH):
+        batch = activities[start:start + BUILD_BATCH]
+        while batch:
+            counted = add_heatmap_counts(athlete_id, [activity['id'] for activity in batch], route_tiles(batch))
+            if not counted:
+                break
+            # Another process counted some of these first; add the rest
+            counted = set(counted)
+            batch = [activity for activity in batch if activity['id'] not in counted]
+
+
+def get_heatmap(athlete_id):
+    """The athlete's heatmap, counting any stored activities it doesn't include yet first."""
+    heatmap = heatmap_cache.get(athlete_id)
+    if heatmap is not None:
+        return heatmap
+
+    with athlete_lock(athlete_id):
+        heatmap = heatmap_cache.get(athlete_id)
+        if heatmap is None:
+            counted, level_max, missing = get_heatmap_summary(athlete_id)
+            if missing:
+                # Everything on first use; after that only activities stored since
+                add_routes(athlete_id, missing)
+                counted, level_max, _ = get_heatmap_summary(athlete_id)
+            heatmap = Heatmap(counted, level_max, get_route_extent(athlete_id))
+            heatmap_cache.set(athlete_id, heatmap)
+    return heatmap
+
+
+def invalidate_heatmap(athlete_id):
+    """Forget the athlete's heatmap summary and tiles, e.g. because activities were stored."""
+    heatmap_cache.pop(athlete_id)
+    tile_cache.pop_where(lambda key: key[0] == athlete_id)
+
+
+def update_heatmap(athlete_id, new_activities):
+    """Count newly synced activities (off the request path); a big sync is left to get_heatmap."""
+    if len(new_activities) > SYNC_HEATMAP_LIMIT:
+        return
+    with athlete_lock(athlete_id):
+        add_routes(athlete_id, new_activities)
+    invalidate_heatmap(athlete_id)
+
+
+def tile_grid(athlete_id, zoom, x, y):
+    """Dense 256x256 counts for one tile, or None when no route passes through it."""
+    base = min(zoom, BASE_ZOOM)
+    scale = 1 << (zoom - base)
+    stored = get_heatmap_tile(athlete_id, base, x // scale, y // scale)
+    if stored is None:
+        return None
+
+    grid = np.zeros(TILE_SIZE * TILE_SIZE, dtype=np.uint32)
+    cells, counts = stored
+    grid[cells] = counts
+    grid = grid.reshape(TILE_SIZE, TILE_SIZE)
+    if scale == 1:
+        return grid
+
+    # Past the base zoom, enlarge the matching block of the base tile
+    size = TILE_SIZE // scale
+    block = grid[(y % scale) * size:(y % scale + 1) * size, (x % scale) * size:(x % scale + 1) * size]
+    return np.repeat(np.repeat(block, scale, axis=0), scale, axis=1)
+
+
+# Transparent → Strava orange → pale yellow, indexed by scaled intensity (0-255)
+ramp = np.linspace(0, 1, 256)
+COLOR_RAMP = np.column_stack((
+    np.full(256, 251),
+    82 + (ramp * 173),
+    1 + (ramp ** 2 * 180),
+    np.where(ramp > 0, 90 + ramp * 165, 0),
+)).astype(np.uint8)
+
+
+def encode_png(rgba):
+    """Minimal PNG encoder for an (h, w, 4) uint8 array."""
+    height, width = rgba.shape[:2]
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    # Every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    raw[:, 1:] = rgba.reshape(height, -1)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def render_tile(athlete_id, zoom, x, y):
+    """PNG bytes and version for a heatmap tile, cached until the heatmap changes."""
+    heatmap = get_heatmap(athlete_id)
+    key = (athlete_id, heatmap.version, zoom, x, y)
+    png = tile_cache.get(key)
+    if png is not None:
+        return png, heatmap.version
+
+    counts = tile_grid(athlete_id, zoom, x, y)
+    if counts is None:
+        png = EMPTY_TILE
+    else:
+        # Log scale, so a few well-worn streets don't wash out everything else
+        level_max = heatmap.level_max.get(min(zoom, BASE_ZOOM), 1)
+        intensity = np.log1p(counts) / np.log1p(max(level_max, 1))
+        png = encode_png(COLOR_RAMP[np.ceil(intensity * 255).astype(np.uint8)])
+    tile_cache.set(key, png)
+    return png, heatmap.version
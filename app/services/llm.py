@@ -0,0 +1,425 @@
+import asyncio
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager
+from dotenv import load_dotenv
+import os
+import threading
+import time
+
+from openai import (APIConnectionError, APITimeoutError, AsyncOpenAI, InternalServerError, OpenAI,
+                    RateLimitError)
+
+load_dotenv()
+# No retries inside the client: a failed call falls back to the next model tier, and
+# retrying the last one would run past the stage's latency budget
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+# Gateway for every outgoing OpenAI call. At most MAX_CONCURRENCY calls run at once;
+# up to MAX_QUEUE more wait for a free slot, and anything beyond that is turned away
+# immediately instead of piling up blocked threads and upstream 429s.
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))  # Seconds a call may wait for a slot
+CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30"))  # Seconds a single OpenAI request may take
+
+
+class LLMOverloaded(Exception):
+    def __init__(self, status_code, retry_after):
+        reason = "queue is full" if status_code == 429 else "no slot freed up in time"
+        super().__init__(f"LLM gateway overloaded: {reason}")
+        self.status_code = status_code  # 429 when rejected outright, 503 after waiting
+        self.retry_after = retry_after
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_queue=MAX_QUEUE,
+                 queue_timeout=QUEUE_TIMEOUT, call_timeout=CALL_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+
+        self.in_flight = 0
+        self.queued = 0
+        self._cond = threading.Condition()
+        self._async_waiters = deque()  # (loop, future) of coroutines waiting for a slot
+
+        # Metrics
+        self.peak_in_flight = 0
+        self.peak_queued = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.timeouts = 0
+        self.upstream_rate_limited = 0
+        self._waits = deque(maxlen=1000)  # Recent queue wait times in seconds
+
+    def _admit(self, waited):
+        self.in_flight += 1
+        self.admitted += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self._waits.append(waited)
+
+    def _enqueue(self):
+        """Reserve a queue position, or raise if the queue is full."""
+        if self.queued >= self.max_queue:
+            self.rejected_full += 1
+            raise LLMOverloaded(429, self.queue_timeout)
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+
+    def _release(self, error=None):
+        with self._cond:
+            self.in_flight -= 1
+            if isinstance(error, APITimeoutError):
+                self.timeouts += 1
+            elif isinstance(error, RateLimitError):
+                self.upstream_rate_limited += 1
+
+            # Hand the slot to one waiting thread and one waiting coroutine; whoever
+            # gets there first takes it and the other goes back to waiting
+            self._cond.notify()
+            self._wake_next()
+
+    def _wake_next(self):
+        while self._async_waiters:
+            loop, future = self._async_waiters.popleft()
+            if not future.done():
+                loop.call_soon_threadsafe(_wake, future)
+                return
+
+    def _stop_waiting(self, loop, future):
+        """Drop a coroutine that gives up waiting. If it was already picked for a wakeup
+        (which may not have reached its future yet), pass that on to the next waiter."""
+        try:
+            self._async_waiters.remove((loop, future))
+        except ValueError:
+            self._wake_next()
+
+    def check(self):
+        """Raise right away if a new call would be rejected (for responses that can't
+        change their status code once they've started)."""
+        with self._cond:
+            if self.in_flight >= self.max_concurrency and self.queued >= self.max_queue:
+                self.rejected_full += 1
+                raise LLMOverloaded(429, self.queue_timeout)
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the concurrent call slots for the duration of the block."""
+        started = time.monotonic()
+        with self._cond:
+            if self.in_flight >= self.max_concurrency:
+                self._enqueue()
+                try:
+                    deadline = started + self.queue_timeout
+                    while self.in_flight >= self.max_concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected_timeout += 1
+                            raise LLMOverloaded(503, self.queue_timeout)
+                        self._cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self._admit(time.monotonic() - started)
+
+        # finally, so a stream that is closed early still gives its slot back
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(error)
+
+    @asynccontextmanager
+    async def async_slot(self):
+        """slot() for coroutines: waits on a future instead of blocking a thread."""
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+
+        with self._cond:
+            admitted = self.in_flight < self.max_concurrency
+            if admitted:
+                self._admit(0.0)
+            else:
+                self._enqueue()
+
+        if not admitted:
+            deadline = started + self.queue_timeout
+            try:
+                while True:
+                    with self._cond:
+                        if self.in_flight < self.max_concurrency:
+                            self._admit(time.monotonic() - started)
+                            break
+                        future = loop.create_future()
+                        self._async_waiters.append((loop, future))
+
+                    remaining = deadline - time.monotonic()
+                    try:
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError
+                        await asyncio.wait_for(future, remaining)
+                    except asyncio.TimeoutError:
+                        with self._cond:
+                            self._stop_waiting(loop, future)
+                            self.rejected_timeout += 1
+                        raise LLMOverloaded(503, self.queue_timeout)
+                    except asyncio.CancelledError:
+                        # Don't swallow a wakeup meant for us when the request goes away
+                        with self._cond:
+                            self._stop_waiting(loop, future)
+                        raise
+            finally:
+                with self._cond:
+                    self.queued -= 1
+
+        # finally, so a stream that is closed early still gives its slot back
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(error)
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": self.queued,
+                "peak_in_flight": self.peak_in_flight,
+                "peak_queued": self.peak_queued,
+                "admitted": self.admitted,
+                "rejected_full": self.rejected_full,
+                "rejected_timeout": self.rejected_timeout,
+                "timeouts": self.timeouts,
+                "upstream_rate_limited": self.upstream_rate_limited,
+                "wait_ms": {
+                    "avg": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+                    "p95": round(1000 * waits[min(len(waits) - 1, int(0.95 * len(waits)))], 1) if waits else 0.0,
+                    "max": round(1000 * waits[-1], 1) if waits else 0.0,
+                },
+            }
+
+
+# Shared by every OpenAI call in this process
+llm_gateway = LLMGateway()
+
+
+# Model routing: each chat stage goes to the cheapest tier that does the job. The stage's
+# latency budget (seconds) is shared by its tiers: every attempt may use an even share of
+# what earlier attempts left, so a stage never spends more than its budget upstream.
+
+MODEL_TIERS = {
+    "small": os.getenv("OPENAI_SMALL_MODEL", "gpt-4o-mini"),
+    "large": os.getenv("OPENAI_LARGE_MODEL", "gpt-4o"),
+}
+
+STAGE_ROUTES = {
+    "classify": (("small", "large"), float(os.getenv("LLM_CLASSIFY_BUDGET", "3"))),
+    "greeting": (("small", "large"), float(os.getenv("LLM_GREETING_BUDGET", "5"))),
+    "answer": (("large", "small"), float(os.getenv("LLM_ANSWER_BUDGET", "30"))),
+}
+
+# Upstream failures worth retrying on another tier (APITimeoutError is a connection error)
+FALLBACK_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+# Shortest timeout an attempt gets; with less of the budget left, no further tier is tried
+MIN_ATTEMPT_TIMEOUT = 0.5
+
+
+def route(stage):
+    """([model, ...] to try in order, latency budget) for a stage."""
+    tiers, budget = STAGE_ROUTES[stage]
+    models = []
+    for tier in tiers:
+        if MODEL_TIERS[tier] not in models:
+            models.append(MODEL_TIERS[tier])
+    return models, budget
+
+
+def attempt_timeout(remaining, attempts_left):
+    """Timeout for the next attempt: an even share of the budget that is left."""
+    return max(min(remaining / attempts_left, llm_gateway.call_timeout), MIN_ATTEMPT_TIMEOUT)
+
+
+class StageStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = defaultdict(lambda: {
+            "calls": 0, "timeouts": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "latencies": deque(maxlen=500),
+        })  # (stage, model) -> counters
+        self.fallbacks = defaultdict(int)  # stage -> attempts handed to the next tier
+
+    def record(self, stage, model, latency, usage=None, error=None):
+        with self.lock:
+            entry = self.calls[(stage, model)]
+            entry["calls"] += 1
+            if isinstance(error, APITimeoutError):
+                entry["timeouts"] += 1
+            elif error is not None:
+                entry["errors"] += 1
+            else:
+                entry["latencies"].append(latency)
+            if usage is not None:
+                entry["prompt_tokens"] += usage.prompt_tokens or 0
+                entry["completion_tokens"] += usage.completion_tokens or 0
+
+    def record_fallback(self, stage):
+        with self.lock:
+            self.fallbacks[stage] += 1
+
+    def summary(self):
+        with self.lock:
+            stages = {}
+            for (stage, model), entry in self.calls.items():
+                latencies = sorted(entry["latencies"])
+                stages.setdefault(stage, {"fallbacks": self.fallbacks.get(stage, 0), "models": {}})
+                stages[stage]["models"][model] = {
+                    "calls": entry["calls"],
+                    "timeouts": entry["timeouts"],
+                    "errors": entry["errors"],
+                    "prompt_tokens": entry["prompt_tokens"],
+                    "completion_tokens": entry["completion_tokens"],
+                    "latency_ms": {
+                        "avg": round(1000 * sum(latencies) / len(latencies), 1) if latencies else 0.0,
+                        "p95": round(1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 1) if latencies else 0.0,
+                    },
+                }
+            return stages
+
+
+stage_stats = StageStats()
+
+
+def complete(stage, messages, **kwargs):
+    """Chat completion for a stage, falling back to the next tier on timeouts and
+    upstream errors. Raises LLMOverloaded or the last tier's error."""
+    models, remaining = route(stage)
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        try:
+            with llm_gateway.slot():
+                started = time.monotonic()
+                try:
+                    response = client.chat.completions.create(
+                        model=model, messages=messages, timeout=attempt_timeout(remaining, len(models) - i), **kwargs
+                    )
+                except Exception as e:
+                    remaining -= time.monotonic() - started
+                    stage_stats.record(stage, model, time.monotonic() - started, error=e)
+                    raise
+                stage_stats.record(stage, model, time.monotonic() - started, response.usage)
+                return response
+        except FALLBACK_ERRORS as e:
+            if last or remaining <= MIN_ATTEMPT_TIMEOUT:  # Out of tiers or out of budget
+                raise
+            print(f"{stage}: {model} failed ({e}), falling back to {models[i + 1]}")
+            stage_stats.record_fallback(stage)
+
+
+async def async_complete(stage, messages, **kwargs):
+    """complete() for coroutines."""
+    models, remaining = route(stage)
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        try:
+            async with llm_gateway.async_slot():
+                started = time.monotonic()
+                try:
+                    response = await async_client.chat.completions.create(
+                        model=model, messages=messages, timeout=attempt_timeout(remaining, len(models) - i), **kwargs
+                    )
+                except Exception as e:
+                    remaining -= time.monotonic() - started
+                    stage_stats.record(stage, model, time.monotonic() - started, error=e)
+                    raise
+                stage_stats.record(stage, model, time.monotonic() - started, response.usage)
+                return response
+        except FALLBACK_ERRORS as e:
+            if last or remaining <= MIN_ATTEMPT_TIMEOUT:  # Out of tiers or out of budget
+                raise
+            print(f"{stage}: {model} failed ({e}), falling back to {models[i + 1]}")
+            stage_stats.record_fallback(stage)
+
+
+def stream_complete(stage, messages, **kwargs):
+    """Yield content deltas for a stage. Falls back to the next tier only while
+    nothing has been sent yet; the slot is held until the last token."""
+    models, remaining = route(stage)
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        sent = False
+        try:
+            with llm_gateway.slot():
+                started = time.monotonic()
+                usage = None
+                try:
+                    stream = client.chat.completions.create(
+                        model=model, messages=messages, timeout=attempt_timeout(remaining, len(models) - i),
+                        stream=True, stream_options={"include_usage": True}, **kwargs
+                    )
+                    for chunk in stream:
+                        usage = chunk.usage or usage  # Sent on the final chunk
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            sent = True
+                            yield chunk.choices[0].delta.content
+                except Exception as e:
+                    remaining -= time.monotonic() - started
+                    stage_stats.record(stage, model, time.monotonic() - started, error=e)
+                    raise
+                stage_stats.record(stage, model, time.monotonic() - started, usage)
+                return
+        except FALLBACK_ERRORS as e:
+            if last or sent or remaining <= MIN_ATTEMPT_TIMEOUT:
+                raise
+            print(f"{stage}: {model} failed ({e}), falling back to {models[i + 1]}")
+            stage_stats.record_fallback(stage)
+
+
+async def async_stream_complete(stage, messages, **kwargs):
+    """stream_complete() for coroutines (an async generator)."""
+    models, remaining = route(stage)
+    for i, model in enumerate(models):
+        last = i == len(models) - 1
+        sent = False
+        try:
+            async with llm_gateway.async_slot():
+                started = time.monotonic()
+                usage = None
+                try:
+                    stream = await async_client.chat.completions.create(
+                        model=model, messages=messages, timeout=attempt_timeout(remaining, len(models) - i),
+                        stream=True, stream_options={"include_usage": True}, **kwargs
+                    )
+                    async for chunk in stream:
+                        usage = chunk.usage or usage
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            sent = True
+                            yield chunk.choices[0].delta.content
+                except Exception as e:
+                    remaining -= time.monotonic() - started
+                    stage_stats.record(stage, model, time.monotonic() - started, error=e)
+                    raise
+                stage_stats.record(stage, model, time.monotonic() - started, usage)
+                return
+        except FALLBACK_ERRORS as e:
+            if last or sent or remaining <= MIN_ATTEMPT_TIMEOUT:
+                raise
+            print(f"{stage}: {model} failed ({e}), falling back to {models[i + 1]}")
+            stage_stats.record_fallback(stage)
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+import time
+
+# Request priorities: page loads go before background syncs
+INTERACTIVE = 0
+BACKGROUND = 1
+
+SHORT_WINDOW = 15 * 60  # Strava's short quota resets every quarter hour
+DAILY_WINDOW = 24 * 3600  # and the daily quota at midnight UTC
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Strava rate limit reached, retry in {int(retry_after)}s")
+        self.retry_after = retry_after
+
+
+# Scheduler for outgoing Strava calls. Tracks the 15-minute and daily quota windows
+# reported in X-RateLimit-Limit / X-RateLimit-Usage and spaces requests with a token
+# bucket. Background calls only use part of each quota and always yield to waiting
+# interactive calls.
+
+class StravaScheduler:
+    def __init__(self, short_limit=100, daily_limit=1000, burst=10, background_share=0.8):
+        self.short_limit = short_limit
+        self.daily_limit = daily_limit
+        self.short_usage = 0
+        self.daily_usage = 0
+        self.burst = burst
+        self.background_share = background_share
+
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0  # Wall clock, set after a 429
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._cond = threading.Condition()
+
+        now = time.time()
+        self._short_resets_at = (now // SHORT_WINDOW + 1) * SHORT_WINDOW
+        self._daily_resets_at = (now // DAILY_WINDOW + 1) * DAILY_WINDOW
+
+    @property
+    def refill_rate(self):
+        # Spread the short quota evenly over its window
+        return self.short_limit / SHORT_WINDOW
+
+    def _roll_windows(self, now):
+        if now >= self._short_resets_at:
+            self.short_usage = 0
+            self._short_resets_at = (now // SHORT_WINDOW + 1) * SHORT_WINDOW
+        if now >= self._daily_resets_at:
+            self.daily_usage = 0
+            self._daily_resets_at = (now // DAILY_WINDOW + 1) * DAILY_WINDOW
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.refill_rate)
+        self._refilled_at = now
+
+    def _delay(self, priority):
+        """Seconds until a request of this priority may be sent (0 means now)."""
+        now = time.time()
+        self._roll_windows(now)
+
+        if now < self._blocked_until:
+            return self._blocked_until - now
+
+        share = 1.0 if priority == INTERACTIVE else self.background_share
+        if self.daily_usage >= self.daily_limit * share:
+            return self._daily_resets_at - now
+        if self.short_usage >= self.short_limit * share:
+            return self._short_resets_at - now
+
+        # Background calls step aside while an interactive call is waiting
+        if priority == BACKGROUND and self._waiting[INTERACTIVE]:
+            return 0.05
+
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.refill_rate
+
+    def _take(self):
+        self._tokens -= 1
+        self.short_usage += 1
+        self.daily_usage += 1
+
+    def acquire(self, priority=INTERACTIVE, max_wait=None):
+        """Block until a request may be sent, or raise RateLimitExceeded if that takes
+        longer than max_wait seconds."""
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    delay = self._delay(priority)
+                    if delay <= 0:
+                        self._take()
+                        return
+
+                    if deadline is not None and delay > deadline - time.monotonic():
+                        raise RateLimitExceeded(delay)
+                    self._cond.wait(delay)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    async def acquire_async(self, priority=INTERACTIVE, max_wait=None):
+        """acquire() for coroutines: waits with asyncio.sleep instead of blocking a thread."""
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+
+        with self._cond:
+            self._waiting[priority] += 1
+        try:
+            while True:
+                with self._cond:
+                    delay = self._delay(priority)
+                    if delay <= 0:
+                        self._take()
+                        return
+
+                if deadline is not None and delay > deadline - time.monotonic():
+                    raise RateLimitExceeded(delay)
+                # Re-check regularly; quota updates from other requests may free us earlier
+                await asyncio.sleep(min(delay, 0.5))
+        finally:
+            with self._cond:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def update(self, headers, status_code=200):
+        """Sync quota state from Strava's rate limit headers."""
+        limits = headers.get('X-RateLimit-Limit')
+        usage = headers.get('X-RateLimit-Usage')
+
+        with self._cond:
+            self._roll_windows(time.time())
+            try:
+                if limits:
+                    self.short_limit, self.daily_limit = (int(v) for v in limits.split(','))
+                if usage:
+                    short_usage, daily_usage = (int(v) for v in usage.split(','))
+                    # Other workers share the quota, so the server's count wins if higher
+                    self.short_usage = max(self.short_usage, short_usage)
+                    self.daily_usage = max(self.daily_usage, daily_usage)
+            except ValueError:
+                print(f"Unexpected rate limit headers: {limits} / {usage}")
+
+            if status_code == 429:
+                retry_after = headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    self._blocked_until = time.time() + int(retry_after)
+                elif self.daily_usage >= self.daily_limit:
+                    self._blocked_until = self._daily_resets_at
+                else:
+                    self._blocked_until = self._short_resets_at
+
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "short_usage": self.short_usage,
+                "short_limit": self.short_limit,
+                "daily_usage": self.daily_usage,
+                "daily_limit": self.daily_limit,
+                "waiting": dict(self._waiting),
+            }
+
+
+# Shared by every Strava call in this process
+scheduler = StravaScheduler()
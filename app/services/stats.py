@@ -0,0 +1,281 @@
+from datetime import timedelta
+
+import numpy as np
+
+# Columnar view over an athlete's activities. Built once per sync so every
+# dashboard section can work on NumPy masks instead of re-parsing dates.
+
+class ActivityFrame:
+    def __init__(self, activities):
+        # Parse every start date exactly once ('2024-01-31T07:15:00Z' -> epoch seconds)
+        start = np.array(
+            [act['start_date_local'][:19] for act in activities], dtype='datetime64[s]'
+        ).astype(np.int64)
+
+        # Most recent first, like the rest of the dashboard expects
+        order = np.argsort(-start, kind='stable')
+        self.activities = [activities[i] for i in order]
+        self.start = start[order]
+
+        self.ids = np.array([act.get('id', 0) for act in self.activities], dtype=np.int64)
+        self.distance = np.array([act.get('distance', 0) for act in self.activities], dtype=np.float64)
+        self.moving_time = np.array([act.get('moving_time', 0) for act in self.activities], dtype=np.float64)
+        self.elevation = np.array(
+            [act.get('total_elevation_gain', 0) for act in self.activities], dtype=np.float64
+        )
+        self.average_heartrate = np.array(
+            [act.get('average_heartrate', np.nan) for act in self.activities], dtype=np.float64
+        )
+
+        # Sport types are stored as small integer codes into self.sport_types
+        sport_names = [act.get('sport_type', '').lower() for act in self.activities]
+        self.sport_types, codes = np.unique(np.array(sport_names, dtype=str), return_inverse=True)
+        self.sport_types = [str(name) for name in self.sport_types]
+        self.sport_code = codes.astype(np.int16).reshape(-1)
+
+        # Calendar month of each activity (months since 1970-01)
+        self.month = self.start.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+
+        # Derived results; a sync builds a new frame, so these never go stale
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.activities)
+
+    def memo(self, key, compute):
+        """Return compute(), computed only once per frame and key."""
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def between(self, start=None, end=None, include_start=True):
+        """Boolean mask for activities with start <= t <= end (epoch seconds)."""
+        mask = np.ones(len(self), dtype=bool)
+        if start is not None:
+            mask &= (self.start >= start) if include_start else (self.start > start)
+        if end is not None:
+            mask &= self.start <= end
+        return mask
+
+    def sport_mask(self, sport_types):
+        """Boolean mask for activities whose lowercased sport_type is in sport_types."""
+        codes = [i for i, name in enumerate(self.sport_types) if name in sport_types]
+        return np.isin(self.sport_code, codes)
+
+    def totals(self, mask):
+        """Summed distance (km), moving time (hrs), elevation (m) and count for a mask."""
+        return {
+            "count": int(mask.sum()),
+            "distance": float(self.distance[mask].sum()) / 1000,
+            "time": float(self.moving_time[mask].sum()) / 3600,
+            "elevation": float(self.elevation[mask].sum()),
+        }
+
+
+def to_epoch(dt):
+    """Epoch seconds of a datetime's wall-clock time, matching ActivityFrame.start."""
+    return int(np.datetime64(dt.replace(tzinfo=None), 's').astype(np.int64))
+
+
+def month_label(month):
+    """Format a months-since-1970 value as "Jan '24"."""
+    year, month_of_year = divmod(int(month), 12)
+    names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+    return f"{names[month_of_year]} '{str(1970 + year)[-2:]}"
+
+
+WEEK = 7 * 24 * 3600
+
+# Sport types that are grouped under one filter button
+SPORT_FAMILIES = {
+    'ride': ['ride', 'virtualride', 'ebikeride', 'handcycle'],
+}
+
+
+def sport_family(sport_type):
+    for family, members in SPORT_FAMILIES.items():
+        if sport_type in members:
+            return family
+    return sport_type
+
+
+def current_week_start(now):
+    """Monday 00:00 of the week containing `now`."""
+    start_of_week = now - timedelta(days=now.weekday())
+    return start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def weekly_series(frame, start_of_current_week, weeks=12, include=()):
+    """Bucket every activity by week and sport family in a single pass.
+
+    Returns the labels of the `weeks` weeks ending with the current one and,
+    per sport family (plus 'all'), NumPy arrays of activity count, distance (km),
+    moving time (hrs) and elevation (m) per week, oldest week first. Families listed in
+    `include` are always present, zero-filled if the athlete has none.
+    """
+    first_week = to_epoch(start_of_current_week) - (weeks - 1) * WEEK
+    week_index = (frame.start - first_week) // WEEK
+    in_range = (week_index >= 0) & (week_index < weeks)
+
+    # Map each sport code to a family code so rides of every kind share a bucket
+    families = sorted({sport_family(name) for name in frame.sport_types} | set(include) - {'all'})
+    family_lookup = np.array(
+        [families.index(sport_family(name)) for name in frame.sport_types], dtype=np.int64
+    )
+    family_code = family_lookup[frame.sport_code]
+
+    bucket = family_code[in_range] * weeks + week_index[in_range]
+    size = max(len(families), 1) * weeks
+
+    def bucketed(values):
+        return np.bincount(bucket, weights=values[in_range], minlength=size).reshape(-1, weeks)
+
+    count = np.bincount(bucket, minlength=size).reshape(-1, weeks)
+    distance = bucketed(frame.distance) / 1000
+    time = bucketed(frame.moving_time) / 3600
+    elevation = bucketed(frame.elevation)
+
+    series = {
+        family: {"count": count[i], "distance": distance[i], "time": time[i], "elevation": elevation[i]}
+        for i, family in enumerate(families)
+    }
+    series['all'] = {
+        "count": count.sum(axis=0),
+        "distance": distance.sum(axis=0),
+        "time": time.sum(axis=0),
+        "elevation": elevation.sum(axis=0),
+    }
+
+    labels = []
+    for i in range(weeks - 1, -1, -1):
+        start_of_week = start_of_current_week - timedelta(weeks=i)
+        end_of_week = start_of_week + timedelta(days=6, hours=23, minutes=59, seconds=59)
+        labels.append(f"{start_of_week.strftime('%b %d')} - {end_of_week.strftime('%b %d')}")
+
+    return labels, series
+
+
+def weekly_stats_by_sport(frame, start_of_current_week, weeks=12, include=('run', 'ride')):
+    """Dashboard-ready weekly stats and chart data for every sport filter at once."""
+    labels, series = weekly_series(frame, start_of_current_week, weeks, include)
+
+    result = {}
+    for sport, values in series.items():
+        weekly_distance = float(values["distance"][-1])
+        weekly_time = float(values["time"][-1])
+        weekly_elevation = float(values["elevation"][-1])
+
+        result[sport] = {
+            "weekly_stats": {
+                "distance": f"{weekly_distance:.2f} km",
+                "time": f"{int(weekly_time)} hrs {int((weekly_time % 1) * 60)} mins",
+                "elevation": f"{weekly_elevation:.0f} m"
+            },
+            "weekly_chart": {
+                "labels": labels,
+                "distances": [round(float(d), 2) for d in values["distance"]]
+            }
+        }
+
+    return result
+
+
+def monthly_rollups(frame, now, months=6):
+    """Count, distance (km), moving time (hrs) and average HR for each of the last
+    `months` calendar months, oldest first."""
+    current_month = int(np.datetime64(now.replace(tzinfo=None), 'M').astype(np.int64))
+    month_index = frame.month - (current_month - months + 1)
+    in_range = (month_index >= 0) & (month_index < months)
+    index = month_index[in_range]
+
+    has_hr = ~np.isnan(frame.average_heartrate[in_range])
+    count = np.bincount(index, minlength=months)
+    distance = np.bincount(index, weights=frame.distance[in_range], minlength=months) / 1000
+    time = np.bincount(index, weights=frame.moving_time[in_range], minlength=months) / 3600
+    hr_sum = np.bincount(index[has_hr], weights=frame.average_heartrate[in_range][has_hr], minlength=months)
+    hr_count = np.bincount(index[has_hr], minlength=months)
+
+    return [
+        {
+            "label": month_label(current_month - months + 1 + i),
+            "count": int(count[i]),
+            "distance": float(distance[i]),
+            "time": float(time[i]),
+            "average_heartrate": round(hr_sum[i] / hr_count[i]) if hr_count[i] else None,
+        }
+        for i in range(months)
+    ]
+
+
+# Longest gap (seconds) between two stream samples that still counts as moving
+MAX_SAMPLE_GAP = 30
+
+
+def time_in_zones(streams, zone_table):
+    """Seconds spent in each heart rate zone over any number of (time, heartrate)
+    streams, in one histogram over all samples. Index 0 holds time outside every
+    zone, index i + 1 the time in zone_table.zones[i]."""
+    streams = [(time, heartrate) for time, heartrate in streams if len(time) > 1]
+    size = len(zone_table.zones) + 1
+    if not streams:
+        return np.zeros(size)
+
+    time = np.concatenate([t for t, _ in streams]).astype(np.int64)
+    heartrate = np.concatenate([hr for _, hr in streams])
+
+    # Each sample's heart rate holds until the next sample of the same activity;
+    # the last sample of every activity and long pauses don't count
+    durations = np.diff(time, append=time[-1])
+    durations[np.cumsum([len(t) for t, _ in streams]) - 1] = 0
+    durations = np.clip(durations, 0, MAX_SAMPLE_GAP)
+
+    zones = zone_table.zone_indices(heartrate)
+    return np.bincount(zones + 1, weights=durations, minlength=size)
+
+
+RUN_SPORTS = ['run', 'trailrun', 'treadmill', 'virtualrun', 'racerun']
+
+
+def pace_label(seconds):
+    """Format a pace in seconds per km as "4:20"."""
+    return f"{int(seconds) // 60}:{int(seconds) % 60:02d}"
+
+
+def hr_by_pace(frame, bin_width=20, pace_min=240, pace_max=480, months=None, now=None):
+    """Average heart rate per pace bin and calendar month for runs.
+
+    Paces (seconds per km) are binned into [pace_min, pace_max) in steps of bin_width,
+    optionally only over the last `months` calendar months. Returns an ordered dict of
+    pace label ("4:00–4:20") -> [{"month_year", "bpm"}, ...] sorted by month; bins
+    without runs get an empty list.
+    """
+    running = frame.sport_mask(RUN_SPORTS)
+    running &= (frame.distance != 0) & (frame.moving_time != 0)
+    running &= ~np.isnan(frame.average_heartrate) & (frame.average_heartrate != 0)
+    if months is not None:
+        current_month = int(np.datetime64(now.replace(tzinfo=None), 'M').astype(np.int64))
+        running &= frame.month > current_month - months
+
+    edges = np.append(np.arange(pace_min, pace_max, bin_width), pace_max)
+    labels = [f"{pace_label(low)}–{pace_label(high)}" for low, high in zip(edges[:-1], edges[1:])]
+
+    paces = frame.moving_time[running] / (frame.distance[running] / 1000)
+    pace_bin = np.digitize(paces, edges) - 1  # edges[i] <= pace < edges[i + 1] -> i
+    in_range = (pace_bin >= 0) & (pace_bin < len(labels))
+
+    # Group by (pace bin, month) with one bincount over a combined key
+    month_values, month_index = np.unique(frame.month[running][in_range], return_inverse=True)
+    key = pace_bin[in_range] * len(month_values) + month_index.reshape(-1)
+    size = len(labels) * len(month_values)
+    hr_sum = np.bincount(key, weights=frame.average_heartrate[running][in_range], minlength=size)
+    hr_count = np.bincount(key, minlength=size)
+    hr_sum = hr_sum.reshape(len(labels), -1)
+    hr_count = hr_count.reshape(len(labels), -1)
+
+    return {
+        label: [
+            {"month_year": month_label(month), "bpm": round(float(hr_sum[i, j] / hr_count[i, j]))}
+            for j, month in enumerate(month_values) if hr_count[i, j]
+        ]
+        for i, label in enumerate(labels)
+    }
@@ -1,40 +1,431 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
+import asyncio
+import httpx
+import numpy as np
+import os
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 
-# Function 1: Get raw activities
+from app.models.activities import (
+    get_activities, get_earliest_start_date, get_latest_start_date, get_store_version, get_streams, is_backfilled,
+    mark_backfilled, save_activities, save_stream
+)
+from app.services.cache import activity_cache, response_cache, sync_cache
+from app.services.clusters import cluster_new_routes
+from app.services.heatmap import invalidate_heatmap, update_heatmap
+from app.services.ratelimit import BACKGROUND, INTERACTIVE, RateLimitExceeded, scheduler
+from app.services.stats import ActivityFrame
 
-def get_raw_activities(access_token):
-    base_url = "https://www.strava.com/api/v3"
+BASE_URL = os.getenv("STRAVA_API_URL", "https://www.strava.com/api/v3")
+
+# Number of activity pages requested ahead of the one being consumed
+PAGE_WINDOW = 4
+
+# One pooled session for every Strava call so connections (and TLS) are kept alive
+http = requests.Session()
+http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=PAGE_WINDOW * 4))
+http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=PAGE_WINDOW * 4))
+
+# Async counterpart of `http` for the ASGI chat path, created on first use
+async_http = None
+
+# Seconds to wait for Strava to answer, matching the async client below
+REQUEST_TIMEOUT = 30
+
+# How long (seconds) a call may be deferred by the rate limit scheduler before giving up
+MAX_WAIT = {INTERACTIVE: 10, BACKGROUND: 15 * 60}
+
+# Heart rate streams of newly synced activities are fetched in the background
+STREAM_PREFETCH_DAYS = 35  # Enough for the current week and month
+
+# (athlete id, activity id) of streams with a background download queued
+queued_streams = set()
+queued_streams_lock = threading.Lock()
+
+# Athlete ids with a history backfill running in the background
+queued_backfills = set()
+queued_backfills_lock = threading.Lock()
+
+
+class StravaAPIError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f"{status_code}, {text}")
+        self.status_code = status_code
+        self.text = text
+
+# Every outgoing Strava call goes through here so it respects the rate limits
+
+def strava_request(method, url, priority=INTERACTIVE, retries=3, max_wait=None, **kwargs):
+    deadline = time.monotonic() + (MAX_WAIT[priority] if max_wait is None else max_wait)
+
+    for attempt in range(retries + 1):
+        try:
+            scheduler.acquire(priority, max_wait=deadline - time.monotonic())
+        except RateLimitExceeded as e:
+            raise StravaAPIError(429, str(e))
+
+        response = http.request(method, url, **{"timeout": REQUEST_TIMEOUT, **kwargs})
+        scheduler.update(response.headers, response.status_code)
+        if response.status_code != 429:
+            return response
+
+        # Back off before retrying; the scheduler also holds calls until the quota resets
+        print(f"Strava rate limit hit on {url}, attempt {attempt + 1}")
+        time.sleep(min(0.5 * 2 ** attempt + random.random() * 0.1, max(0, deadline - time.monotonic())))
+
+    return response
+
+# Function 1: Get the authenticated athlete's profile
+
+def get_athlete(access_token, priority=INTERACTIVE):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = strava_request("GET", f"{BASE_URL}/athlete", priority, headers=headers)
+    if response.status_code != 200:
+        raise StravaAPIError(response.status_code, response.text)
+    return response.json()
+
+# Function 2: Fetch every page of /athlete/activities, several pages at a time
+
+class PageWindow:
+    """Speculatively keep pages in flight, but consume them strictly in order. An
+    incremental sync (`after` set) usually fits in one page, so it starts with a
+    single request and widens the window each time a full page comes back.
+    Shared by the threaded and async page fetchers."""
+
+    def __init__(self, params, per_page, window, max_pages=None):
+        self.per_page = per_page
+        self.window = window
+        self.max_pages = max_pages
+        self.next_page = 1
+        self.in_flight = 1 if params.get("after") else window
+        self.last_page_seen = False
+
+    def pages_to_request(self, pending):
+        pages = []
+        while not self.last_page_seen and len(pending) + len(pages) < self.in_flight:
+            if self.max_pages is not None and self.next_page > self.max_pages:
+                break
+            pages.append(self.next_page)
+            self.next_page += 1
+        return pages
+
+    def consume(self, activities):
+        """Account for the next page in order; False once there is nothing more to fetch."""
+        if not activities:
+            return False
+        # A short page is the last one; don't request anything beyond it
+        if len(activities) < self.per_page:
+            self.last_page_seen = True
+        else:
+            self.in_flight = min(self.window, self.in_flight * 2)
+        return True
+
+
+def fetch_activity_pages(headers, params, per_page=200, window=PAGE_WINDOW, priority=INTERACTIVE, on_page=None,
+                         max_pages=None):
+    def fetch_page(page):
+        response = strava_request(
+            "GET",
+            f"{BASE_URL}/athlete/activities",
+            priority,
+            headers=headers,
+            params={**params, "per_page": per_page, "page": page}
+        )
+        if response.status_code != 200:
+            raise StravaAPIError(response.status_code, response.text)
+        return response.json()
+
+    all_activities = []
+    paging = PageWindow(params, per_page, window, max_pages)
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=window)
+    try:
+        while True:
+            for page in paging.pages_to_request(pending):
+                pending[page] = executor.submit(fetch_page, page)
+            if not pending:
+                break
+
+            activities = pending.pop(min(pending)).result()
+            if not paging.consume(activities):
+                break
+            if on_page:
+                on_page(activities)
+            all_activities.extend(activities)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return all_activities
+
+# Function 3: Incrementally sync new activities into the local store
+
+def sync_params(athlete_id):
+    """Paging params for the next sync and the most pages it may fetch."""
+    # Only ask Strava for activities newer than the newest one we already have
+    latest = get_latest_start_date(athlete_id)
+    if latest is None:
+        # Nothing stored yet: the newest page is fetched now, and queue_backfill
+        # pages through the rest of the history in the background
+        return {}, 1
+    # With `after` set Strava returns the oldest activities first, so storing every page
+    # as it arrives lets an interrupted sync continue from the newest stored activity
+    return {"after": latest}, None
+
+
+def activities_synced(access_token, athlete_id, new_activities):
+    """Bring everything derived from the store up to date with newly saved activities."""
+    if not new_activities:
+        return
+    # Answers and heatmap tiles based on the old data are stale now
+    response_cache.pop_where(lambda key: key[0] == athlete_id)
+    invalidate_heatmap(athlete_id)
+    prefetch_hr_streams(access_token, athlete_id, new_activities)
+    queue_route_updates(athlete_id, new_activities)
+
+
+def sync_activities(access_token, athlete_id, priority=INTERACTIVE):
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params, max_pages = sync_params(athlete_id)
+    new_activities = []
+
+    def save_page(activities):
+        save_activities(athlete_id, activities)
+        new_activities.extend(activities)
+
+    try:
+        fetch_activity_pages(headers, params, priority=priority, on_page=save_page, max_pages=max_pages)
+    finally:
+        activities_synced(access_token, athlete_id, new_activities)
+    queue_backfill(access_token, athlete_id)
+    return new_activities
+
+
+def backfill_activities(access_token, athlete_id):
+    """Fetch the history older than the stored activities, at background priority.
+    With `before` set Strava returns the newest activities first, so an interrupted
+    backfill continues from the oldest stored activity next time."""
     headers = {"Authorization": f"Bearer {access_token}"}
+    earliest = get_earliest_start_date(athlete_id)
+    new_activities = []
+
+    def save_page(activities):
+        save_activities(athlete_id, activities)
+        new_activities.extend(activities)
+
+    try:
+        fetch_activity_pages(
+            headers, {} if earliest is None else {"before": earliest}, priority=BACKGROUND, on_page=save_page
+        )
+    finally:
+        activities_synced(access_token, athlete_id, new_activities)
+    mark_backfilled(athlete_id)
+    return new_activities
+
+
+def queue_backfill(access_token, athlete_id):
+    """Backfill the athlete's history on a background thread, unless that's done or under way."""
+    if is_backfilled(athlete_id):
+        return
+    with queued_backfills_lock:
+        if athlete_id in queued_backfills:
+            return
+        queued_backfills.add(athlete_id)
+
+    def backfill():
+        try:
+            backfill_activities(access_token, athlete_id)
+        except Exception as e:
+            # Picked up again after the next sync
+            print(f"Error backfilling activities: {e}")
+        finally:
+            with queued_backfills_lock:
+                queued_backfills.discard(athlete_id)
+
+    # Daemon thread, so a backfill waiting for quota never holds up shutdown
+    threading.Thread(target=backfill, daemon=True).start()
+
+
+def queue_route_updates(athlete_id, new_activities):
+    """Count newly synced routes in the stored heatmap and cluster them, on a background
+    thread. Until that's done, get_heatmap and usual_routes handle whatever they find missing."""
+    def update():
+        try:
+            update_heatmap(athlete_id, new_activities)
+        except Exception as e:
+            print(f"Error updating heatmap: {e}")
+        try:
+            cluster_new_routes(athlete_id, new_activities)
+        except Exception as e:
+            print(f"Error clustering routes: {e}")
+
+    threading.Thread(target=update, daemon=True).start()
+
+# Function 4: Get an athlete's activity frame, shared by the dashboard and chat
+
+def stored_activity_frame(athlete_id, sync_error=None):
+    """Frame of the stored activities, parsed once per store version. Raises sync_error
+    if the sync before it failed and nothing is stored."""
+    version = get_store_version(athlete_id)
+    frame = activity_cache.get((athlete_id, version))
+    if frame is None:
+        frame = ActivityFrame(get_activities(athlete_id))
+        # Frames of older versions are never asked for again
+        activity_cache.pop_where(lambda key: key[0] == athlete_id)
+        activity_cache.set((athlete_id, version), frame)
+
+    if sync_error and not len(frame.ids):
+        raise sync_error
+    return frame
+
+
+def get_activity_frame(access_token, athlete_id, priority=INTERACTIVE):
+    # Syncs at most once per sync_cache TTL; a failed sync is retried on the next call
+    sync_error = None
+    if sync_cache.get(athlete_id) is None:
+        try:
+            sync_activities(access_token, athlete_id, priority)
+            sync_cache.set(athlete_id, True)
+        except StravaAPIError as e:
+            print(f"Error syncing activities: {e.status_code}, {e.text}")
+            sync_error = e
+
+    return stored_activity_frame(athlete_id, sync_error)
+
+# Function 5: Get raw activities (last six months) for the chatbot
+
+def get_raw_activities(access_token, athlete_id=None):
     now = datetime.now()
     six_months_ago = int((now - timedelta(days=180)).timestamp())
 
-    all_activities = []
-    page = 1
-    
-    while True:
-        params = {
-            "after": six_months_ago,
-            "per_page": 200,
-            "page": page
-        }
-
-        response = requests.get(f"{base_url}/athlete/activities", headers=headers, params=params)
-        
+    try:
+        if athlete_id is None:
+            athlete_id = get_athlete(access_token)["id"]
+        frame = get_activity_frame(access_token, athlete_id)
+    except StravaAPIError as e:
+        print(f"Error fetching Strava data: {e.text}")
+        return []
+
+    recent = frame.start > six_months_ago
+    return [act for act, keep in zip(frame.activities, recent) if keep]
+
+# Function 6: Async variants for the ASGI chat path (same cache, store and scheduler)
+
+def get_async_http():
+    global async_http
+    if async_http is None:
+        async_http = httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=httpx.Limits(max_keepalive_connections=PAGE_WINDOW * 4))
+    return async_http
+
+
+async def async_strava_request(method, url, priority=INTERACTIVE, retries=3, **kwargs):
+    deadline = time.monotonic() + MAX_WAIT[priority]
+
+    for attempt in range(retries + 1):
+        try:
+            await scheduler.acquire_async(priority, max_wait=deadline - time.monotonic())
+        except RateLimitExceeded as e:
+            raise StravaAPIError(429, str(e))
+
+        response = await get_async_http().request(method, url, **kwargs)
+        scheduler.update(response.headers, response.status_code)
+        if response.status_code != 429:
+            return response
+
+        print(f"Strava rate limit hit on {url}, attempt {attempt + 1}")
+        await asyncio.sleep(min(0.5 * 2 ** attempt + random.random() * 0.1, max(0, deadline - time.monotonic())))
+
+    return response
+
+
+async def async_fetch_activity_pages(headers, params, per_page=200, window=PAGE_WINDOW, priority=INTERACTIVE, on_page=None,
+                                     max_pages=None):
+    async def fetch_page(page):
+        response = await async_strava_request(
+            "GET",
+            f"{BASE_URL}/athlete/activities",
+            priority,
+            headers=headers,
+            params={**params, "per_page": per_page, "page": page}
+        )
         if response.status_code != 200:
-            print(f"Error fetching Strava data: {response.text}")
-            break
+            raise StravaAPIError(response.status_code, response.text)
+        return response.json()
 
-        activities = response.json()
-        if not activities:  # No more activities to fetch
-            break
-            
-        all_activities.extend(activities)
-        page += 1
+    # Same paging as fetch_activity_pages, with tasks instead of threads
+    all_activities = []
+    paging = PageWindow(params, per_page, window, max_pages)
+    pending = {}
+    try:
+        while True:
+            for page in paging.pages_to_request(pending):
+                pending[page] = asyncio.ensure_future(fetch_page(page))
+            if not pending:
+                break
+
+            activities = await pending.pop(min(pending))
+            if not paging.consume(activities):
+                break
+            if on_page:
+                await on_page(activities)
+            all_activities.extend(activities)
+    finally:
+        for task in pending.values():
+            task.cancel()
 
     return all_activities
 
-# Function 2: Process the raw activities 
+
+async def async_get_activity_frame(access_token, athlete_id, priority=INTERACTIVE):
+    if sync_cache.get(athlete_id) is not None:
+        return await asyncio.to_thread(stored_activity_frame, athlete_id)
+
+    # Store access and building the frame block, so they run in worker threads
+    headers = {"Authorization": f"Bearer {access_token}"}
+    sync_error = None
+    new_activities = []
+
+    async def save_page(activities):
+        await asyncio.to_thread(save_activities, athlete_id, activities)
+        new_activities.extend(activities)
+
+    try:
+        params, max_pages = await asyncio.to_thread(sync_params, athlete_id)
+        try:
+            await async_fetch_activity_pages(headers, params, priority=priority, on_page=save_page, max_pages=max_pages)
+        finally:
+            await asyncio.to_thread(activities_synced, access_token, athlete_id, new_activities)
+        await asyncio.to_thread(queue_backfill, access_token, athlete_id)
+        sync_cache.set(athlete_id, True)
+    except StravaAPIError as e:
+        print(f"Error syncing activities: {e.status_code}, {e.text}")
+        sync_error = e
+
+    return await asyncio.to_thread(stored_activity_frame, athlete_id, sync_error)
+
+
+async def async_get_raw_activities(access_token, athlete_id=None):
+    six_months_ago = int((datetime.now() - timedelta(days=180)).timestamp())
+
+    try:
+        if athlete_id is None:
+            headers = {"Authorization": f"Bearer {access_token}"}
+            response = await async_strava_request("GET", f"{BASE_URL}/athlete", headers=headers)
+            if response.status_code != 200:
+                raise StravaAPIError(response.status_code, response.text)
+            athlete_id = response.json()["id"]
+        frame = await async_get_activity_frame(access_token, athlete_id)
+    except StravaAPIError as e:
+        print(f"Error fetching Strava data: {e.text}")
+        return []
+
+    recent = frame.start > six_months_ago
+    return [act for act, keep in zip(frame.activities, recent) if keep]
+
+# Function 7: Process the raw activities 
 
 def process_activities(raw_activities):
     valid_activities = []
@@ -52,8 +443,10 @@ def process_activities(raw_activities):
             # Extract necessary data
             name = act.get("name", "Unnamed Activity").replace(",", " ")  # Remove commas to avoid CSV issues
             distance = round(act["distance"] / 1000, 1)  # Convert meters to km
-            elevation_gain = act.get("total_elevation_gain", 0)  # Elevation in meters
+            elevation_gain = round(act.get("total_elevation_gain", 0))  # Elevation in meters
             avg_hr = act.get("average_heartrate", "N/A")  # Average heart rate
+            if isinstance(avg_hr, float):
+                avg_hr = round(avg_hr)  # Whole bpm keeps the prompt short
             elapsed_time = round(act["elapsed_time"] / 60, 1)  # Convert seconds to minutes
             
             # Get the activity type from the mapping
@@ -81,4 +474,102 @@ def process_activities(raw_activities):
             print(f"Skipping invalid activity: {act} (Error: {e})")
             continue
 
-    return "\n".join(valid_activities)  # Join all rows into a single string
\ No newline at end of file
+    return "\n".join(valid_activities)  # Join all rows into a single string
+
+# Function 8: Heart rate streams for time-in-zone analysis (fetched once, then stored)
+
+def fetch_hr_stream(access_token, activity_id, priority=INTERACTIVE, max_wait=None):
+    """(time, heartrate) samples of one activity; both empty if it has no heart rate."""
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = strava_request(
+        "GET",
+        f"{BASE_URL}/activities/{activity_id}/streams",
+        priority,
+        max_wait=max_wait,
+        headers=headers,
+        params={"keys": "time,heartrate", "key_by_type": "true"}
+    )
+    if response.status_code == 404:  # Manual entries and deleted activities have no streams
+        return [], []
+    if response.status_code != 200:
+        raise StravaAPIError(response.status_code, response.text)
+
+    streams = response.json()
+    time = streams.get("time", {}).get("data", [])
+    heartrate = streams.get("heartrate", {}).get("data", [])
+    if len(time) != len(heartrate):
+        return [], []
+    return time, heartrate
+
+
+def get_hr_streams(access_token, athlete_id, activity_ids, priority=INTERACTIVE, max_wait=None):
+    """Stored streams for activity_ids, fetching and storing whichever are missing.
+    Once the rate limit says no, the rest is left to a background download and
+    left out of the result."""
+    streams = get_streams(athlete_id, activity_ids)
+    missing = [activity_id for activity_id in activity_ids if activity_id not in streams]
+    if not missing or not access_token:
+        return streams
+
+    def fetch(activity_id):
+        time, heartrate = fetch_hr_stream(access_token, activity_id, priority, max_wait)
+        save_stream(athlete_id, activity_id, time, heartrate)
+        return activity_id, time, heartrate
+
+    # Interactive calls fetch in parallel; background ones are bound by the quota anyway
+    executor = None
+    if priority == INTERACTIVE:
+        executor = ThreadPoolExecutor(max_workers=PAGE_WINDOW)
+        futures = [executor.submit(fetch, activity_id) for activity_id in missing]
+    try:
+        for i, activity_id in enumerate(missing):
+            try:
+                activity_id, time, heartrate = futures[i].result() if executor else fetch(activity_id)
+            except StravaAPIError as e:
+                print(f"Error fetching heart rate stream: {e.status_code}, {e.text}")
+                if e.status_code == 429:
+                    break
+                continue
+            streams[activity_id] = (
+                np.asarray(time, dtype=np.int32), np.asarray(heartrate, dtype=np.int16)
+            )
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    leftover = [activity_id for activity_id in missing if activity_id not in streams]
+    if leftover and priority == INTERACTIVE:
+        queue_hr_streams(access_token, athlete_id, leftover)
+    return streams
+
+
+def queue_hr_streams(access_token, athlete_id, activity_ids):
+    """Download streams at background priority, skipping ones that are already queued."""
+    with queued_streams_lock:
+        keys = {(athlete_id, activity_id) for activity_id in activity_ids} - queued_streams
+        queued_streams.update(keys)
+    if not keys:
+        return
+
+    def download():
+        try:
+            get_hr_streams(access_token, athlete_id, [activity_id for _, activity_id in keys], BACKGROUND)
+        except Exception as e:
+            print(f"Error downloading heart rate streams: {e}")
+        finally:
+            with queued_streams_lock:
+                queued_streams.difference_update(keys)
+
+    # Daemon thread, so a download waiting for quota never holds up shutdown
+    threading.Thread(target=download, daemon=True).start()
+
+
+def prefetch_hr_streams(access_token, athlete_id, new_activities):
+    """Queue stream downloads for recent heart rate activities at background priority."""
+    cutoff = datetime.now() - timedelta(days=STREAM_PREFETCH_DAYS)
+    activity_ids = [
+        act['id'] for act in new_activities
+        if act.get('has_heartrate') and datetime.strptime(act['start_date'], "%Y-%m-%dT%H:%M:%SZ") > cutoff
+    ]
+    if activity_ids:
+        queue_hr_streams(access_token, athlete_id, activity_ids)
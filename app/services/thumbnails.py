@@ -0,0 +1,74 @@
+import hashlib
+import os
+import re
+import tempfile
+
+import numpy as np
+
+from app.services.geo import decode_polyline, simplify
+
+# Static SVG route sketches for the activity list. Files are named after a hash of
+# the polyline and drawing options, so each one is rendered once and never changes.
+
+THUMBNAIL_DIR = os.getenv('THUMBNAIL_DIR', os.path.join('instance', 'thumbnails'))
+# Bump when the drawing below changes, so old files aren't served for new styles
+STYLE_VERSION = 1
+STROKE_COLOR = '#FB5201'
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def thumbnail_digest(encoded, size):
+    return hashlib.sha256(f"{STYLE_VERSION}:{size}:{encoded}".encode('utf-8')).hexdigest()
+
+
+def thumbnail_path(digest):
+    return os.path.join(THUMBNAIL_DIR, f"{digest}.svg")
+
+
+def render_route_svg(points, size=80, padding=6):
+    """SVG markup drawing the route scaled to fit a size x size box."""
+    if len(points) == 0:
+        return f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 {size} {size}"/>'
+
+    # Web Mercator projection, so the shape matches the interactive map
+    x = np.radians(points[:, 1])
+    y = -np.log(np.tan(np.pi / 4 + np.radians(points[:, 0]) / 2))
+
+    span = max(float(np.ptp(x)), float(np.ptp(y)))
+    scale = (size - 2 * padding) / span if span > 0 else 0.0
+    # Centre the route in the box along its shorter side
+    px = padding + (x - x.min()) * scale + ((size - 2 * padding) - float(np.ptp(x)) * scale) / 2
+    py = padding + (y - y.min()) * scale + ((size - 2 * padding) - float(np.ptp(y)) * scale) / 2
+
+    # Anything under half a pixel is invisible at this size
+    pixels = np.column_stack((px, py))
+    pixels = np.round(pixels[simplify(pixels, 0.5)], 1)
+
+    path = "M" + " L".join(f"{x:g} {y:g}" for x, y in pixels.tolist())
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{size}" height="{size}" viewBox="0 0 {size} {size}">'
+        f'<path d="{path}" fill="none" stroke="{STROKE_COLOR}" stroke-width="2" '
+        f'stroke-linecap="round" stroke-linejoin="round"/></svg>'
+    )
+
+
+def write_thumbnail(digest, svg):
+    # Written to a temp file first, so a concurrent request never serves half a file
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=THUMBNAIL_DIR, prefix='.thumb-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(svg)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, thumbnail_path(digest))
+    except Exception:
+        os.remove(temp_path)
+        raise
+
+
+def route_thumbnail(encoded, size=80):
+    """Digest of the SVG thumbnail for an encoded polyline, rendering it on first use."""
+    digest = thumbnail_digest(encoded, size)
+    if not os.path.exists(thumbnail_path(digest)):
+        write_thumbnail(digest, render_route_svg(decode_polyline(encoded), size))
+    return digest
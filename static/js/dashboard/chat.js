@@ -5,6 +5,7 @@ export function initializeChat() {
   const sendButton = document.getElementById("sendButton");
   const chatArea = document.querySelector(".rounded-2xl .flex-1.overflow-y-auto.space-y-4");
   const API_URL = "/api/chat";
+  const STREAM_URL = "/api/chat/stream";
 
   // Update the chat area to prevent horizontal scrolling
   chatArea.style.paddingBottom = "1rem";
@@ -148,31 +149,83 @@ function typewriterEffect(text) {
     showTypingAnimation();
     chatArea.scrollTop = chatArea.scrollHeight;
 
-    const startTime = Date.now();
+    streamResponse(message).catch(() => {
+        hideTypingAnimation();
+        appendAIMessage("Oops! Something went wrong. Please try again.");
+    });
+}
+
+  function createStreamingMessage() {
+    const messageWrapper = document.createElement("div");
+    messageWrapper.className = "flex items-start";
+
+    const avatar = createAvatar();
+    messageWrapper.appendChild(avatar);
+
+    const messageBubble = document.createElement("div");
+    messageBubble.className = "ml-4 max-w-[90%] bg-white border border-[#E7E7E7] rounded-xl py-3 px-4 text-[13px] font-normal fm-inter text-[#374151] whitespace-pre-wrap break-words";
+
+    messageWrapper.appendChild(messageBubble);
+    chatArea.appendChild(messageWrapper);
+    return messageBubble;
+  }
 
-    fetch(API_URL, {
+  // Read the Server-Sent Events from the stream endpoint and render tokens as they arrive
+  async function streamResponse(message) {
+    const response = await fetch(STREAM_URL, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ 
             message, 
             access_token: sessionStorage.getItem("access_token") // Include the token
         }),
-    })
-    .then((res) => res.json())
-    .then((data) => {
-        const timeElapsed = Date.now() - startTime;
-        const minDuration = 1000;
-
-        setTimeout(() => {
-            hideTypingAnimation();
-            typewriterEffect(data.response);
-        }, Math.max(0, minDuration - timeElapsed));
-    })
-    .catch(() => {
-        hideTypingAnimation();
-        appendAIMessage("Oops! Something went wrong. Please try again.");
     });
-}
+
+    // Errors (e.g. no token) come back as plain JSON
+    if (!response.ok || !response.body) {
+      const data = await response.json();
+      hideTypingAnimation();
+      appendAIMessage(data.response);
+      return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let text = "";
+    let messageBubble = null;
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop(); // Keep any incomplete event for the next read
+
+      for (const event of events) {
+        if (event.startsWith("event: done")) continue;
+
+        const dataLine = event.split("\n").find((line) => line.startsWith("data: "));
+        if (!dataLine) continue;
+
+        const { token } = JSON.parse(dataLine.slice(6));
+        if (!messageBubble) {
+          hideTypingAnimation();
+          messageBubble = createStreamingMessage();
+        }
+
+        text += token;
+        messageBubble.textContent = text;
+        chatArea.scrollTop = chatArea.scrollHeight;
+      }
+    }
+
+    if (!messageBubble) {
+      hideTypingAnimation();
+      appendAIMessage("Oops! Something went wrong. Please try again.");
+    }
+  }
 
   chatInput.addEventListener("keydown", (e) => {
     if (e.key === "Enter" && !e.shiftKey) {
@@ -2,6 +2,12 @@
 
 const sportTypeCache = {};
 
+// Preload the stats for every sport filter that were rendered with the page
+const preloadedElement = document.getElementById('weekly-by-sport-data');
+if (preloadedElement) {
+    Object.assign(sportTypeCache, JSON.parse(preloadedElement.textContent));
+}
+
 // Add the button parameter to the function
 export async function applyFilters(button) {
     // Remove active class from all buttons
@@ -18,7 +24,7 @@ export async function applyFilters(button) {
     }
 
     try {
-        const response = await fetch(`/dashboard?sport_type=${sportType}`);
+        const response = await fetch(`/api/weekly-stats?sport_type=${sportType}`);
         const data = await response.json();
         
         // Cache the data
@@ -0,0 +1,39 @@
+// static/js/dashboard/heatmap.js
+
+// All of the athlete's routes at once, drawn as PNG tiles rendered on the server
+export async function initializeHeatmap() {
+    const container = document.getElementById('heatmap');
+    if (!container) {
+        return;
+    }
+
+    try {
+        const response = await fetch('/api/heatmap');
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const heatmap = await response.json();
+
+        if (!heatmap.bounds) {
+            container.textContent = 'No routes to show yet.';
+            return;
+        }
+
+        const map = L.map(container, {
+            maxZoom: heatmap.max_zoom,
+            attributionControl: false // Hide attribution
+        });
+
+        // Muted base map so the routes stand out
+        L.tileLayer('https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png', {
+            attribution: '© OpenStreetMap contributors © CARTO'
+        }).addTo(map);
+
+        // The tile URL includes the heatmap version, so new activities show up after a sync
+        L.tileLayer(heatmap.tiles, { maxZoom: heatmap.max_zoom }).addTo(map);
+
+        map.fitBounds(heatmap.bounds);
+    } catch (error) {
+        console.error('Error loading heatmap:', error);
+    }
+}
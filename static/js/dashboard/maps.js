@@ -1,32 +1,50 @@
 // static/js/dashboard/maps.js
 
+// Each activity starts out as a static route thumbnail; the Leaflet map is only
+// created when the thumbnail is clicked.
 export function initializeMaps(activitiesData) {
 
-    // Loop through the activities and render maps
     activitiesData.forEach((activity, index) => {
-        if (activity.polyline && activity.start_latlng && activity.start_latlng[0] !== 0) {
-            // Dynamically render a small map for each activity
-            const map = L.map(`map-${index + 1}`, {
-                zoomControl: false, // Disable zoom controls
-                dragging: false, // Disable dragging
-                scrollWheelZoom: false, // Disable scroll wheel zoom
-                attributionControl: false // Hide attribution
-            }).setView(activity.start_latlng, 13); // Set initial view based on start_latlng
-
-            // Add OpenStreetMap tiles
-            L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-                attribution: '© OpenStreetMap contributors'
-            }).addTo(map);
-
-            // Decode polyline and add to map
-            const decodedPolyline = polyline.decode(activity.polyline);
-            const polylineLayer = L.polyline(decodedPolyline, { color: '#FB5201', weight: 2 }); // Updated color
-            polylineLayer.addTo(map);
-
-            // Fit map bounds to polyline
-            map.fitBounds(polylineLayer.getBounds());
-        } else {
+        const container = document.getElementById(`map-${index + 1}`);
+        if (!container) {
+            return;
+        }
+
+        if (!activity.start_latlng || activity.start_latlng[0] === 0) {
             console.warn(`No valid polyline or coordinates for activity: ${activity.name}`);
+            return;
         }
+
+        container.addEventListener('click', () => loadInteractiveMap(container, activity), { once: true });
     });
-}
\ No newline at end of file
+}
+
+async function loadInteractiveMap(container, activity) {
+    try {
+        // Route is decoded and simplified on the server for a map of this size
+        const response = await fetch(`/api/routes/${activity.id}?size=${container.clientWidth || 80}`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const route = await response.json();
+
+        container.innerHTML = '';
+        const map = L.map(container, {
+            zoomControl: false, // Disable zoom controls
+            attributionControl: false // Hide attribution
+        }).setView(activity.start_latlng, route.zoom); // Set initial view based on start_latlng
+
+        // Add OpenStreetMap tiles
+        L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+            attribution: '© OpenStreetMap contributors'
+        }).addTo(map);
+
+        const polylineLayer = L.polyline(route.coordinates, { color: '#FB5201', weight: 2 }); // Updated color
+        polylineLayer.addTo(map);
+
+        // Fit map bounds to polyline
+        map.fitBounds(polylineLayer.getBounds());
+    } catch (error) {
+        console.error(`Error loading map for activity: ${activity.name}`, error);
+    }
+}
@@ -0,0 +1,49 @@
+// static/js/dashboard/usualRoutes.js
+
+// Routes the athlete repeats, with how their pace and heart rate have changed
+export async function initializeUsualRoutes() {
+    const list = document.getElementById('usual-routes');
+    if (!list) {
+        return;
+    }
+
+    try {
+        const response = await fetch('/api/usual-routes?limit=5');
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        const { routes } = await response.json();
+
+        if (!routes.length) {
+            list.innerHTML = '<li class="text-base text-gray-500">No repeated routes yet.</li>';
+            return;
+        }
+
+        routes.forEach(route => {
+            const latest = route.activities[route.activities.length - 1];
+            const item = document.createElement('li');
+            item.className = 'flex items-center gap-4';
+            item.innerHTML = `
+                <img src="${route.thumbnail}" alt="" width="80" height="80" loading="lazy" class="w-20 h-20 rounded">
+                <div>
+                    <p class="text-base font-normal mb-1"></p>
+                    <p class="text-base">${route.count}x &nbsp; ${route.distance} km &nbsp; best ${route.best_pace ?? '-'} /km</p>
+                    <p class="text-base text-gray-500">Last ${latest.pace_label ?? '-'} /km${latest.heartrate ? ` at ${Math.round(latest.heartrate)} bpm` : ''}${describeTrend(route.pace_trend, route.heartrate_trend)}</p>
+                </div>`;
+            item.querySelector('p').textContent = route.name; // Activity names are user input
+            list.appendChild(item);
+        });
+    } catch (error) {
+        console.error('Error loading usual routes:', error);
+    }
+}
+
+function describeTrend(paceTrend, heartrateTrend) {
+    if (paceTrend === null) {
+        return '';
+    }
+    // Negative pace trend = faster (fewer seconds per km)
+    const pace = `${Math.abs(paceTrend).toFixed(1)} s/km ${paceTrend <= 0 ? 'faster' : 'slower'}`;
+    const heartrate = heartrateTrend === null ? '' : `, ${heartrateTrend <= 0 ? '' : '+'}${heartrateTrend.toFixed(1)} bpm`;
+    return ` · ${pace}${heartrate} per month`;
+}
@@ -1,4 +1,6 @@
 import { initializeMaps } from '/static/js/dashboard/maps.js';
+import { initializeHeatmap } from '/static/js/dashboard/heatmap.js';
+import { initializeUsualRoutes } from '/static/js/dashboard/usualRoutes.js';
 import { initializeHeartRateTrends } from '/static/js/dashboard/heartRateTrends.js';
 import { initializeWeeklyStats } from '/static/js/dashboard/weeklyStats.js';
 import { initializeChat } from '/static/js/dashboard/chat.js';
@@ -20,6 +22,8 @@ document.addEventListener('DOMContentLoaded', () => {
     // Initialize all dashboard components
     try {
         initializeMaps(activitiesData);
+        initializeHeatmap();
+        initializeUsualRoutes();
         initializeHeartRateTrends();
         initializeWeeklyStats(activitiesData);
         initializeChat();
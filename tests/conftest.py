@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+# Run from anywhere, with placeholder keys: nothing here talks to the real services
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('OPENAI_API_KEY', 'sk-test')
+os.environ.setdefault('SECRET_KEY', 'test')
+
+from app.models import activities  # noqa: E402
+from openai import AsyncOpenAI, OpenAI  # noqa: E402
+
+from app.services import cache, llm, ratelimit, strava  # noqa: E402
+from tests.fake_openai import FakeOpenAI  # noqa: E402
+from tests.fake_strava import FakeStrava, make_activities  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    """A fresh activity store, empty caches and an untouched rate limit budget for every test."""
+    monkeypatch.setattr(activities, 'DB_PATH', str(tmp_path / 'activities.db'))
+    monkeypatch.setattr(activities, 'schema_ready', False)
+    monkeypatch.setattr(strava, 'scheduler', ratelimit.StravaScheduler())
+    for name in ('activity_cache', 'sync_cache', 'response_cache', 'route_cache', 'heatmap_cache', 'tile_cache'):
+        getattr(cache, name).clear()
+    yield activities
+
+
+@pytest.fixture
+def fake_strava(monkeypatch):
+    server = FakeStrava(make_activities(300)).start()
+    monkeypatch.setattr(strava, 'BASE_URL', server.url)
+    # Stream downloads, backfills and route updates run in background threads; tests
+    # that want them call them directly
+    monkeypatch.setattr(strava, 'prefetch_hr_streams', lambda *args: None)
+    monkeypatch.setattr(strava, 'queue_backfill', lambda *args: None)
+    monkeypatch.setattr(strava, 'queue_route_updates', lambda *args: None)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    server = FakeOpenAI().start()
+    monkeypatch.setattr(llm, 'client', OpenAI(api_key='sk-test', base_url=server.url, max_retries=0))
+    monkeypatch.setattr(llm, 'async_client', AsyncOpenAI(api_key='sk-test', base_url=server.url, max_retries=0))
+    yield server
+    server.stop()
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+
+import uvicorn
+
+# Stand-in for OpenAI's chat completions endpoint (plain and streamed), as an ASGI app so
+# it keeps up with load tests. Answers are a fixed sentence, sent one word at a time.
+
+WORDS = ['Great ', 'week! ', 'You ', 'ran ', 'a ', 'lot.\n', 'Keep ', 'going.']
+
+
+class FakeOpenAI:
+    def __init__(self, word_delay=0.0):
+        self.word_delay = word_delay  # Seconds per generated word
+        self.model_delay = {}  # model -> extra seconds before the first word
+        self.failures = {}  # model -> HTTP status it answers with
+        self.break_after = None  # Words streamed before the connection is dropped
+        self.calls = []  # Models called, in order
+        self.server = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        request = json.loads(body or b'{}')
+        model = request.get('model', '')
+        content = request.get('messages', [{}])[-1].get('content', '')
+        self.calls.append(model)
+
+        if model in self.failures:
+            return await self.reply(send, self.failures[model], {'error': {'message': 'Fake failure'}})
+
+        await asyncio.sleep(self.model_delay.get(model, 0))
+        words = ['relevant'] if 'query classifier' in content else WORDS
+        usage = {'prompt_tokens': len(content) // 4, 'completion_tokens': len(words),
+                 'total_tokens': len(content) // 4 + len(words)}
+
+        if not request.get('stream'):
+            await asyncio.sleep(self.word_delay * len(words))
+            return await self.reply(send, 200, {
+                'id': 'fake', 'object': 'chat.completion', 'created': 0, 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(words)},
+                             'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream')]})
+        for i, word in enumerate(words):
+            if i == self.break_after:
+                raise ConnectionResetError("Fake connection drop")
+            await asyncio.sleep(self.word_delay)
+            await self.event(send, {'id': 'fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': model,
+                                    'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}]})
+        if request.get('stream_options', {}).get('include_usage'):
+            await self.event(send, {'id': 'fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': model,
+                                    'choices': [], 'usage': usage})
+        await send({'type': 'http.response.body', 'body': b'data: [DONE]\n\n'})
+
+    @staticmethod
+    async def event(send, data):
+        await send({'type': 'http.response.body', 'body': f"data: {json.dumps(data)}\n\n".encode(), 'more_body': True})
+
+    @staticmethod
+    async def reply(send, status, data):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps(data).encode()})
+
+    @property
+    def url(self):
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}/v1'
+
+    def start(self, port=0):
+        """Serve from a background thread; returns once the port is open."""
+        self.server = uvicorn.Server(uvicorn.Config(self, host='127.0.0.1', port=port, log_level='warning'))
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+
+
+if __name__ == '__main__':
+    # python -m tests.fake_openai [port] [seconds per word]
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8802
+    fake = FakeOpenAI(float(sys.argv[2]) if len(sys.argv) > 2 else 0.05)
+    uvicorn.run(fake, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
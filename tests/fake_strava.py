@@ -0,0 +1,161 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# Stand-in for the parts of the Strava API the app uses, served on a local port.
+# Activities are listed newest first, or oldest first when `after` is given, like Strava.
+# `before` only lists older activities.
+
+ATHLETE_ID = 42
+SPORTS = ['Run', 'Run', 'Ride', 'TrailRun', 'Swim', 'VirtualRide']
+
+
+def make_activities(count, seed=1):
+    """`count` activities, one every 12 hours going back from now (newest first)."""
+    rnd = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    activities = []
+    for i in range(count):
+        start = (now - timedelta(hours=12 * i + 1)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        sport = rnd.choice(SPORTS)
+        distance = rnd.uniform(3000, 40000)
+        activities.append({
+            'id': 1000 + i,
+            'name': f'Activity {i}',
+            'type': 'Run' if 'Run' in sport else sport.replace('Virtual', ''),
+            'sport_type': sport,
+            'distance': distance,
+            'moving_time': int(distance / 3.0),
+            'elapsed_time': int(distance / 2.9),
+            'total_elevation_gain': rnd.uniform(0, 300),
+            'average_heartrate': rnd.uniform(120, 175),
+            'has_heartrate': True,
+            'trainer': False,
+            'start_date': start,
+            'start_date_local': start,
+            'start_latlng': [51.5 + rnd.uniform(-.05, .05), 5.05 + rnd.uniform(-.05, .05)],
+            'map': {'summary_polyline': '_p~iF~ps|U_ulLnnqC_mqNvxq`@'},
+        })
+    return activities
+
+
+def encode_polyline(points):
+    def encode(value):
+        value = ~(value << 1) if value < 0 else value << 1
+        chunks = ''
+        while value >= 0x20:
+            chunks += chr((0x20 | (value & 0x1f)) + 63)
+            value >>= 5
+        return chunks + chr(value + 63)
+
+    encoded, last_lat, last_lng = '', 0, 0
+    for lat, lng in points:
+        lat, lng = round(lat * 1e5), round(lng * 1e5)
+        encoded += encode(lat - last_lat) + encode(lng - last_lng)
+        last_lat, last_lng = lat, lng
+    return encoded
+
+
+def activities_with_routes(count):
+    """make_activities, each following one of four loops (with a little GPS noise)."""
+    rnd = np.random.default_rng(2)
+    loops = [np.cumsum(rnd.normal(0, 4e-4, (300, 2)), axis=0) + [51.55, 5.08] for _ in range(4)]
+    activities = make_activities(count)
+    for i, activity in enumerate(activities):
+        activity['map']['summary_polyline'] = encode_polyline(loops[i % 4] + rnd.normal(0, 2e-5, (300, 2)))
+    return activities
+
+
+def epoch(start_date):
+    return datetime.strptime(start_date, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp()
+
+
+class FakeStravaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        with server.lock:
+            server.calls.append(self.path)
+            calls = len(server.calls)
+        time.sleep(server.latency)
+
+        if server.quota is not None and calls > server.quota:
+            return self.reply(429, {'message': 'Rate Limit Exceeded'}, {'Retry-After': '60'})
+
+        if url.path.endswith('/athlete'):
+            return self.reply(200, {'id': ATHLETE_ID, 'firstname': 'Test', 'lastname': 'Athlete', 'city': 'Tilburg'})
+
+        if url.path.endswith('/athlete/activities'):
+            per_page = int(query.get('per_page', ['30'])[0])
+            page = int(query.get('page', ['1'])[0])
+            activities = server.activities
+            if 'before' in query:
+                before = int(query['before'][0])
+                activities = [act for act in activities if epoch(act['start_date']) < before]
+            if 'after' in query:
+                after = int(query['after'][0])
+                activities = [act for act in reversed(activities) if epoch(act['start_date']) > after]
+            return self.reply(200, activities[(page - 1) * per_page:page * per_page])
+
+        if url.path.endswith('/streams'):
+            activity_id = int(url.path.split('/')[-2])
+            if activity_id % 7 == 0:  # Some activities have no streams
+                return self.reply(404, {'message': 'Record Not Found'})
+            rnd = random.Random(activity_id)
+            time_data, heartrate, second, bpm = [], [], 0, 130
+            for _ in range(1800 + activity_id % 5 * 300):
+                second += 1 if rnd.random() > 0.02 else rnd.randint(2, 120)  # The odd pause
+                bpm = max(90, min(195, bpm + rnd.randint(-2, 2)))
+                time_data.append(second)
+                heartrate.append(bpm)
+            return self.reply(200, {'time': {'data': time_data}, 'heartrate': {'data': heartrate}})
+
+        return self.reply(404, {'message': 'Record Not Found'})
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-RateLimit-Limit', self.server.limit)
+        self.send_header('X-RateLimit-Usage', f'{len(self.server.calls)},{len(self.server.calls)}')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeStrava(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, activities, port=0):
+        super().__init__(('127.0.0.1', port), FakeStravaHandler)
+        self.activities = activities
+        self.calls = []
+        self.lock = threading.Lock()
+        self.latency = 0.0  # Seconds every response is delayed
+        self.quota = None  # Calls answered before everything gets a 429
+        self.limit = '600,30000'  # X-RateLimit-Limit
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/api/v3'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,143 @@
+"""Load test for the ASGI app against the stand-in Strava and OpenAI servers.
+
+    python -m tests.load_chat [--chats 200] [--pages 40] [--word-delay 0.05] [--strava-latency 0.2]
+
+Fires --chats concurrent requests at POST /api/chat and at POST /api/chat/stream
+while --pages Flask page loads (/dashboard) run alongside them through the WSGI
+adapter, and reports status codes and latencies per route.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chats', type=int, default=200, help='concurrent requests per chat route')
+    parser.add_argument('--pages', type=int, default=40, help='concurrent dashboard loads')
+    parser.add_argument('--word-delay', type=float, default=0.05, help='seconds per word from the fake OpenAI')
+    parser.add_argument('--strava-latency', type=float, default=0.2, help='seconds per fake Strava call')
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, root)
+    os.chdir(root)
+
+    # The fake OpenAI runs in its own process, so it doesn't compete with the app for the GIL
+    openai_port = free_port()
+    fake_openai = subprocess.Popen(
+        [sys.executable, '-m', 'tests.fake_openai', str(openai_port), str(args.word_delay)], cwd=root
+    )
+    from tests.fake_strava import FakeStrava, make_activities
+    strava = FakeStrava(make_activities(300)).start()
+    strava.latency = args.strava_latency
+    strava.limit = '100000,1000000'  # Measure the app, not the rate limit scheduler
+
+    store = tempfile.mkdtemp()
+    os.environ.update({
+        'OPENAI_API_KEY': 'sk-test',
+        'OPENAI_BASE_URL': f'http://127.0.0.1:{openai_port}/v1',
+        'STRAVA_API_URL': strava.url,
+        'ACTIVITY_DB_PATH': os.path.join(store, 'activities.db'),
+        'THUMBNAIL_DIR': os.path.join(store, 'thumbnails'),
+        'SECRET_KEY': 'load-test',
+    })
+
+    import httpx
+    import uvicorn
+    from app.asgi import app, flask_app
+    from app.models.activities import is_backfilled
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', backlog=4096))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    for _ in range(100):  # Wait for the fake OpenAI to listen
+        try:
+            socket.create_connection(('127.0.0.1', openai_port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    base = f'http://127.0.0.1:{port}'
+    session = flask_app.session_interface.get_signing_serializer(flask_app).dumps(
+        {'access_token': 'token', 'athlete_id': 42}
+    )
+    cookies = {'session': session}
+
+    async def timed(name, request):
+        started = time.monotonic()
+        response = await request
+        if name == 'chat/stream' and response.status_code == 200 and 'event: done' not in response.text:
+            return name, 'incomplete', time.monotonic() - started
+        return name, response.status_code, time.monotonic() - started
+
+    async def run():
+        async with httpx.AsyncClient(timeout=120, limits=httpx.Limits(max_connections=None)) as client:
+            # Sync the activities once and let the history backfill finish, so the run
+            # measures serving rather than the first sync
+            await client.get(f'{base}/dashboard', cookies=cookies)
+            while not is_backfilled(42):
+                await asyncio.sleep(0.1)
+
+            peak_threads = 0
+            done = asyncio.Event()
+
+            async def watch_threads():
+                nonlocal peak_threads
+                while not done.is_set():
+                    peak_threads = max(peak_threads, threading.active_count())
+                    await asyncio.sleep(0.05)
+
+            requests = []
+            for i in range(args.chats):
+                body = {'message': f'how was my training this week {i}'}
+                requests.append(timed('chat', client.post(f'{base}/api/chat', json=body, cookies=cookies)))
+                requests.append(timed('chat/stream', client.post(f'{base}/api/chat/stream', json=body, cookies=cookies)))
+            for _ in range(args.pages):
+                requests.append(timed('dashboard', client.get(f'{base}/dashboard', cookies=cookies)))
+
+            watcher = asyncio.ensure_future(watch_threads())
+            started = time.monotonic()
+            results = await asyncio.gather(*requests)
+            elapsed = time.monotonic() - started
+            done.set()
+            await watcher
+            return results, elapsed, peak_threads
+
+    try:
+        results, elapsed, peak_threads = asyncio.run(run())
+    finally:
+        server.should_exit = True
+        fake_openai.terminate()
+        strava.stop()
+
+    print(f"{len(results)} requests in {elapsed:.2f}s, peak threads {peak_threads}")
+    for name in ('chat', 'chat/stream', 'dashboard'):
+        latencies = [latency for route, _, latency in results if route == name]
+        statuses = Counter(status for route, status, _ in results if route == name)
+        print(f"  {name:12} {dict(statuses)}  p50 {percentile(latencies, 0.5):.2f}s  "
+              f"p95 {percentile(latencies, 0.95):.2f}s  max {max(latencies, default=0):.2f}s")
+
+
+if __name__ == '__main__':
+    main()
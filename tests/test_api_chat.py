@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+from app import create_app
+from app.routes import api
+from tests.fake_strava import ATHLETE_ID
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.secret_key = 'test'
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['access_token'] = 'token'
+        session['athlete_id'] = ATHLETE_ID
+    return client
+
+
+def test_greeting_loads_no_activities(client, fake_strava, fake_openai):
+    response = client.post('/api/chat', json={"message": "hello"})
+    assert response.status_code == 200
+    assert fake_strava.calls == []
+
+
+def test_relevant_question_uses_the_prefetched_activities(client, fake_strava, fake_openai):
+    response = client.post('/api/chat', json={"message": "how was my training this week"})
+    assert response.json == {"response": "Great week! You ran a lot.\nKeep going."}
+    assert len(fake_strava.calls) == 1  # The newest page of activities
+
+
+def test_prefetch_is_shed_when_the_queue_is_full(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(api, 'chat_prefetch_slots', threading.BoundedSemaphore(2))
+    monkeypatch.setattr(api, 'load_chat_context', lambda *args: release.wait())
+
+    futures = [api.prefetch_chat_context("how far did I run", 'token', ATHLETE_ID) for _ in range(3)]
+    assert futures[2] is None
+    release.set()
+    for future in futures[:2]:
+        future.result(timeout=5)
+    # Slots are handed back once the loads finish
+    assert api.prefetch_chat_context("how far did I run", 'token', ATHLETE_ID).result(timeout=5)
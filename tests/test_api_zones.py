@@ -0,0 +1,41 @@
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.secret_key = 'test'
+    return app.test_client()
+
+
+@pytest.mark.parametrize("body", [
+    {"heart_rates": "150"},
+    {"activity_ids": 5},
+    {"heart_rates": [], "activity_ids": "1,2"},
+    {},
+    [150, 160],
+])
+def test_rejects_anything_but_lists(client, body):
+    assert client.post('/api/calculate-zones', json=body).status_code == 400
+
+
+@pytest.mark.parametrize("body", [{"heart_rates": []}, {"activity_ids": []}])
+def test_empty_batch(client, body):
+    response = client.post('/api/calculate-zones', json=body)
+    assert response.status_code == 200
+    assert response.json == {"zones": []}
+
+
+def test_batch_size_is_checked_on_the_list_provided(client):
+    response = client.post('/api/calculate-zones', json={"heart_rates": [], "activity_ids": [1] * 5001})
+    assert response.status_code == 400
+    response = client.post('/api/calculate-zones', json={"heart_rates": [150] * 5001})
+    assert response.status_code == 400
+
+
+def test_heart_rates(client):
+    response = client.post('/api/calculate-zones', json={"heart_rates": [150, None, "abc"]})
+    assert response.status_code == 200
+    assert len(response.json["zones"]) == 3
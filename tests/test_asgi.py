@@ -0,0 +1,77 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from app.asgi import app, flask_app
+from app.routes import api
+
+MESSAGE = {"message": "how was my training this week"}
+
+
+def post(path, body, session=None):
+    async def request():
+        cookies = {}
+        if session is not None:
+            cookies["session"] = flask_app.session_interface.get_signing_serializer(flask_app).dumps(session)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", cookies=cookies) as client:
+            return await client.post(path, json=body)
+
+    return asyncio.run(request())
+
+
+def stream_tokens(response):
+    events = response.text.split("\n\n")
+    assert events[-2] == "event: done\ndata: {}"
+    return "".join(json.loads(event[len("data: "):])["token"] for event in events[:-2])
+
+
+def test_chat_stream_is_served_natively(fake_strava, fake_openai):
+    response = post("/api/chat/stream", MESSAGE, {"access_token": "token", "athlete_id": 42})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert stream_tokens(response) == "Great week! You ran a lot.\nKeep going."
+
+    # Cached once complete: the next identical question doesn't reach OpenAI
+    calls = len(fake_openai.calls)
+    assert stream_tokens(post("/api/chat/stream", MESSAGE, {"access_token": "token", "athlete_id": 42})) \
+        == "Great week! You ran a lot.\nKeep going."
+    assert len(fake_openai.calls) == calls
+
+
+def test_broken_stream_ends_with_an_error(fake_strava, fake_openai):
+    fake_openai.break_after = 3
+    response = post("/api/chat/stream", MESSAGE, {"access_token": "token", "athlete_id": 42})
+    assert stream_tokens(response).startswith("Great week! You \n\nSorry")
+
+
+def test_chat_stream_needs_a_login():
+    assert post("/api/chat/stream", MESSAGE).status_code == 401
+
+
+def test_other_routes_go_to_flask():
+    response = post("/api/calculate-zones", {"heart_rates": []})
+    assert response.status_code == 200
+    assert response.json() == {"zones": []}
+
+
+def test_flask_routes_run_side_by_side(monkeypatch):
+    def slow_zones(zone_table, heart_rates):
+        time.sleep(0.5)
+        return []
+
+    monkeypatch.setattr(api, "zone_results", slow_zones)
+
+    async def requests():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[
+                client.post("/api/calculate-zones", json={"heart_rates": [150]}) for _ in range(4)
+            ])
+
+    start = time.monotonic()
+    responses = asyncio.run(requests())
+    assert [response.json() for response in responses] == [{"zones": []}] * 4
+    assert time.monotonic() - start < 1.5
@@ -0,0 +1,76 @@
+from app.services import chat
+from app.services.cache import response_cache
+from app.services.chat import PROMPT_PREFIX, PROMPT_TOKEN_BUDGET, QUERY_ERROR, cached_stream, count_tokens, create_prompt, stream_openai
+
+ROWS = [f"Run,Morning run {i},10.0,50,150,5.5,55.0" for i in range(200)]
+CSV = "\n".join(ROWS[:100] + ["Swim,Pool,2.0,0,130,N/A,45.0"] + ROWS[100:])
+
+
+def activity_rows(prompt):
+    return prompt.split("Recent activities:\n", 1)[1].split("\n\nUser question:", 1)[0].split("\n")
+
+
+def test_prompt_fills_the_budget():
+    prompt = create_prompt(CSV, "how was my week?", "Weekly totals")
+    assert prompt.startswith(PROMPT_PREFIX + "\nWeekly totals\n")
+    assert prompt.rstrip().endswith("User question: how was my week?")
+    assert 0.85 * PROMPT_TOKEN_BUDGET < count_tokens(prompt) <= PROMPT_TOKEN_BUDGET
+
+
+def test_failed_tokenizer_download_is_retried_later(monkeypatch):
+    import tiktoken
+
+    clock = [1000.0]
+    monkeypatch.setattr(chat.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(chat, "tokenizer", None)
+    monkeypatch.setattr(chat, "tokenizer_failures", 0)
+    monkeypatch.setattr(chat, "tokenizer_retry_at", 0.0)
+    downloads = []
+
+    def get_encoding(name):
+        downloads.append(name)
+        if len(downloads) == 1:
+            raise ConnectionError("offline")
+        return "encoding"
+
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+    assert chat.get_tokenizer() is None
+    assert chat.get_tokenizer() is None  # Still backing off
+    assert len(downloads) == 1
+    clock[0] += chat.TOKENIZER_RETRY
+    assert chat.get_tokenizer() == "encoding"
+
+
+def test_mentioned_sport_is_included_without_reordering():
+    for question in ("how was my swimming?", "did I swim enough", "when I swam last"):
+        rows = activity_rows(create_prompt(CSV, question, token_budget=600))
+        assert "Swim,Pool,2.0,0,130,N/A,45.0" in rows
+        assert rows[0] == ROWS[0]  # Most recent first, as always
+    assert "Swim,Pool,2.0,0,130,N/A,45.0" not in activity_rows(create_prompt(CSV, "how was my week", token_budget=600))
+
+
+def test_prompts_share_a_prefix_up_to_the_last_rows():
+    # A longer question leaves room for fewer rows, but the ones included are the same
+    first = activity_rows(create_prompt(CSV, "how was my week", "Weekly totals"))
+    second = activity_rows(create_prompt(CSV, "am I doing too much compared to last month", "Weekly totals"))
+    shorter, longer = sorted((first, second), key=len)
+    assert longer[:len(shorter)] == shorter
+
+
+def test_stream_that_breaks_off_is_not_cached(monkeypatch):
+    def broken_stream(stage, messages, **kwargs):
+        yield "Great "
+        yield "week"
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(chat, "stream_complete", broken_stream)
+    tokens = list(cached_stream(("athlete", "answer"), lambda: stream_openai("prompt")))
+    assert tokens == ["Great ", "week", f"\n\n{QUERY_ERROR}"]
+    assert response_cache.get(("athlete", "answer")) is None
+
+
+def test_complete_stream_is_cached(monkeypatch):
+    monkeypatch.setattr(chat, "stream_complete", lambda stage, messages, **kwargs: iter(["Great ", "week!"]))
+    assert list(cached_stream(("athlete", "answer"), lambda: stream_openai("prompt"))) == ["Great ", "week!"]
+    assert response_cache.get(("athlete", "answer")) == "Great week!"
+    assert list(cached_stream(("athlete", "answer"), lambda: stream_openai("prompt"))) == ["Great week!"]
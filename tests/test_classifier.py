@@ -0,0 +1,27 @@
+import pytest
+
+from app.services.classifier import THRESHOLD, classify_locally, score_query
+
+
+@pytest.mark.parametrize("query", [
+    "how do I run a python script",
+    "who won the race for president",
+    "what is the capital of france",
+])
+def test_single_ambiguous_word_goes_to_the_llm(query):
+    assert score_query(query)[1] < THRESHOLD
+    assert classify_locally(query, lambda q: "irrelevant") == "irrelevant"
+
+
+@pytest.mark.parametrize("query, label", [
+    ("how was my training this week", "relevant"),
+    ("how many km did I run last week", "relevant"),
+    ("what's my heart rate zone 2", "relevant"),
+    ("hi there", "greeting"),
+    ("thanks coach", "greeting"),
+])
+def test_clear_queries_are_settled_locally(query, label):
+    def llm_classifier(q):
+        raise AssertionError("LLM called")
+
+    assert classify_locally(query, llm_classifier) == label
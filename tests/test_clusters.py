@@ -0,0 +1,34 @@
+import threading
+import time
+
+from app.models.activities import get_route_clusters, save_activities
+from app.services import clusters, strava
+from app.services.strava import stored_activity_frame
+from tests.fake_strava import ATHLETE_ID, activities_with_routes
+
+# Replaced by a no-op in the fake_strava fixture
+queue_route_updates = strava.queue_route_updates
+
+
+def test_usual_routes_clusters_missing_activities_on_demand():
+    save_activities(ATHLETE_ID, activities_with_routes(40))
+
+    routes = clusters.usual_routes(ATHLETE_ID, stored_activity_frame(ATHLETE_ID))
+    assert routes and all(route["count"] >= 3 for route in routes)
+    assert len(get_route_clusters(ATHLETE_ID)[0]) == 40
+
+
+def test_sync_clusters_new_routes_off_the_request_thread(fake_strava, monkeypatch):
+    fake_strava.activities = activities_with_routes(40)
+    monkeypatch.setattr(strava, 'queue_route_updates', queue_route_updates)
+    threads = []
+    assign = clusters.assign_route_clusters
+    monkeypatch.setattr(clusters, 'assign_route_clusters',
+                        lambda *args: threads.append(threading.current_thread()) or assign(*args))
+
+    strava.sync_activities('token', ATHLETE_ID)
+    deadline = time.monotonic() + 10
+    while get_route_clusters(ATHLETE_ID)[1] and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert len(get_route_clusters(ATHLETE_ID)[0]) == 40
+    assert threads and threading.current_thread() not in threads
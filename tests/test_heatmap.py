@@ -0,0 +1,69 @@
+import threading
+import time
+
+import numpy as np
+
+from app.models.activities import get_heatmap_summary, save_activities
+from app.services import heatmap, strava
+from app.services.cache import heatmap_cache
+from tests.fake_strava import ATHLETE_ID, activities_with_routes
+
+# Replaced by a no-op in the fake_strava fixture
+queue_route_updates = strava.queue_route_updates
+
+
+def test_stored_counts_match_a_single_build(monkeypatch):
+    activities = activities_with_routes(120)
+    monkeypatch.setattr(heatmap, 'BUILD_BATCH', 50)
+    save_activities(ATHLETE_ID, activities[20:])
+
+    first = heatmap.get_heatmap(ATHLETE_ID)
+    assert first.activities == 100
+    heatmap.update_heatmap(ATHLETE_ID, activities[:20])  # A sync
+    assert heatmap.get_heatmap(ATHLETE_ID).version == 120
+
+    expected = heatmap.route_tiles(activities)
+    for (zoom, x, y), (cells, counts) in expected.items():
+        stored_cells, stored_counts = heatmap.get_heatmap_tile(ATHLETE_ID, zoom, x, y)
+        assert np.array_equal(stored_cells, cells) and np.array_equal(stored_counts, counts)
+    assert heatmap.get_heatmap(ATHLETE_ID).level_max == {
+        zoom: max(int(counts.max()) for (z, _, _), (_, counts) in expected.items() if z == zoom)
+        for zoom in range(heatmap.BASE_ZOOM + 1)
+    }
+
+
+def test_restart_does_not_rasterize_again(monkeypatch):
+    save_activities(ATHLETE_ID, activities_with_routes(30))
+    heatmap.get_heatmap(ATHLETE_ID)
+    _, version = heatmap.render_tile(ATHLETE_ID, 3, 4, 2)
+
+    heatmap_cache.clear()
+    monkeypatch.setattr(heatmap, 'route_tiles', lambda activities: (_ for _ in ()).throw(AssertionError))
+    assert heatmap.get_heatmap(ATHLETE_ID).version == version == 30
+    assert heatmap.get_heatmap(ATHLETE_ID).bounds is not None
+
+
+def test_tiles_past_the_base_zoom_are_enlarged():
+    save_activities(ATHLETE_ID, activities_with_routes(10))
+    heatmap.get_heatmap(ATHLETE_ID)
+    x, y = heatmap.project(np.array([[51.55, 5.08]]), heatmap.BASE_ZOOM)
+    tile_x, tile_y = int(x[0]) // 256, int(y[0]) // 256
+    base = heatmap.tile_grid(ATHLETE_ID, heatmap.BASE_ZOOM, tile_x, tile_y)
+    enlarged = heatmap.tile_grid(ATHLETE_ID, heatmap.BASE_ZOOM + 1, tile_x * 2 + 1, tile_y * 2)
+    assert np.array_equal(enlarged[::2, ::2], base[:128, 128:])
+    assert heatmap.tile_grid(ATHLETE_ID, 5, 0, 0) is None
+
+
+def test_sync_counts_new_routes_off_the_request_thread(fake_strava, monkeypatch):
+    fake_strava.activities = activities_with_routes(50)
+    monkeypatch.setattr(strava, 'queue_route_updates', queue_route_updates)
+    threads = []
+    route_tiles = heatmap.route_tiles
+    monkeypatch.setattr(heatmap, 'route_tiles', lambda activities: threads.append(threading.current_thread()) or route_tiles(activities))
+
+    strava.sync_activities('token', ATHLETE_ID)
+    deadline = time.monotonic() + 10
+    while get_heatmap_summary(ATHLETE_ID)[0] < 50 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert get_heatmap_summary(ATHLETE_ID)[0] == 50
+    assert threads and threading.current_thread() not in threads
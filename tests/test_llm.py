@@ -0,0 +1,126 @@
+import asyncio
+import time
+
+import pytest
+from openai import APITimeoutError, InternalServerError
+
+from app.services import llm
+
+MESSAGES = [{"role": "user", "content": "How was my week?"}]
+LARGE, SMALL = llm.MODEL_TIERS["large"], llm.MODEL_TIERS["small"]
+
+
+@pytest.fixture
+def answer_budget(monkeypatch):
+    monkeypatch.setitem(llm.STAGE_ROUTES, "answer", (("large", "small"), 2.0))
+
+
+def test_failed_tier_falls_back_without_retries(fake_openai):
+    fake_openai.failures[LARGE] = 500
+    response = llm.complete("answer", MESSAGES)
+    assert response.choices[0].message.content.startswith("Great")
+    assert fake_openai.calls == [LARGE, SMALL]
+
+    fake_openai.failures[SMALL] = 500
+    with pytest.raises(InternalServerError):
+        llm.complete("answer", MESSAGES)
+    assert fake_openai.calls == [LARGE, SMALL, LARGE, SMALL]
+
+
+def test_slow_tier_leaves_the_rest_of_the_budget_to_the_next(fake_openai, answer_budget):
+    fake_openai.model_delay[LARGE] = 5
+    started = time.monotonic()
+    response = llm.complete("answer", MESSAGES)
+    assert response.model == SMALL
+    assert time.monotonic() - started < 2.0
+
+
+def test_stage_never_runs_past_its_budget(fake_openai, answer_budget):
+    fake_openai.model_delay[LARGE] = fake_openai.model_delay[SMALL] = 5
+
+    started = time.monotonic()
+    with pytest.raises(APITimeoutError):
+        llm.complete("answer", MESSAGES)
+    assert time.monotonic() - started < 2.5
+
+    started = time.monotonic()
+    with pytest.raises(APITimeoutError):
+        asyncio.run(llm.async_complete("answer", MESSAGES))
+    assert time.monotonic() - started < 2.5
+    assert fake_openai.calls == [LARGE, SMALL, LARGE, SMALL]
+
+
+def test_spent_budget_tries_no_further_tiers(fake_openai, monkeypatch):
+    monkeypatch.setitem(llm.STAGE_ROUTES, "answer", (("large", "small"), 1.0))
+    fake_openai.model_delay[LARGE] = 5
+
+    # The first tier's half of the budget leaves no more than the shortest attempt
+    with pytest.raises(APITimeoutError):
+        llm.complete("answer", MESSAGES)
+    assert fake_openai.calls == [LARGE]
+
+
+def test_attempt_timeout_never_drops_below_the_floor():
+    assert llm.attempt_timeout(0.6, 2) == llm.MIN_ATTEMPT_TIMEOUT
+    assert llm.attempt_timeout(-1.0, 1) == llm.MIN_ATTEMPT_TIMEOUT
+    assert llm.attempt_timeout(4.0, 2) == min(2.0, llm.llm_gateway.call_timeout)
+
+
+def test_wakeup_is_passed_on_when_the_woken_waiter_goes_away():
+    gateway = llm.LLMGateway(max_concurrency=1, max_queue=10, queue_timeout=5)
+
+    async def wait_for_slot():
+        async with gateway.async_slot():
+            return time.monotonic()
+
+    async def run():
+        async with gateway.async_slot():
+            first = asyncio.ensure_future(wait_for_slot())
+            second = asyncio.ensure_future(wait_for_slot())
+            await asyncio.sleep(0.05)
+            # The first waiter leaves just as the slot is released: the wakeup goes to
+            # it before it has had a chance to stop waiting
+            first.cancel()
+        released = time.monotonic()
+        return await second - released
+
+    assert asyncio.run(run()) < 0.5
+    assert gateway.in_flight == 0 and gateway.queued == 0 and not gateway._async_waiters
+
+
+def test_waiters_timing_out_during_releases_never_strand_a_free_slot():
+    gateway = llm.LLMGateway(max_concurrency=1, max_queue=1000, queue_timeout=0.01)
+    stranded = []
+
+    async def call():
+        try:
+            async with gateway.async_slot():
+                await asyncio.sleep(0.01)
+        except llm.LLMOverloaded:
+            pass
+
+    async def watch(done):
+        # A free slot with coroutines still waiting for it means a wakeup got lost
+        since = None
+        while not done.is_set():
+            waiting = any(not future.done() for _, future in gateway._async_waiters)
+            if gateway.in_flight < gateway.max_concurrency and waiting:
+                since = since or time.monotonic()
+                if time.monotonic() - since > 0.1:
+                    stranded.append(len(gateway._async_waiters))
+            else:
+                since = None
+            await asyncio.sleep(0.005)
+
+    async def run():
+        done = asyncio.Event()
+        watcher = asyncio.ensure_future(watch(done))
+        for _ in range(20):
+            await asyncio.gather(*[call() for _ in range(30)])
+        done.set()
+        await watcher
+
+    asyncio.run(run())
+    assert not stranded
+    assert gateway.in_flight == 0 and gateway.queued == 0 and not gateway._async_waiters
+    assert gateway.rejected_timeout > 0  # Timeouts did race the releases
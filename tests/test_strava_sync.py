@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from app.models.activities import get_activities, is_backfilled
+from app.services import strava
+from app.services.ratelimit import BACKGROUND
+from tests.fake_strava import ATHLETE_ID, make_activities
+
+# Replaced by a no-op in the fake_strava fixture
+queue_backfill = strava.queue_backfill
+
+
+def stored_ids():
+    return [act['id'] for act in get_activities(ATHLETE_ID)]
+
+
+def test_page_window_starts_small_for_incremental_syncs():
+    paging = strava.PageWindow({"after": 1700000000}, per_page=200, window=4)
+    assert paging.pages_to_request({}) == [1]
+    assert paging.consume([{}] * 200)
+    assert paging.pages_to_request({}) == [2, 3]
+    assert paging.consume([{}] * 10)  # Short page: the last one
+    assert paging.pages_to_request({}) == []
+    assert not paging.consume([])
+
+    backfill = strava.PageWindow({"after": 0}, per_page=200, window=4)
+    assert backfill.pages_to_request({}) == [1, 2, 3, 4]
+
+
+def test_first_sync_stores_newest_page_and_backfills_the_rest(fake_strava):
+    fake_strava.activities = make_activities(1000)
+
+    new_activities = strava.sync_activities('token', ATHLETE_ID)
+    assert len(fake_strava.calls) == 1
+    assert [act['id'] for act in new_activities] == [act['id'] for act in fake_strava.activities[:200]]
+
+    assert len(strava.backfill_activities('token', ATHLETE_ID)) == 800
+    assert sorted(stored_ids()) == sorted(act['id'] for act in fake_strava.activities)
+    assert is_backfilled(ATHLETE_ID)
+    # Nothing new, so the next sync is a single page request
+    calls = len(fake_strava.calls)
+    assert strava.sync_activities('token', ATHLETE_ID) == []
+    assert len(fake_strava.calls) == calls + 1
+
+
+def test_interrupted_backfill_continues_where_it_stopped(fake_strava, monkeypatch):
+    fake_strava.activities = make_activities(1400)
+    strava.sync_activities('token', ATHLETE_ID)
+    fake_strava.quota = 1 + 4  # The first sync and the backfill's first window of pages
+    monkeypatch.setitem(strava.MAX_WAIT, BACKGROUND, 0.5)
+
+    with pytest.raises(strava.StravaAPIError):
+        strava.backfill_activities('token', ATHLETE_ID)
+    # Pages arrive newest first, so what was stored is the newest part of the history
+    saved = stored_ids()
+    assert len(saved) == 1000
+    assert set(saved) == {act['id'] for act in fake_strava.activities[:1000]}
+    assert not is_backfilled(ATHLETE_ID)
+
+    fake_strava.quota = None
+    monkeypatch.setattr(strava, 'scheduler', type(strava.scheduler)())
+    assert len(strava.backfill_activities('token', ATHLETE_ID)) == 400
+    assert sorted(stored_ids()) == sorted(act['id'] for act in fake_strava.activities)
+
+
+def test_dashboard_load_does_not_wait_for_the_backfill(fake_strava, monkeypatch):
+    fake_strava.activities = make_activities(1000)
+    fake_strava.latency = 0.05
+    monkeypatch.setattr(strava, 'queue_backfill', queue_backfill)
+
+    frame = strava.get_activity_frame('token', ATHLETE_ID)
+    assert len(frame.ids) == 200
+
+    deadline = time.monotonic() + 10
+    while not is_backfilled(ATHLETE_ID) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert len(stored_ids()) == 1000
+
+
+def test_failed_sync_falls_back_to_stored_activities(fake_strava):
+    strava.sync_activities('token', ATHLETE_ID)
+    strava.backfill_activities('token', ATHLETE_ID)
+    fake_strava.quota = len(fake_strava.calls)
+
+    frame = strava.get_activity_frame('token', ATHLETE_ID)
+    assert len(frame.ids) == 300
+    # The stored frame is reused, but the sync is tried again next time
+    assert strava.sync_cache.get(ATHLETE_ID) is None
+    assert strava.get_activity_frame('token', ATHLETE_ID) is frame
+
+
+def test_frame_is_parsed_once_per_store_version(fake_strava, monkeypatch):
+    frame = strava.get_activity_frame('token', ATHLETE_ID)
+    calls = len(fake_strava.calls)
+    assert strava.get_activity_frame('token', ATHLETE_ID) is frame
+    assert strava.stored_activity_frame(ATHLETE_ID) is frame
+    assert len(fake_strava.calls) == calls  # Synced recently
+
+    # The backfill stores more activities, so the next call sees them without a sync
+    strava.backfill_activities('token', ATHLETE_ID)
+    newer = strava.get_activity_frame('token', ATHLETE_ID)
+    assert newer is not frame and len(newer.ids) == 300
+    assert len(strava.activity_cache) == 1  # The old version's frame is dropped
+
+
+def test_async_frame_matches_sync_frame(fake_strava):
+    frame = asyncio.run(strava.async_get_activity_frame('token', ATHLETE_ID))
+    strava.activity_cache.clear()
+    strava.sync_cache.clear()
+    assert list(frame.ids) == list(strava.get_activity_frame('token', ATHLETE_ID).ids)
+    assert len(frame.ids) == 200  # The newest page; the rest is left to the backfill